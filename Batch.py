@@ -0,0 +1,169 @@
+"""
+Headless batch processing of HPLC-MS ASCII files, e.g. on Linux processing nodes.
+For every file: parse -> summary -> traces -> peaks -> export (Excel, npz, csv, parquet or arrow),
+files are processed in a process pool.
+Imports no GUI modules (FreeSimpleGUI, Tk, pyplot).
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import configparser
+import glob
+import logging
+import os
+from time import perf_counter
+
+from Constants import DEFAULT_SETTINGS
+from Model.Data import Data
+from Model.ParseCSV import ParseCSV
+from Model.CreateExcel import CreateExcel
+from Model.Export import Export
+from Model.Cache import DatasetCache
+from Model.Signal import SignalConditioner
+
+__all__ = ['Batch', 'BatchResult']
+BatchResult = namedtuple('BatchResult', ['filename', 'size', 'scans', 'peaks', 'seconds', 'result_filename', 'error'])
+
+
+class Batch:
+    """ Batch mode without GUI: analysis of all files of a directory or glob pattern with the same parameters """
+    logger = logging.getLogger().getChild(__name__)
+
+    file_suffixes = ('.ascii', '.txt', '.csv')  # files taken from a directory
+
+    @classmethod
+    def find_files(cls, pattern):
+        """All files of directory 'pattern' with one of 'file_suffixes', else all files matching glob 'pattern'"""
+        if Path(pattern).is_dir():
+            files = [path for path in Path(pattern).iterdir() if path.suffix.lower() in cls.file_suffixes]
+        else:
+            files = [Path(name) for name in glob.glob(pattern, recursive=True)]
+        return sorted(path for path in files if path.is_file())
+
+    @staticmethod
+    def load_settings(settings_filename):
+        """Settings of config file, missing entries are taken from program defaults"""
+        settings = configparser.ConfigParser(allow_no_value=True)
+        settings.read_dict(DEFAULT_SETTINGS)
+        if Path(settings_filename).is_file():
+            settings.read(settings_filename)
+        return settings
+
+    @classmethod
+    def run(cls, pattern, mass=0, mass_interval=0.5, time=0, time_interval=0.4, settings=None, jobs=None,
+            output_folder=None, export=True, export_format='xlsx', export_scans=False):
+        """
+        Process all files of 'pattern' in a pool of 'jobs' processes (default: one per CPU, 1: no pool).
+        Traces are only calculated for mass > 0 and time > 0. Result files ('export_format' 'xlsx' or one of
+        Export.formats, with all scans if 'export_scans') are written to 'output_folder'
+        (default: folder of the source file). Returns a list of BatchResult in order of the files.
+        """
+        if export and export_format != 'xlsx' and export_format not in Export.available_formats():
+            cls.logger.error(f"Export format '{export_format}' is not available, possible formats: "
+                             f"{', '.join(['xlsx'] + Export.available_formats())}")
+            return []
+        files = cls.find_files(pattern)
+        if not files:
+            cls.logger.warning(f"No files found for '{pattern}'.")
+            return []
+        settings = settings or cls.load_settings('config.ini')
+        settings = {section: dict(settings[section]) for section in settings.sections()}  # picklable
+        parameters = {'mass': mass, 'mass_interval': mass_interval, 'time': time, 'time_interval': time_interval,
+                      'output_folder': output_folder, 'export': export, 'export_format': export_format,
+                      'export_scans': export_scans}
+        jobs = min(jobs or os.cpu_count() or 1, len(files))
+        cls.logger.info(f"Batch of {len(files)} files with {jobs} processes.")
+
+        start = perf_counter()
+        work = [(str(filename), settings, parameters) for filename in files]
+        if jobs == 1:
+            results = [_process_file(job) for job in work]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(_process_file, work))
+        cls.report(results, perf_counter() - start)
+        return results
+
+    @classmethod
+    def report(cls, results, seconds):
+        """Log result of every file and throughput of the batch (files/s, MB/s)"""
+        for result in results:
+            if result.error:
+                cls.logger.error(f"{result.filename}: {result.error}")
+            else:
+                cls.logger.log(25, f"{result.filename}: {result.scans} scans, {result.peaks} peaks, "
+                                   f"{result.seconds:.2f} s")
+        megabytes = sum(result.size for result in results) / 1024 / 1024
+        failed = sum(1 for result in results if result.error)
+        seconds = max(seconds, 1e-9)
+        cls.logger.log(25, f"{len(results)} files ({failed} failed), {megabytes:.1f} MB in {seconds:.2f} s: "
+                           f"{len(results) / seconds:.2f} files/s, {megabytes / seconds:.2f} MB/s")
+        return
+
+    @classmethod
+    def process_file(cls, filename, settings, parameters):
+        """Parse, analyze and export one file. Returns BatchResult, errors are returned and not raised."""
+        start = perf_counter()
+        size = Path(filename).stat().st_size
+        try:
+            data = DatasetCache.load_or_parse(filename, DatasetCache.settings_key(settings))
+            if not data:
+                return BatchResult(filename, size, 0, 0, perf_counter() - start, None, "File can not be parsed")
+            summary = Data.get_total_counts(data)
+            mass_trace = None
+            if parameters['mass'] > 0:
+                mass_trace = Data.mass_trace(data, parameters['mass'], parameters['mass_interval'])
+            elution_time_trace = None
+            if parameters['time'] > 0:
+                elution_time_trace = Data.elution_time_trace(data, parameters['time'], parameters['time_interval'],
+                                                             summary=summary)
+
+            # Peaks in 'Counts per time', on the conditioned signal if smoothing or baseline removal is set
+            counts = summary.total_counts_per_time
+            conditioner = SignalConditioner.from_settings(settings)
+            if conditioner is not None:
+                counts = conditioner.apply(counts)
+            lookahead = settings['DATA'].getint('peak_lookahead', fallback=50)
+            max_peaks, min_peaks = Data.peakdetect(counts, summary.elution_times, lookahead=lookahead)
+            peak_table = Data.peak_table(counts, summary.elution_times, max_peaks, min_peaks)
+
+            result_filename = None
+            if parameters['export'] and parameters['export_format'] != 'xlsx':
+                tables = Export.tables(summary, mass_trace, elution_time_trace, peak_table,
+                                       data=data if parameters['export_scans'] else None)
+                metadata = Export.metadata(filename,
+                                           mass=parameters['mass'], mass_interval=parameters['mass_interval'],
+                                           time=parameters['time'], time_interval=parameters['time_interval'])
+                filenames = Export.write(tables, Export.result_basename(filename, parameters['output_folder']),
+                                         parameters['export_format'], metadata=metadata)
+                result_filename = ', '.join(str(name) for name in filenames)
+            elif parameters['export']:
+                result_filename = CreateExcel.result_filename(filename, parameters['output_folder'])
+                modes = CreateExcel.summary_modes(summary,
+                                                  mass_trace=mass_trace,
+                                                  mass=parameters['mass'],
+                                                  mass_interval=parameters['mass_interval'],
+                                                  elution_time_trace=elution_time_trace,
+                                                  time=parameters['time'],
+                                                  time_interval=parameters['time_interval'])
+                CreateExcel.create_excel_file(modes=modes,
+                                              excel_filename=str(result_filename),
+                                              source_filename=filename,
+                                              peak_table=peak_table)
+        except Exception as e:  # one broken file must not stop the batch
+            cls.logger.exception(f"Error in '{filename}'")
+            return BatchResult(filename, size, 0, 0, perf_counter() - start, None, f"{type(e).__name__}: {e}")
+        return BatchResult(filename, size, len(summary.elution_times), len(peak_table.apex_time),
+                           perf_counter() - start, result_filename and str(result_filename), None)
+
+
+def _process_file(job):
+    """Worker of the process pool: apply settings in this process, then process one file"""
+    filename, settings_dict, parameters = job
+    settings = configparser.ConfigParser(allow_no_value=True)
+    settings.read_dict(settings_dict)
+    ParseCSV.apply_settings(settings)
+    ParseCSV.workers = 1  # files are already processed in parallel
+    DatasetCache.apply_settings(settings)
+    Export.apply_settings(settings)
+    return Batch.process_file(filename, settings, parameters)
@@ -4,3 +4,54 @@ VERSION = 'v0.31'
 SETTINGS_FILENAME = 'config.ini'
 # DEFAULT_ASCII_FILE = Path('~/Desktop/PeakExplorer/PeakExplorer/Beispiel_asci.ascii').expanduser()
 DEFAULT_ASCII_FILE = ''
+
+# Program defaults, if config file is missing or empty
+DEFAULT_SETTINGS = {"GUI": {"font_size": "14",
+                            "font_family": "Arial",
+                            "theme": "Reddit",
+                            "last_file": "",
+                            "downsampling": "minmax",
+                            "live_update": "yes",
+                            "live_delay_ms": "150"},
+                    "CSV": {"delimiter": ",",
+                            "decimal": ".",
+                            "encoding": 'utf-8',
+                            "max_chunk_mb": "256",
+                            "chunk_size": "10000",
+                            "workers": "1",
+                            "out_of_core_mb": "2048"},
+                    "CACHE": {"enabled": "yes",
+                              "directory": "",
+                              "max_size_mb": "2048",
+                              "full_hash": "no",
+                              "result_cache_mb": "256"},
+                    "DATA": {"col_retention": "0",
+                             "col_number_masses": "7",
+                             "col_data_starts": "8",
+                             "xic_tolerance": "0.5",
+                             "xic_unit": "Da",
+                             "map_time_bin": "0.05",
+                             "map_mass_bin": "1.0",
+                             "approximate_traces": "no",
+                             "mass_bin_width": "0",
+                             "mass_bin_ppm": "0",
+                             "mass_dtype": "float64",
+                             "count_dtype": "float64",
+                             "offset_dtype": "int64",
+                             "feature_detection": "no",
+                             "feature_mass_bin": "1.0",
+                             "feature_min_sn": "3",
+                             "feature_count": "20",
+                             "peak_lookahead": "50",
+                             "smoothing": "none",
+                             "smoothing_window": "7",
+                             "smoothing_order": "2",
+                             "baseline": "none",
+                             "baseline_window": "101",
+                             "col_meaning":
+                                 'retention time[min], unused, ionisation, device, unused,'
+                                 ' unknown, mass interval, number of masses, mass_space_count'},
+                    "EXPORT": {"format": "none",
+                               "scans": "no",
+                               "chunk_rows": "1000000",
+                               "csv_delimiter": ","}}
@@ -1,16 +1,24 @@
-from os import startfile
+from collections import namedtuple
 from pathlib import Path
 
 import configparser
 import logging
-import matplotlib.pyplot as plt
+import os
+import subprocess
+import sys
+import threading
+import time
 
-from Model.Data import Data
-from Model.ParseCSV import ParseCSV
-from Model.CreateExcel import CreateExcel
+from Constants import DEFAULT_SETTINGS
+# Model modules (and numpy) are imported in the methods, which use them, and not on program start
 
 __all__ = ["Controller"]
 WINDOW_CLOSED = None
+TIMEOUT_EVENT = '__TIMEOUT__'  # event of 'read_all_windows' with timeout, if no other event occurred
+Analysis = namedtuple('Analysis', ['parameters', 'dataset', 'dataset_key', 'summary', 'mass_trace',
+                                   'elution_time_trace', 'max_peaks', 'min_peaks', 'peak_table',
+                                   'conditioned_counts', 'features', 'intensity_map', 'result_filename'])
+XicResult = namedtuple('XicResult', ['dataset', 'dataset_key', 'elution_times', 'xics', 'labels', 'result_filename'])
 
 
 class Controller:
@@ -36,6 +44,7 @@ class Controller:
         self.mass_interval = 0.5  # +- deviation in Dalton
         self.time = 4  # elution time in minutes
         self.time_interval = 0.4  # +- time deviation in minutes
+        self.approximate_traces = False  # traces from binned intensity map
 
         # Loading other settings from config file
         self.settings = None
@@ -53,12 +62,27 @@ class Controller:
         self.output_folder = ""
 
         # Data storage
+        self.dataset = None  # parsed file, kept for further analyses of the same file
+        self.dataset_key = None
         self.summary = None
         self.mass_trace = None
         self.elution_time_trace = None
         self.number_of_entries = None
         self.max_peaks = []
         self.min_peaks = []
+        self.peak_table = None
+        self.conditioned_counts = None  # smoothed and baseline corrected 'total_counts_per_time'
+        self.features = None  # ranked features of untargeted feature detection
+        self.last_analysis = None  # Analysis of the results shown
+
+        # Background analysis: the GUI stays responsive, results of the last analysis stay usable
+        self.worker = None  # thread of the running analysis
+        self.worker_window = None  # window, which receives the progress events of the worker
+        self.cancel_event = threading.Event()
+
+        # Live mode: changes of mass, time and intervals update the plotted traces (debounced)
+        self.live_delay = self.settings['GUI'].getint('live_delay_ms', fallback=150) / 1000
+        self.live_update_due = None  # time (perf_counter) of the pending live update, None: no update pending
 
         Controller.logger.info('Finished.')
         return
@@ -72,26 +96,16 @@ class Controller:
             self.settings.read(self.settings_filename)
         if self.settings and self.settings.sections != []:  # config file is present AND contains correct data
             Controller.logger.info("Loaded from config file!")
+            for section in DEFAULT_SETTINGS:  # sections of newer program versions
+                if not self.settings.has_section(section):
+                    self.settings[section] = DEFAULT_SETTINGS[section]
             if not Path(self.settings['GUI']['last_file']).is_file():
                 self.settings['GUI']['last_file'] = ""
         else:
             Controller.logger.warning(f"Error on config file '{self.settings_filename}'."
                                       f" Program defaults will be used.")
-            settings_dict = {"GUI": {"font_size": "14",
-                                     "font_family": "Arial",
-                                     "theme": "Reddit",
-                                     "last_file": ""},
-                             "CSV": {"delimiter": ",",
-                                     "decimal": ".",
-                                     "encoding": 'utf-8'},
-                             "DATA": {"col_retention": "0",
-                                      "col_number_masses": "7",
-                                      "col_data_starts": "8",
-                                      "col_meaning":
-                                          'retention time[min], unused, ionisation, device, unused,'
-                                          ' unknown, mass interval, number of masses, mass_space_count'}}
             self.settings = configparser.ConfigParser()
-            self.settings.read_dict(settings_dict)
+            self.settings.read_dict(DEFAULT_SETTINGS)
         return
 
     def set_view(self, view):
@@ -99,7 +113,7 @@ class Controller:
         Controller.logger.info(f"{self.set_view.__doc__}")
         self.view = view
 
-        plt.close('all')  # if some windows are still open, close them
+        self.view.close_figures()  # if some windows are still open, close them
 
         if self.settings:
             self.view.update_gui_settings()
@@ -123,26 +137,54 @@ class Controller:
         self.view.move_up_left(self.view.main_window)
         return
 
+    # Events, which are not possible while an analysis is running
+    busy_events = ("-START_BUTTON-", "Öffnen in Excel", "Zielmassen-Liste...", "Cache leeren", "Einstellungen")
+
     def mainloop(self):
         Controller.logger.info('Entering controller mainloop')
         while True:
-            self.window, self.event, self.values = self.view.read_all_windows()
+            self.window, self.event, self.values = self.view.read_all_windows(self.live_update_timeout())
+            if self.event == TIMEOUT_EVENT:
+                self.live_update()
+                continue
 
             if self.event in (WINDOW_CLOSED, "Beenden"):
                 self.window.close()
                 if self.window == self.view.result_window:  # if closing result win, mark as closed
-                    self.view.result_window = None
+                    self.view.result_window_closed()
                 elif self.window == self.view.main_window:  # if closing main win, exit program
                     break
-            if self.event in ("-EXIT1-", "-EXIT2-"):
+            if self.event in ("-EXIT1-", "-EXIT2-", "-EXIT3-", "-EXIT4-"):
                 self.window.close()
                 if self.window == self.view.result_window:  # if closing result win, mark as closed
-                    self.view.result_window = None
+                    self.view.result_window_closed()
+            if self.event == "-PROGRESS-":
+                self.view.show_progress(*self.values["-PROGRESS-"])
+            if self.event == "-ANALYSIS_DONE-":
+                self.analysis_finished(self.values["-ANALYSIS_DONE-"])
+            if self.event == "-XICS_DONE-":
+                self.target_list_finished(self.values["-XICS_DONE-"])
+            if self.event == "-CANCEL-" and self.is_busy():
+                Controller.logger.info("Analysis will be cancelled.")
+                self.cancel_event.set()
+                self.view.show_progress("Abbrechen ...")
+            if self.event in self.busy_events and self.is_busy():
+                self.view.popup(title="Auswertung läuft", text="Bitte warten oder die Auswertung abbrechen.")
+                continue
             if self.event == "Öffnen in Excel":
                 self.create_excel_file()  # generate Excel file
+            if self.event == "-FEATURES-" and self.values["-FEATURES-"]:
+                self.trace_feature(self.values["-FEATURES-"][0])
+            if self.event == "Zielmassen-Liste...":
+                self.target_list_pressed()
+            if self.event == "Cache leeren":
+                from Model.Cache import DatasetCache
+                DatasetCache.clear(self.values['-IN-'])
+                self.view.popup(title="", text="Cache geleert!")
             if self.event == "Über":
                 self.view.about_window()
             if self.event == "Einstellungen":
+                appearance = [self.settings['GUI'].get(item) for item in ('theme', 'font_family', 'font_size')]
                 settings_to_save = self.view.settings_window()
                 if settings_to_save:
                     self.view.update_gui_settings()
@@ -161,10 +203,13 @@ class Controller:
                     self.view.main_window.close()
                     self.view.make_main_window()
                     self.view.move_up_left(self.view.main_window)
-                    if self.view.result_window:
+                    # Result window keeps its figures, it is only created again for a new theme or font
+                    new_appearance = [self.settings['GUI'].get(item) for item in ('theme', 'font_family', 'font_size')]
+                    if self.view.result_window and appearance != new_appearance:
                         self.view.result_window.close()
                         self.view.make_result_window(self.ascii_filename,
-                                                     self.number_of_entries)
+                                                     self.number_of_entries,
+                                                     self.features)
                         # self.view.move_up(self.view.result_window)
                     self.view.main_window["-MASS_INTERVAL-"].update(self.mass_interval)
                     self.view.main_window["-TIME_INTERVAL-"].update(self.time_interval)
@@ -185,10 +230,13 @@ class Controller:
             if self.event == '-MASS-':
                 if not self.is_int(self.values['-MASS-']):
                     self.view.main_window['-MASS-'].update("")
+                self.schedule_live_update()
             if self.event == '-TIME-':
                 if not self.is_int(self.values['-TIME-']):
                     self.view.main_window['-TIME-'].update("")
+                self.schedule_live_update()
             if self.event == "-MASS_INTERVAL_UP-":
+                self.schedule_live_update()
                 if self.mass_interval <= 15.9:
                     self.mass_interval += 0.1
                     self.mass_interval = round(self.mass_interval, 1)
@@ -197,6 +245,7 @@ class Controller:
                     self.mass_interval = 0.1
                     self.view.main_window["-MASS_INTERVAL-"].update(f"{self.mass_interval:0.1f}")
             if self.event == "-MASS_INTERVAL_DOWN-":
+                self.schedule_live_update()
                 if self.mass_interval >= 0.2:
                     self.mass_interval -= 0.1
                     self.mass_interval = round(self.mass_interval, 1)
@@ -205,6 +254,7 @@ class Controller:
                     self.mass_interval = 16.0
                     self.view.main_window["-MASS_INTERVAL-"].update(f"{self.mass_interval:0.1f}")
             if self.event == "-TIME_INTERVAL_UP-":
+                self.schedule_live_update()
                 if self.time_interval <= 0.9:
                     self.time_interval += 0.1
                     self.time_interval = round(self.time_interval, 1)
@@ -212,6 +262,7 @@ class Controller:
                     self.time_interval = 0.1
                 self.view.main_window["-TIME_INTERVAL-"].update(f"{self.time_interval:0.1f}")
             if self.event == "-TIME_INTERVAL_DOWN-":
+                self.schedule_live_update()
                 if self.time_interval >= 0.2:
                     self.time_interval -= 0.1
                     self.time_interval = round(self.time_interval, 1)
@@ -221,11 +272,13 @@ class Controller:
             if self.event == "-START_BUTTON-":
                 self.start_button_pressed()
 
+        self.cancel_event.set()  # a running analysis stops at its next stage
         self.view.main_window.close()  # Close GUI, return to main()
         return
 
     def start_button_pressed(self):
         """ Here the analysis and Excel file generation is controlled. """
+        from Model.Export import Export
         Controller.logger.info('Start button was pressed...')
 
         # Check, if given filepath is valid
@@ -238,6 +291,10 @@ class Controller:
         self.follow_time_trace = True if self.values['-ELUTION_TIME_TRACE-'] else False
         self.show_with_matplot = True if self.values['-MATPLOT-'] else False
         self.open_excel = True if self.values['-EXCEL-'] else False
+        export_format = self.values['-EXPORT_FORMAT-'] or self.view.no_export
+        export_scans = True if self.values['-EXPORT_SCANS-'] else False
+        self.settings['EXPORT']['format'] = export_format
+        self.settings['EXPORT']['scans'] = 'yes' if export_scans else 'no'
         # Convert GUI entries for mass and time to float -> no ValueError here, because of prefiltering
         self.mass = float(self.values['-MASS-'])
         self.time = float(self.values['-TIME-'])
@@ -250,9 +307,109 @@ class Controller:
         Controller.logger.debug(f"{self.follow_mass_trace = }, {self.mass = }, {self.mass_interval = }")
         Controller.logger.debug(f"{self.follow_time_trace = }, {self.time = }, {self.time_interval = }")
 
-        # Start analysis -> Results are stored in instance variables
-        if not self.analysis():
+        # Excel file must be writable before the analysis starts
+        result_filename = None
+        if self.open_excel:
+            result_filename = Path(self.output_folder, self.create_result_filename(self.ascii_filename))
+            if self.result_file_in_use(result_filename):
+                return
+
+        # Parameters of this analysis, GUI entries may change while the worker is running
+        parameters = {'ascii_filename': self.ascii_filename,
+                      'follow_mass_trace': self.follow_mass_trace,
+                      'mass': self.mass,
+                      'mass_interval': self.mass_interval,
+                      'follow_time_trace': self.follow_time_trace,
+                      'time': self.time,
+                      'time_interval': self.time_interval,
+                      'result_filename': result_filename,
+                      'export_format': None if export_format == self.view.no_export else export_format,
+                      'export_scans': export_scans,
+                      'output_folder': self.output_folder}
+        self.set_csv_settings()
+        self.set_cache_settings()
+        Export.apply_settings(self.settings)
+        self.start_worker(parameters)
+        return
+
+    def is_busy(self):
+        """True while an analysis is running in the worker thread"""
+        return self.worker is not None
+
+    def start_worker(self, parameters, worker=None):
+        """
+        Start 'worker' (default: analysis_worker) with 'parameters' in a worker thread,
+        which posts '-PROGRESS-' events and its result event ('-ANALYSIS_DONE-' or '-XICS_DONE-')
+        """
+        from Model.ParseCSV import ParseCSV
+        Controller.logger.info(f"{self.start_worker.__doc__}")
+        self.cancel_event.clear()
+        self.worker_window = self.view.main_window
+        ParseCSV.cancel_event = self.cancel_event
+        ParseCSV.progress = lambda bytes_read, total_bytes, scans: self.worker_window.write_event_value(
+            "-PROGRESS-", ("Einlesen", bytes_read, total_bytes, scans))
+        self.view.set_busy(True)
+        self.worker = threading.Thread(target=worker or self.analysis_worker, args=(parameters,), daemon=True)
+        self.worker.start()
+        return
+
+    def next_stage(self, stage):
+        """ Worker: post 'stage' as progress event, raises ParseCancelled if the analysis was cancelled """
+        from Model.ParseCSV import ParseCancelled
+        if self.cancel_event.is_set():
+            raise ParseCancelled(f"Analysis cancelled before '{stage}'.")
+        self.worker_window.write_event_value("-PROGRESS-", (stage,))
+        return
+
+    def analysis_worker(self, parameters):
+        """
+        Worker thread: analysis, Excel file and export in other formats.
+        Result is posted as event '-ANALYSIS_DONE-' (None on errors)
+        """
+        from Model.ParseCSV import ParseCancelled
+        analysis = None
+        try:
+            analysis = self.analysis(parameters)
+            if analysis and parameters['result_filename']:
+                self.next_stage("Excel-Datei")
+                self.write_excel_file(analysis)
+            if analysis and parameters['export_format']:
+                self.next_stage(f"Export {parameters['export_format']}")
+                self.write_export(analysis)
+        except ParseCancelled as e:
+            Controller.logger.info(f"{e}")
+            if analysis:
+                self.discard_dataset(analysis.dataset)
+            analysis = None
+        except Exception:
+            Controller.logger.exception(f"Error in analysis of '{parameters['ascii_filename']}'")
+            if analysis:
+                self.discard_dataset(analysis.dataset)
+            analysis = None
+        self.worker_window.write_event_value("-ANALYSIS_DONE-", analysis)
+        return
+
+    def stop_worker(self):
+        """ Main thread: the worker has posted its result, GUI is usable again """
+        from Model.ParseCSV import ParseCSV
+        self.worker.join()
+        self.worker = None
+        ParseCSV.progress = None
+        self.view.set_busy(False)
+        return
+
+    def analysis_finished(self, analysis):
+        """ Main thread: take over the results of the worker, open Excel file and show plots """
+        self.stop_worker()
+        if self.cancel_event.is_set():
+            if analysis:
+                self.discard_dataset(analysis.dataset)
+            Controller.logger.info("Analysis cancelled.")
+            self.view.show_progress("Abgebrochen")
+            return
+        if not analysis:
             Controller.logger.error(f"Error in analyzing file content!")
+            self.view.show_progress("Fehler")
             title = 'Dateiformat kann nicht gelesen werden!'
             text = [f"Die Datei\n"
                     f"\n'{Path(self.ascii_filename).name}'",
@@ -261,83 +418,395 @@ class Controller:
             self.view.popup(title, "\n".join(text))
             return
 
-        # Generate Excel file
-        if self.open_excel:
-            self.create_excel_file()
-
-        # Generate Plots
-        fig1, fig2 = self.view.plot_canvas(matplot=self.show_with_matplot,
-                                           summary=self.summary,
-                                           mass=self.mass,
-                                           mass_interval=self.mass_interval,
-                                           mass_trace=self.mass_trace,
-                                           time=self.time,
-                                           time_interval=self.time_interval,
-                                           elution_time_trace=self.elution_time_trace,
-                                           max_peaks=self.max_peaks)
+        # Results of the previous analysis are replaced now
+        self.set_dataset(analysis.dataset, analysis.dataset_key)
+        self.last_analysis = analysis
+        self.summary = analysis.summary
+        self.number_of_entries = len(analysis.dataset)
+        self.mass_trace = analysis.mass_trace
+        self.elution_time_trace = analysis.elution_time_trace
+        self.max_peaks, self.min_peaks = analysis.max_peaks, analysis.min_peaks
+        self.peak_table = analysis.peak_table
+        self.conditioned_counts = analysis.conditioned_counts
+        self.features = analysis.features
+        self.view.show_progress("Fertig")
+
+        if analysis.result_filename:
+            Controller.logger.info("Öffnen der Ergebnis-Exceldatei.")
+            self.open_file(analysis.result_filename)
+        self.show_results()
+        return
+
+    def show_results(self):
+        """ Plots of the last analysis in matplotlib windows or in the result window """
+        parameters = self.last_analysis.parameters
+        self.view.plot_canvas(matplot=self.show_with_matplot,
+                              summary=self.summary,
+                              mass=parameters['mass'],
+                              mass_interval=parameters['mass_interval'],
+                              mass_trace=self.mass_trace,
+                              time=parameters['time'],
+                              time_interval=parameters['time_interval'],
+                              elution_time_trace=self.elution_time_trace,
+                              max_peaks=self.max_peaks,
+                              conditioned_counts=self.conditioned_counts)
+        self.view.plot_heatmap(self.last_analysis.intensity_map, matplot=self.show_with_matplot)
 
         # Show with Matplot
         if self.show_with_matplot:
-            plt.show()
+            self.view.show_figures()
         else:
-            # Show in result window
-            if self.view.result_window:
-                self.view.result_window.close()
-            plt.close('all')
-            self.view.make_result_window(self.ascii_filename,
-                                         self.number_of_entries)
-            self.view.draw_figure(self.view.result_window['-CANVAS1-'].TKCanvas, fig1)
-            self.view.draw_figure(self.view.result_window['-CANVAS2-'].TKCanvas, fig2)
+            # Show in result window, figures and canvases are updated in place
+            self.view.show_result_window(self.ascii_filename,
+                                         self.number_of_entries,
+                                         self.features)
         return
 
-    def set_csv_settings(self):
-        """Set setting for data analysis in Data class"""
-        ParseCSV.delimiter = self.settings['CSV']['delimiter']
-        ParseCSV.decimal = self.settings['CSV']['decimal']
-        ParseCSV.encoding = self.settings['CSV']['encoding']
+    def schedule_live_update(self):
+        """ Live mode: (re)start the delay of the live update, so fast changes are coalesced into one update """
+        # pyplot windows block the event loop until they are closed (plt.show), live mode needs the result window
+        if self.values and self.values.get('-LIVE-') and self.last_analysis is not None \
+                and not self.show_with_matplot:
+            self.live_update_due = time.perf_counter() + self.live_delay
+        return
+
+    def live_update_timeout(self):
+        """Timeout in ms for 'read_all_windows' until the pending live update, None if no update is pending"""
+        if self.live_update_due is None:
+            return None
+        return max(int((self.live_update_due - time.perf_counter()) * 1000), 0)
+
+    def live_update(self):
+        """
+        Live mode: calculate traces for the current mass, time and intervals with the loaded dataset
+        and update the plotted lines. Only traces with changed parameters are calculated.
+        """
+        self.live_update_due = None
+        analysis = self.last_analysis
+        if self.is_busy() or analysis is None or analysis.dataset is not self.dataset:
+            return
+        start = time.perf_counter()
+        parameters = dict(analysis.parameters)
+        mass_trace, elution_time_trace = analysis.mass_trace, analysis.elution_time_trace
+        try:
+            mass = float(self.view.main_window['-MASS-'].get())
+        except ValueError:
+            mass = parameters['mass']
+        try:
+            elution_time = float(self.view.main_window['-TIME-'].get())
+        except ValueError:
+            elution_time = parameters['time']
+
+        if mass_trace is not None and (mass, self.mass_interval) != (parameters['mass'], parameters['mass_interval']):
+            parameters['mass'], parameters['mass_interval'] = mass, self.mass_interval
+            mass_trace = self.compute_mass_trace(self.dataset, mass, self.mass_interval)
+            self.view.update_trace('mass', self.summary.elution_times, mass_trace,
+                                   self.view.mass_trace_label(mass, self.mass_interval))
+        if elution_time_trace is not None \
+                and (elution_time, self.time_interval) != (parameters['time'], parameters['time_interval']):
+            parameters['time'], parameters['time_interval'] = elution_time, self.time_interval
+            elution_time_trace = self.compute_elution_time_trace(self.dataset, self.summary,
+                                                                 elution_time, self.time_interval)
+            self.view.update_trace('time', self.summary.ion_masses, elution_time_trace,
+                                   self.view.time_trace_label(elution_time, self.time_interval))
+        if parameters == analysis.parameters:
+            return
 
-        ParseCSV.col_retention = int(self.settings['DATA']['col_retention'])
-        ParseCSV.col_number_masses = int(self.settings['DATA']['col_number_masses'])
-        ParseCSV.col_data_starts = int(self.settings['DATA']['col_data_starts'])
+        # Excel export of the result window uses the traces shown
+        self.mass_trace, self.elution_time_trace = mass_trace, elution_time_trace
+        self.mass, self.time = parameters['mass'], parameters['time']
+        self.last_analysis = analysis._replace(parameters=parameters, mass_trace=mass_trace,
+                                               elution_time_trace=elution_time_trace)
+        Controller.logger.debug(f"Live update in {(time.perf_counter() - start) * 1000:.1f} ms.")
         return
 
-    def analysis(self):
-        Controller.logger.info('Data analysis starts.')
-        # Set settings for ParseCSV module
+    def compute_mass_trace(self, data, mass, mass_interval):
+        """Mass trace of 'data' (from ResultCache, if already calculated)"""
+        from Model.Data import Data
+        from Model.ResultCache import ResultCache
+        return ResultCache.get_or_compute(
+            data, 'mass_trace', (mass, mass_interval, self.approximate_traces),
+            lambda: Data.mass_trace(data=data,
+                                    mass=mass,
+                                    mass_interval=mass_interval,
+                                    approximate=self.approximate_traces))
+
+    def compute_elution_time_trace(self, data, summary, time, time_interval):
+        """Elution time trace of 'data' (from ResultCache, if already calculated)"""
+        from Model.Data import Data
+        from Model.ResultCache import ResultCache
+        return ResultCache.get_or_compute(
+            data, 'elution_time_trace', (time, time_interval, self.approximate_traces),
+            lambda: Data.elution_time_trace(data=data,
+                                            time=time,
+                                            time_interval=time_interval,
+                                            summary=summary,
+                                            approximate=self.approximate_traces))
+
+    def trace_feature(self, index):
+        """ Follow the mass trace of feature 'index': set mass and interval in main window and start again """
+        mass = float(self.features.mass[index])
+        feature_mass_bin = self.settings['DATA'].getfloat('feature_mass_bin', fallback=1.0)
+        Controller.logger.info(f"Tracing feature {index}: {mass:g} Da at {self.features.retention_time[index]:.2f} min")
+        self.mass = mass
+        self.mass_interval = min(max(round(feature_mass_bin / 2, 1), 0.1), 16.0)
+        self.view.main_window["-MASS-"].update(f"{mass:g}")
+        self.view.main_window["-MASS_INTERVAL-"].update(f"{self.mass_interval:0.1f}")
+        self.view.main_window["-MASS_TRACE-"].update(True)
+        self.view.main_window["-MASS_FRAME-"].update(visible=True)
+        self.view.main_window.write_event_value("-START_BUTTON-", None)  # values are read from main window
+        return
+
+    def target_list_pressed(self):
+        """ Extract XICs for all masses of a target list in the worker: overlaid plot and optional Excel file """
+        Controller.logger.info(f"{self.target_list_pressed.__doc__}")
+        if not Path(self.values['-IN-']).is_file():
+            self.view.main_window['-IN-'].update('')
+            return
+        target_filename = self.view.get_target_list_filename()
+        if not target_filename or not Path(target_filename).is_file():
+            return
+        self.ascii_filename = self.values['-IN-']
+        self.output_folder = Path(self.ascii_filename).parent
+        self.open_excel = True if self.values['-EXCEL-'] else False
+        result_filename = None
+        if self.open_excel:
+            result_filename = Path(self.output_folder, f'HPLC_MS_{Path(self.ascii_filename).name}_XIC.xlsx')
+            if self.is_file_in_use(result_filename):
+                result_filename = None
+
         self.set_csv_settings()
+        self.set_cache_settings()
+        parameters = {'ascii_filename': self.ascii_filename,
+                      'target_filename': target_filename,
+                      'result_filename': result_filename}
+        self.start_worker(parameters, worker=self.target_list_worker)
+        return
 
-        # Read CSV file
-        data = ParseCSV.read_csv_file(self.ascii_filename)
-        if not data:
+    def target_list_worker(self, parameters):
+        """
+        Worker thread: read target list, load file, extract XICs and write the optional Excel file.
+        Result is posted as event '-XICS_DONE-' (XicResult, None on errors)
+        """
+        import numpy as np
+        from Model.CreateExcel import CreateExcel
+        from Model.Data import Data
+        from Model.ParseCSV import ParseCSV, ParseCancelled
+        result = None
+        data = None
+        try:
+            masses, tolerances = ParseCSV.read_target_list(parameters['target_filename'])
+            if masses:
+                self.next_stage("Datei laden")
+                data, key = self.load_dataset(parameters['ascii_filename'])
+            if data:
+                self.next_stage("XICs")
+                unit = self.settings['DATA'].get('xic_unit', fallback='Da')
+                if tolerances is None:
+                    tolerances = self.settings['DATA'].getfloat('xic_tolerance', fallback=0.5)
+                xics = Data.extract_xics(data, masses, tolerances, unit=unit)
+                labels = [f"{mass}±{tolerance} {unit}"
+                          for mass, tolerance in zip(masses, np.broadcast_to(tolerances, len(masses)))]
+                if parameters['result_filename']:
+                    self.next_stage("Excel-Datei")
+                    CreateExcel.create_xic_file(data.elution_times, xics, labels,
+                                                excel_filename=parameters['result_filename'],
+                                                source_filename=parameters['ascii_filename'])
+                result = XicResult(data, key, data.elution_times, xics, labels, parameters['result_filename'])
+        except ParseCancelled as e:
+            Controller.logger.info(f"{e}")
+            self.discard_dataset(data)
+        except Exception:
+            Controller.logger.exception(f"Error in XIC extraction of '{parameters['ascii_filename']}'")
+            self.discard_dataset(data)
+        self.worker_window.write_event_value("-XICS_DONE-", result)
+        return
+
+    def target_list_finished(self, result):
+        """ Main thread: take over the dataset of the worker, open Excel file and plot the XICs """
+        self.stop_worker()
+        if self.cancel_event.is_set():
+            if result:
+                self.discard_dataset(result.dataset)
+            Controller.logger.info("XIC extraction cancelled.")
+            self.view.show_progress("Abgebrochen")
+            return
+        if not result:
+            self.view.show_progress("Fehler")
+            self.view.popup('Zielmassen-Liste', 'Zielmassen oder Datei können nicht gelesen werden.')
+            return
+        self.set_dataset(result.dataset, result.dataset_key)
+        self.view.show_progress("Fertig")
+        if result.result_filename:
+            self.open_file(result.result_filename)
+        self.view.plot_xics(result.elution_times, result.xics, result.labels)
+        self.view.show_figures()
+        return
+
+    def set_csv_settings(self):
+        """Set setting for data analysis in Data class"""
+        from Model.IntensityMap import IntensityMap
+        from Model.ParseCSV import ParseCSV
+        ParseCSV.apply_settings(self.settings)
+
+        IntensityMap.time_bin = self.settings['DATA'].getfloat('map_time_bin', fallback=IntensityMap.time_bin)
+        IntensityMap.mass_bin = self.settings['DATA'].getfloat('map_mass_bin', fallback=IntensityMap.mass_bin)
+        self.approximate_traces = self.settings['DATA'].getboolean('approximate_traces', fallback=False)
+        return
+
+    def set_cache_settings(self):
+        """Set settings for the on-disk cache of parsed files and the in-memory cache of results"""
+        from Model.Cache import DatasetCache
+        from Model.ResultCache import ResultCache
+        if not self.settings.has_section('CACHE'):
             return
+        DatasetCache.apply_settings(self.settings)
+        ResultCache.max_size_mb = self.settings['CACHE'].getint('result_cache_mb', fallback=ResultCache.max_size_mb)
+        return
 
+    def cache_key_settings(self):
+        """Settings which change the parse result and therefore belong to the cache key"""
+        from Model.Cache import DatasetCache
+        return DatasetCache.settings_key(self.settings)
+
+    def analysis(self, parameters):
+        """
+        Worker: load file and analyze it with 'parameters' (dict of start_button_pressed).
+        Returns Analysis or None if the file can not be parsed. Raises ParseCancelled if cancelled.
+        Instance variables are not changed, results of the previous analysis stay usable.
+        """
+        from Model.ParseCSV import ParseCancelled
+        Controller.logger.info('Data analysis starts.')
+        self.next_stage("Datei laden")
+        data, dataset_key = self.load_dataset(parameters['ascii_filename'])
+        if self.cancel_event.is_set():
+            raise ParseCancelled("Analysis cancelled while parsing.")
+        if not data:
+            return None
+        try:
+            return self.analyze_dataset(parameters, data, dataset_key)
+        except BaseException:
+            self.discard_dataset(data)  # results of a dataset, which is not taken over, are never used
+            raise
+
+    def analyze_dataset(self, parameters, data, dataset_key):
+        """Worker: analysis of the loaded 'data' with 'parameters', returns Analysis"""
+        from Model.Data import Data
+        from Model.Dataset import Dataset
+        from Model.ResultCache import ResultCache
         # Get 'Counts per time' and 'Counts per mass'
         Controller.logger.info(f"{len(data)} lines found in file.")
-        self.number_of_entries = len(data)
-        self.summary = Data.get_total_counts(data)
+        self.next_stage("Summen")
+        summary = self.summary if data is self.dataset and self.summary is not None else Data.get_total_counts(data)
 
         # Extract mass trace
-        if self.follow_mass_trace:
-            self.mass_trace = Data.mass_trace(data=data,
-                                              mass=self.mass,
-                                              mass_interval=self.mass_interval)
-            if self.mass_trace:
-                Controller.logger.debug(f"Mass trace entries: {len(self.mass_trace)}")
+        mass, mass_interval = parameters['mass'], parameters['mass_interval']
+        mass_trace = None
+        if parameters['follow_mass_trace']:
+            self.next_stage("Massenspur")
+            mass_trace = self.compute_mass_trace(data, mass, mass_interval)
+            if mass_trace is not None:
+                Controller.logger.debug(f"Mass trace entries: {len(mass_trace)}")
 
         # Extract elution time trace
-        if self.follow_time_trace:
-            self.elution_time_trace = Data.elution_time_trace(data=data,
-                                                              time=self.time,
-                                                              time_interval=self.time_interval)
-            if self.elution_time_trace:
-                Controller.logger.debug(f"Time trace entries: {len(self.elution_time_trace)}")
+        time, time_interval = parameters['time'], parameters['time_interval']
+        elution_time_trace = None
+        if parameters['follow_time_trace']:
+            self.next_stage("Zeitspur")
+            elution_time_trace = self.compute_elution_time_trace(data, summary, time, time_interval)
+            if elution_time_trace is not None:
+                Controller.logger.debug(f"Time trace entries: {len(elution_time_trace)}")
+
+        # Smoothing and baseline removal before peak detection
+        self.next_stage("Peaks")
+        lookahead = self.settings['DATA'].getint('peak_lookahead', fallback=50)
+        conditioner = self.signal_conditioner()
+        counts = summary.total_counts_per_time
+        conditioned_counts = None
+        if conditioner is not None:
+            conditioned_counts = ResultCache.get_or_compute(
+                data, 'condition', ('total_counts_per_time', repr(conditioner)),
+                lambda: conditioner.apply(summary.total_counts_per_time))
+            counts = conditioned_counts
 
         # Get Peaks in 'Counts per time' graph
-        self.max_peaks, self.min_peaks = Data.peakdetect(y_axis=self.summary.total_counts_per_time,
-                                                               x_axis=self.summary.elution_times,
-                                                               lookahead=50, delta=0)
+        max_peaks, min_peaks = ResultCache.get_or_compute(
+            data, 'peakdetect', ('total_counts_per_time', repr(conditioner), lookahead, 0),
+            lambda: Data.peakdetect(y_axis=counts,
+                                    x_axis=summary.elution_times,
+                                    lookahead=lookahead, delta=0))
+        peak_table = Data.peak_table(y_axis=counts,
+                                     x_axis=summary.elution_times,
+                                     max_peaks=max_peaks,
+                                     min_peaks=min_peaks)
+        Controller.logger.debug(f"Peak table entries: {len(peak_table.apex_time)}")
+
+        # Untargeted feature detection in all m/z bins (needs all XICs, so not for files larger than memory)
+        features = None
+        if not self.settings['DATA'].getboolean('feature_detection', fallback=False):
+            Controller.logger.debug("Feature detection switched off ([DATA] feature_detection).")
+        elif isinstance(data, Dataset):
+            self.next_stage("Features")
+            feature_mass_bin = self.settings['DATA'].getfloat('feature_mass_bin', fallback=1.0)
+            feature_min_sn = self.settings['DATA'].getfloat('feature_min_sn', fallback=3.0)
+            feature_count = self.settings['DATA'].getint('feature_count', fallback=20)
+            features = ResultCache.get_or_compute(
+                data, 'find_features', (feature_mass_bin, lookahead, feature_min_sn, feature_count, repr(conditioner)),
+                lambda: Data.find_features(data, mass_bin=feature_mass_bin, lookahead=lookahead,
+                                           min_signal_to_noise=feature_min_sn, max_features=feature_count,
+                                           conditioner=conditioner))
+            Controller.logger.debug(f"Features found: {len(features.mass)}")
+        else:
+            Controller.logger.info("No feature detection for chunk stores.")
+
+        # Heatmap is built here, so the main thread only has to draw it (not for files larger than memory)
+        intensity_map = None
+        if isinstance(data, Dataset):
+            self.next_stage("Heatmap")
+            intensity_map = data.intensity_map
         Controller.logger.info(f"Data analysis finished.")
-        return True
+        return Analysis(parameters, data, dataset_key, summary, mass_trace, elution_time_trace,
+                        max_peaks, min_peaks, peak_table, conditioned_counts, features, intensity_map,
+                        parameters['result_filename'])
+
+    def signal_conditioner(self):
+        """SignalConditioner from [DATA] settings, None if neither smoothing nor baseline removal is set"""
+        from Model.Signal import SignalConditioner
+        return SignalConditioner.from_settings(self.settings)
+
+    def load_dataset(self, ascii_filename):
+        """
+        Returns (Dataset, key) of 'ascii_filename': the already loaded one, if file and parse settings are unchanged,
+        else from the on-disk cache or parsed with the columnar engine (tuple format: ParseCSV.read_csv_file).
+        Files larger than 'out_of_core_mb' are parsed into a ChunkStore on disk, which is returned instead.
+        Dataset is None, if errors occur.
+        """
+        from Model.Cache import DatasetCache
+        stat = Path(ascii_filename).stat()
+        key = (str(Path(ascii_filename).resolve()), stat.st_size, stat.st_mtime_ns,
+               tuple(sorted(self.cache_key_settings().items())))
+        if self.dataset is not None and key == self.dataset_key:
+            Controller.logger.info("Dataset is already loaded.")
+            return self.dataset, key
+        return DatasetCache.load_or_parse(ascii_filename, self.cache_key_settings()), key
+
+    def set_dataset(self, data, key):
+        """Keep 'data' as loaded dataset for further analyses of the same file"""
+        from Model.ResultCache import ResultCache
+        if data is self.dataset:
+            return
+        if self.dataset is not None:
+            ResultCache.invalidate(self.dataset)  # results of the previous dataset are outdated
+        self.dataset, self.dataset_key = data, key
+        self.summary = None  # Summary of the previous dataset is outdated
+        return
+
+    def discard_dataset(self, data):
+        """Remove cached results of 'data', if it is not the loaded dataset (failed or cancelled analysis)"""
+        from Model.ResultCache import ResultCache
+        if data is not None and data is not self.dataset:
+            ResultCache.invalidate(data)
+        return
 
     @staticmethod
     def is_file_in_use(filename):
@@ -361,9 +830,8 @@ class Controller:
     @staticmethod
     def create_result_filename(filename):
         """Creating result filename: (Path/)HPLC_MS_filename.xlsx"""
-        path = Path(filename).parent
-        name = f'HPLC_MS_{Path(filename).name}.xlsx'
-        return Path(path, name)
+        from Model.CreateExcel import CreateExcel
+        return CreateExcel.result_filename(filename)
 
     def set_model(self, model):
         """Setting model for controller"""
@@ -371,47 +839,84 @@ class Controller:
         self.model = model
 
     def create_excel_file(self):
-        """Create excel-file. Existing file with same name will be overwritten."""
+        """Create excel-file of the last analysis. Existing file with same name will be overwritten."""
         Controller.logger.info(f"{self.create_excel_file.__doc__}")
-        result_filename = self.create_result_filename(self.ascii_filename)
+        if self.last_analysis is None:
+            return
+        result_filename = self.create_result_filename(self.last_analysis.parameters['ascii_filename'])
         Controller.logger.info(f"{result_filename = }")
-
-        # Check if file is in use
-        if self.is_file_in_use(result_filename):
-            title = 'Datei bereits geöffnet!'
-            text = f"Die Datei\n\n{Path(result_filename).name}\n\nist bereits in einer anderen Anwendung geöffnet.\n" + \
-                   "Bitte schließen diese Anwendung.\n"
-            self.view.popup(title, text)
+        if self.result_file_in_use(result_filename):
             return
+        self.write_excel_file(self.last_analysis._replace(result_filename=result_filename))
 
-        # Generation of Result-Excel-File
-        Controller.logger.info(f"Generation of Excel file:")
-        data1 = list(zip(self.summary.elution_times, self.summary.total_counts_per_time, self.mass_trace))\
-            if self.mass_trace \
-            else list(zip(self.summary.elution_times, self.summary.total_counts_per_time))
-
-        data2 = list(zip(self.summary.ion_masses, self.summary.total_counts_per_mass, self.elution_time_trace)) \
-            if self.elution_time_trace\
-            else list(zip(self.summary.ion_masses, self.summary.total_counts_per_mass))
+        Controller.logger.info("Öffnen der Ergebnis-Exceldatei.")
+        self.open_file(result_filename)
+        return
 
-        modes = {"counts_per_time": {"data": data1, "trace": 0, "deviation": 0.0},
-                 "counts_per_mass": {"data": data2, "trace": 0, "deviation": 0.0}
-                 }
-        if self.follow_mass_trace:
-            modes["counts_per_time"]["trace"] = self.mass
-            modes["counts_per_time"]["deviation"] = self.mass_interval
+    def result_file_in_use(self, result_filename):
+        """True (with message to user), if 'result_filename' is opened in another application"""
+        if not self.is_file_in_use(result_filename):
+            return False
+        title = 'Datei bereits geöffnet!'
+        text = f"Die Datei\n\n{Path(result_filename).name}\n\nist bereits in einer anderen Anwendung geöffnet.\n" + \
+               "Bitte schließen diese Anwendung.\n"
+        self.view.popup(title, text)
+        return True
 
-        if self.follow_time_trace:
-            modes["counts_per_mass"]["trace"] = self.time
-            modes["counts_per_mass"]["deviation"] = self.time_interval
+    @staticmethod
+    def write_excel_file(analysis):
+        """Write results of 'analysis' to 'analysis.result_filename' (called in main thread or worker)"""
+        from Model.CreateExcel import CreateExcel
+        Controller.logger.info(f"Generation of Excel file:")
+        parameters = analysis.parameters
+        modes = CreateExcel.summary_modes(analysis.summary,
+                                          mass_trace=analysis.mass_trace,
+                                          mass=parameters['mass'],
+                                          mass_interval=parameters['mass_interval'],
+                                          elution_time_trace=analysis.elution_time_trace,
+                                          time=parameters['time'],
+                                          time_interval=parameters['time_interval'])
 
         Controller.logger.info(f"Aufruf '{CreateExcel.create_excel_file.__name__}':")
         CreateExcel.create_excel_file(modes=modes,
-                                      excel_filename=Path(self.output_folder, result_filename),
-                                      source_filename=self.ascii_filename)
+                                      excel_filename=analysis.result_filename,
+                                      source_filename=parameters['ascii_filename'],
+                                      peak_table=analysis.peak_table)
+        return
+
+    @staticmethod
+    def write_export(analysis):
+        """Export results of 'analysis' (and all scans, if 'export_scans') in 'export_format' of its parameters"""
+        from Model.Export import Export
+        parameters = analysis.parameters
+        Controller.logger.info(f"Export '{parameters['export_format']}' of '{parameters['ascii_filename']}'")
+        tables = Export.tables(analysis.summary,
+                               mass_trace=analysis.mass_trace,
+                               elution_time_trace=analysis.elution_time_trace,
+                               peak_table=analysis.peak_table,
+                               data=analysis.dataset if parameters['export_scans'] else None)
+        metadata = Export.metadata(parameters['ascii_filename'],
+                                   mass=parameters['mass'] if analysis.mass_trace is not None else 0,
+                                   mass_interval=parameters['mass_interval'],
+                                   time=parameters['time'] if analysis.elution_time_trace is not None else 0,
+                                   time_interval=parameters['time_interval'])
+        return Export.write(tables,
+                            Export.result_basename(parameters['ascii_filename'], parameters['output_folder']),
+                            parameters['export_format'],
+                            metadata=metadata)
 
-        Controller.logger.info(f"Öffnen der Ergebnis-Exceldatei.")
-        startfile(result_filename)
+    @staticmethod
+    def open_file(filename):
+        """Open file with the default application of the operating system (os.startfile exists only on Windows)"""
+        try:
+            if sys.platform == 'win32':
+                os.startfile(filename)
+            elif sys.platform == 'darwin':
+                subprocess.Popen(['open', str(filename)])
+            else:
+                subprocess.Popen(['xdg-open', str(filename)])
+        except OSError as e:
+            Controller.logger.warning(f"Datei '{filename}' kann nicht geöffnet werden: {e}")
         return
 
 
@@ -0,0 +1,231 @@
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+
+from Model.Dataset import Dataset, MassBinning
+from Model.ChunkStore import ChunkStore
+from Model.ParseCSV import ParseCSV
+
+__all__ = ['DatasetCache']
+
+
+class DatasetCache:
+    """
+    Persistent on-disk cache for parsed acquisitions.
+    Every entry is a directory with one '.npy' file per Dataset array (loaded memory-mapped)
+    and 'meta.json' (binned masses are stored as integer bins, binning in 'meta.json'),
+    or a ChunkStore for files larger than memory ('store_' entries with 'index.json').
+    Entries are evicted in LRU order when the cache exceeds 'max_size_mb'.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+
+    enabled = True
+    directory = ''  # empty: sidecar folder next to the source file
+    sidecar_name = '.peakexplorer_cache'
+    max_size_mb = 2048
+    full_hash = False  # False: hash only sampled blocks of the file content
+
+    arrays = ('elution_times', 'offsets', 'masses', 'counts')
+    meta_filename = 'meta.json'
+    sample_size = 64 * 1024  # bytes per sampled block for the content hash
+    number_of_samples = 16
+
+    @classmethod
+    def apply_settings(cls, settings):
+        """Set cache settings from [CACHE] of 'settings' (configparser of config.ini)"""
+        cls.enabled = settings['CACHE'].getboolean('enabled', fallback=cls.enabled)
+        cls.directory = settings['CACHE'].get('directory', fallback='')
+        cls.max_size_mb = settings['CACHE'].getint('max_size_mb', fallback=cls.max_size_mb)
+        cls.full_hash = settings['CACHE'].getboolean('full_hash', fallback=cls.full_hash)
+        return
+
+    @staticmethod
+    def settings_key(settings):
+        """Settings of config.ini, which change the parse result (ParseCSV.parse_settings), for the cache key"""
+        return {f"{section}.{item}": settings[section].get(item, fallback='')
+                for section, items in ParseCSV.parse_settings.items() if settings.has_section(section)
+                for item in items}
+
+    @classmethod
+    def cache_dir(cls, csv_filename):
+        """Directory holding the cache entries for 'csv_filename'"""
+        if cls.directory:
+            return Path(cls.directory).expanduser()
+        return Path(csv_filename).resolve().parent / cls.sidecar_name
+
+    @classmethod
+    def content_hash(cls, csv_filename):
+        """Hash of the file content: complete file if 'full_hash', else evenly spaced sampled blocks"""
+        digest = hashlib.blake2b(digest_size=16)
+        size = Path(csv_filename).stat().st_size
+        with open(csv_filename, 'rb') as file:
+            if cls.full_hash or size <= cls.sample_size * cls.number_of_samples:
+                for block in iter(lambda: file.read(1024 * 1024), b''):
+                    digest.update(block)
+            else:
+                step = (size - cls.sample_size) // (cls.number_of_samples - 1)
+                for index in range(cls.number_of_samples):
+                    file.seek(index * step)
+                    digest.update(file.read(cls.sample_size))
+        return digest.hexdigest()
+
+    @classmethod
+    def key(cls, csv_filename, settings=None):
+        """Cache key from path, size, mtime, content hash and parse settings (e.g. [CSV] and [DATA] of config.ini)"""
+        path = Path(csv_filename).resolve()
+        stat = path.stat()
+        parts = {'path': str(path),
+                 'size': stat.st_size,
+                 'mtime': stat.st_mtime_ns,
+                 'content': cls.content_hash(path),
+                 'settings': {str(key): str(value) for key, value in dict(settings or {}).items()}}
+        text = json.dumps(parts, sort_keys=True)
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+    @classmethod
+    def load(cls, csv_filename, settings=None):
+        """Returns the cached Dataset (arrays memory-mapped) or None if there is no valid entry"""
+        if not cls.enabled:
+            return None
+        try:
+            entry = cls.cache_dir(csv_filename) / cls.key(csv_filename, settings)
+            if not (entry / cls.meta_filename).is_file():
+                cls.logger.info(f"Cache miss for '{csv_filename}'.")
+                return None
+            meta = json.loads((entry / cls.meta_filename).read_text(encoding='utf-8'))
+            arrays = [np.load(entry / f"{name}.npy", mmap_mode='r') for name in cls.arrays]
+            mass_binning = MassBinning(**meta['mass_binning']) if meta.get('mass_binning') else None
+            os.utime(entry / cls.meta_filename)  # mark as recently used
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            cls.logger.warning(f"Cache entry for '{csv_filename}' can not be read: {e}")
+            return None
+        cls.logger.info(f"Cache hit for '{csv_filename}' ({entry.name}).")
+        return Dataset.from_mass_values(*arrays, source_filename=str(csv_filename), mass_binning=mass_binning)
+
+    @classmethod
+    def store(cls, dataset, csv_filename, settings=None):
+        """Write 'dataset' as cache entry for 'csv_filename' and evict old entries if needed"""
+        if not cls.enabled:
+            return
+        cache_dir = cls.cache_dir(csv_filename)
+        try:
+            entry = cache_dir / cls.key(csv_filename, settings)
+            temp = cache_dir / f"{entry.name}.tmp{os.getpid()}"
+            temp.mkdir(parents=True, exist_ok=True)
+            for name in cls.arrays:
+                array = dataset.mass_values if name == 'masses' else getattr(dataset, name)
+                np.save(temp / f"{name}.npy", np.ascontiguousarray(array))
+            meta = {'source': str(Path(csv_filename).resolve()),
+                    'scans': len(dataset),
+                    'points': dataset.number_of_points,
+                    'mass_binning': dataset.mass_binning.as_dict() if dataset.mass_binning else None,
+                    'created': time.time()}
+            (temp / cls.meta_filename).write_text(json.dumps(meta, indent=2), encoding='utf-8')
+            if entry.exists():
+                shutil.rmtree(entry)
+            temp.rename(entry)
+        except OSError as e:
+            cls.logger.warning(f"Dataset could not be cached in '{cache_dir}': {e}")
+            return
+        cls.logger.info(f"Dataset cached as {entry.name}.")
+        cls.evict(cache_dir)
+        return
+
+    @classmethod
+    def load_store(cls, csv_filename, settings=None):
+        """Returns the ChunkStore of 'csv_filename' or None if there is no valid one"""
+        entry = cls.cache_dir(csv_filename) / f"store_{cls.key(csv_filename, settings)}"
+        if not (entry / ChunkStore.index_filename).is_file():
+            cls.logger.info(f"No chunk store for '{csv_filename}'.")
+            return None
+        try:
+            store = ChunkStore(entry)
+            os.utime(entry / ChunkStore.index_filename)  # mark as recently used
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            cls.logger.warning(f"Chunk store for '{csv_filename}' can not be read: {e}")
+            return None
+        cls.logger.info(f"Chunk store found for '{csv_filename}' ({entry.name}).")
+        return store
+
+    @classmethod
+    def store_dir(cls, csv_filename, settings=None):
+        """Directory for a new ChunkStore of 'csv_filename' (written by ParseCSV.read_csv_to_store)"""
+        return cls.cache_dir(csv_filename) / f"store_{cls.key(csv_filename, settings)}"
+
+    @classmethod
+    def load_or_parse(cls, csv_filename, settings=None):
+        """
+        Returns the parse result of 'csv_filename' from the cache, else parses and caches it:
+        a ChunkStore for files larger than ParseCSV.out_of_core_mb, else a Dataset. None if errors occur.
+        """
+        if 0 < ParseCSV.out_of_core_mb * 1024 * 1024 < Path(csv_filename).stat().st_size:
+            data = cls.load_store(csv_filename, settings)
+            if data is None:
+                directory = cls.store_dir(csv_filename, settings)
+                data = ParseCSV.read_csv_to_store(csv_filename, directory)
+                if not data:
+                    return None
+                cls.evict(directory.parent, keep=directory)
+            return data
+        data = cls.load(csv_filename, settings)
+        if data is None:
+            data = ParseCSV.read_csv_columnar(csv_filename)
+            if not data:
+                return None
+            cls.store(data, csv_filename, settings)
+        return data
+
+    @classmethod
+    def entries(cls, cache_dir):
+        """Returns [(last_used, size_in_bytes, entry_dir, meta)] for all entries in 'cache_dir'"""
+        result = []
+        for meta_file in list(Path(cache_dir).glob(f"*/{cls.meta_filename}")) \
+                + list(Path(cache_dir).glob(f"store_*/{ChunkStore.index_filename}")):
+            entry = meta_file.parent
+            try:
+                meta = json.loads(meta_file.read_text(encoding='utf-8'))
+                size = sum(file.stat().st_size for file in entry.iterdir())
+                result.append((meta_file.stat().st_mtime, size, entry, meta))
+            except (OSError, ValueError):
+                continue
+        return result
+
+    @classmethod
+    def evict(cls, cache_dir, keep=None):
+        """Remove least recently used entries (except entry 'keep') until the cache fits into 'max_size_mb'"""
+        entries = sorted(cls.entries(cache_dir), key=lambda item: item[0])
+        total = sum(size for _, size, _, _ in entries)
+        entries = [item for item in entries if item[2] != keep]
+        budget = cls.max_size_mb * 1024 * 1024
+        while entries and total > budget:
+            _, size, entry, _ = entries.pop(0)
+            cls.logger.info(f"Cache entry {entry.name} evicted ({size} bytes).")
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        return
+
+    @classmethod
+    def invalidate(cls, csv_filename):
+        """Remove all cache entries of 'csv_filename'"""
+        source = str(Path(csv_filename).resolve())
+        for _, _, entry, meta in cls.entries(cls.cache_dir(csv_filename)):
+            if meta.get('source') == source:
+                cls.logger.info(f"Cache entry {entry.name} of '{csv_filename}' removed.")
+                shutil.rmtree(entry, ignore_errors=True)
+        return
+
+    @classmethod
+    def clear(cls, csv_filename=''):
+        """Remove all cache entries (next to 'csv_filename', if cache is stored as sidecar folder)"""
+        if not (cls.directory or csv_filename):
+            return
+        cache_dir = cls.cache_dir(csv_filename)
+        for _, _, entry, _ in cls.entries(cache_dir):
+            shutil.rmtree(entry, ignore_errors=True)
+        cls.logger.info(f"Cache in '{cache_dir}' cleared.")
+        return
@@ -0,0 +1,134 @@
+from pathlib import Path
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+
+from Model.Dataset import Dataset, MassBinning
+
+__all__ = ['ChunkStore']
+
+
+class ChunkStore:
+    """
+    Out-of-core storage of an acquisition as time-ordered chunks on disk.
+    Every chunk is a Dataset saved as '.npy' files and loaded memory-mapped on access,
+    'index.json' holds scans, points, time range and mass range of every chunk.
+    Iterating over a ChunkStore yields its chunks one at a time, so it can be used as stream of chunks
+    for all functions of Data. Queries with a time or mass range only touch the overlapping chunks.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+
+    arrays = ('elution_times', 'offsets', 'masses', 'counts')
+    index_filename = 'index.json'
+    ion_masses_filename = 'ion_masses.npy'
+
+    def __init__(self, directory):
+        self.id = next(Dataset._ids)  # unique like Dataset.id, e.g. for keys of cached results
+        self.directory = Path(directory)
+        index = json.loads((self.directory / self.index_filename).read_text(encoding='utf-8'))
+        self.source_filename = index.get('source', '')
+        self.chunk_info = index['chunks']
+        self.mass_binning = MassBinning(**index['mass_binning']) if index.get('mass_binning') else None
+        self._ion_masses = None
+        self._elution_times = None
+
+    def __len__(self):
+        return sum(info['scans'] for info in self.chunk_info)
+
+    def __iter__(self):
+        for number in range(len(self.chunk_info)):
+            yield self.chunk(number)
+
+    def __repr__(self):
+        return f"{type(self).__name__}('{self.directory}', chunks={len(self.chunk_info)}, scans={len(self)}, " \
+               f"points={self.number_of_points})"
+
+    @property
+    def number_of_points(self):
+        """Total number of (mass, count) pairs in all chunks"""
+        return sum(info['points'] for info in self.chunk_info)
+
+    @property
+    def ion_masses(self):
+        """Sorted distinct masses of all scans (stored while writing, loaded memory-mapped on first use)"""
+        if self._ion_masses is None:
+            self._ion_masses = np.load(self.directory / self.ion_masses_filename, mmap_mode='r')
+        return self._ion_masses
+
+    @property
+    def elution_times(self):
+        """Elution times of all scans in chunk order (order of the scans of all Data functions). Loaded once."""
+        if self._elution_times is None:
+            self._elution_times = np.concatenate(
+                [np.load(self.directory / f"{info['name']}_elution_times.npy") for info in self.chunk_info]
+                or [np.empty(0)])
+        return self._elution_times
+
+    def chunk(self, number):
+        """Chunk 'number' as Dataset with memory-mapped arrays"""
+        name = self.chunk_info[number]['name']
+        arrays = [np.load(self.directory / f"{name}_{array}.npy", mmap_mode='r') for array in self.arrays]
+        return Dataset.from_mass_values(*arrays, source_filename=self.source_filename,
+                                        mass_binning=self.mass_binning)
+
+    def overlapping(self, time_min=-np.inf, time_max=np.inf, mass_min=-np.inf, mass_max=np.inf):
+        """Numbers of all chunks, which contain scans in [time_min, time_max] and masses in [mass_min, mass_max]"""
+        return [number for number, info in enumerate(self.chunk_info)
+                if info['points'] and info['time_max'] >= time_min and info['time_min'] <= time_max
+                and info['mass_max'] >= mass_min and info['mass_min'] <= mass_max]
+
+    @classmethod
+    def write(cls, directory, chunks, source_filename=""):
+        """
+        Write a stream of Datasets (e.g. ParseCSV.iter_csv_chunks) as ChunkStore to 'directory'.
+        Scans of every chunk are sorted by elution time. Only one chunk is held in memory at a time.
+        Returns: the ChunkStore
+        """
+        directory = Path(directory)
+        temp = directory.with_name(f"{directory.name}.tmp{os.getpid()}")
+        if temp.exists():
+            shutil.rmtree(temp)
+        temp.mkdir(parents=True)
+        chunk_info = []
+        ion_masses = np.empty(0)
+        mass_binning = None
+        last_time = -np.inf
+        start = time.perf_counter()
+        try:
+            for number, chunk in enumerate(chunks):
+                index = chunk.time_index  # scans in time order, masses as stored
+                name = f"chunk_{number:05d}"
+                for array, values in zip(cls.arrays, (index.elution_times, index.offsets, index.masses, index.counts)):
+                    np.save(temp / f"{name}_{array}.npy", np.ascontiguousarray(values))
+                masses = chunk.ion_masses
+                chunk_info.append({'name': name,
+                                   'scans': len(chunk),
+                                   'points': chunk.number_of_points,
+                                   'time_min': float(index.elution_times[0]) if len(chunk) else None,
+                                   'time_max': float(index.elution_times[-1]) if len(chunk) else None,
+                                   'mass_min': float(masses[0]) if len(masses) else None,
+                                   'mass_max': float(masses[-1]) if len(masses) else None})
+                ion_masses = np.union1d(ion_masses, masses)
+                mass_binning = chunk.mass_binning
+                if len(chunk) and index.elution_times[0] < last_time:
+                    cls.logger.warning(f"Chunk {number} overlaps the time range of previous chunks.")
+                last_time = max(last_time, float(index.elution_times[-1])) if len(chunk) else last_time
+        except BaseException:  # parse errors or cancellation: no incomplete store is left on disk
+            shutil.rmtree(temp, ignore_errors=True)
+            raise
+
+        np.save(temp / cls.ion_masses_filename, ion_masses)
+        index = {'source': str(Path(source_filename).resolve()) if source_filename else '',
+                 'created': time.time(),
+                 'mass_binning': mass_binning.as_dict() if mass_binning else None,
+                 'chunks': chunk_info}
+        (temp / cls.index_filename).write_text(json.dumps(index, indent=2), encoding='utf-8')
+        if directory.exists():
+            shutil.rmtree(directory)
+        temp.rename(directory)
+        store = cls(directory)
+        cls.logger.info(f"{store} written in {time.perf_counter() - start:.1f} s.")
+        return store
@@ -1,28 +1,66 @@
-import xlsxwriter
+from pathlib import Path
 import logging
+import time
+import numpy as np
 __all__ = ['CreateExcel']
 
 
 class CreateExcel:
     """ Create specialized Excel file from data in Model with 'chart sheet' followed by 'data sheet'"""
     logger = logging.getLogger().getChild(__name__)  # Start logger
-    logger.info('Module imported.')
 
     source_filename = ""
     excel_filename = ''
     excel_workbook = None
 
+    max_rows = 1048576  # rows of an Excel worksheet, longer data is split across several sheets
+    block_rows = 65536  # rows converted at once from arrays to Python floats
+
+    @staticmethod
+    def result_filename(filename, folder=None):
+        """Result filename: (folder or path of 'filename')/HPLC_MS_filename.xlsx"""
+        return Path(folder or Path(filename).parent, f'HPLC_MS_{Path(filename).name}.xlsx')
+
+    @staticmethod
+    def summary_modes(summary, mass_trace=None, mass=0, mass_interval=0,
+                      elution_time_trace=None, time=0, time_interval=0):
+        """
+        Parameter 'modes' of 'create_excel_file' from Summary and optional traces.
+        Columns are the arrays of Summary and traces (no copies).
+        """
+        columns1 = (summary.elution_times, summary.total_counts_per_time)
+        if mass_trace is not None:
+            columns1 += (mass_trace,)
+        columns2 = (summary.ion_masses, summary.total_counts_per_mass)
+        if elution_time_trace is not None:
+            columns2 += (elution_time_trace,)
+
+        modes = {"counts_per_time": {"columns": columns1, "trace": 0, "deviation": 0.0},
+                 "counts_per_mass": {"columns": columns2, "trace": 0, "deviation": 0.0}
+                 }
+        if mass_trace is not None:
+            modes["counts_per_time"]["trace"] = mass
+            modes["counts_per_time"]["deviation"] = mass_interval
+
+        if elution_time_trace is not None:
+            modes["counts_per_mass"]["trace"] = time
+            modes["counts_per_mass"]["deviation"] = time_interval
+        return modes
+
     @classmethod
-    def create_excel_file(cls, modes, excel_filename=excel_filename, source_filename=source_filename):
+    def create_excel_file(cls, modes, excel_filename=excel_filename, source_filename=source_filename,
+                          peak_table=None):
         """Save data to a new created Excel file.
-        Parameter 'modes' is a dict of dicts {mode: {trace: ..., deviation: ...}}"""
+        Parameter 'modes' is a dict of dicts {mode: {columns: ..., trace: ..., deviation: ...}}
+        Optional 'peak_table' (Data.PeakTable) is saved in an extra sheet 'Peaks'"""
         cls.logger.debug(f"{cls.create_excel_file.__doc__}")
+        start = time.perf_counter()
 
         # Create new workbook
         cls.create_new_excel_workbook(excel_filename)
 
         chart_sheet_list = []
-        data_sheet_list = []
+        rows = 0
 
         # Create chart_sheet
         for mode in modes:
@@ -32,38 +70,128 @@ class CreateExcel:
 
         # Create data_sheets and fill corresponding chart_sheets with chart
         for index, mode in enumerate(modes):
-            data = modes[mode]["data"]
             trace = modes[mode]["trace"]
             deviation = modes[mode]["deviation"]
+            show_trace = True if trace != 0 or deviation != 0 else False
+            columns = modes[mode]["columns"][:3 if show_trace else 2]
 
-            # Create data_sheet
+            # Create data_sheets (more than one for more rows than an Excel sheet can hold) and fill with data
             cls.logger.debug(f"Arbeitsblatt 'Data {mode.title()}' wird erzeugt.")
-            data_sheet = cls.excel_workbook.add_worksheet(f'Data_{mode.title()}')
-
-            # Fill data_sheet with data
-            cls.fill_data_sheet(data_sheet, mode, data, trace, deviation, source_filename)
-            data_sheet_list.append(data_sheet)
+            sheets = cls.add_data_sheets(
+                f'Data_{mode.title()}', columns,
+                lambda worksheet, part: cls.fill_data_sheet(worksheet, mode, part, trace, deviation, source_filename))
+            rows += sum(sheet_rows for _, sheet_rows in sheets)
 
             # Now fill chart_sheet with chart
-            show_trace = True if trace != 0 or deviation != 0 else False
-            chart = cls.create_chart(mode, data, show_trace=show_trace)
+            chart = cls.create_chart(mode, sheets, show_trace=show_trace)
             # Insert the chart into the chart_sheet.
             chart_sheet_list[index].set_chart(chart)
 
+        # Create sheet with peak table
+        if peak_table is not None:
+            cls.logger.debug("Arbeitsblatt 'Peaks' wird erzeugt.")
+            cls.fill_peak_sheet(cls.excel_workbook.add_worksheet('Peaks'), peak_table)
+
         # Closing of workbook necessary for writing
         cls.excel_workbook.close()
+        cls.log_throughput(rows, time.perf_counter() - start)
         cls.logger.info('Erzeugung der Ergebnis-Exceldatei beendet.')
         return
 
+    @classmethod
+    def create_xic_file(cls, elution_times, xics, labels, excel_filename=excel_filename,
+                        source_filename=source_filename):
+        """Save XICs of a target list to a new Excel file: 'chart sheet' with all traces followed by 'data sheet'"""
+        cls.logger.debug(f"{cls.create_xic_file.__doc__}")
+        start = time.perf_counter()
+        cls.create_new_excel_workbook(excel_filename)
+        chart_sheet = cls.excel_workbook.add_chartsheet('Chart XIC')
+        underline_format = cls.excel_workbook.add_format({'bottom': True})
+        float_format = cls.excel_workbook.add_format({'num_format': '#,##0.000;;[Red] 0'})
+
+        def fill_xic_sheet(worksheet, columns):
+            worksheet.freeze_panes(1, 1)
+            worksheet.set_zoom(100)
+            worksheet.set_column(0, len(labels), 22)
+            worksheet.write_row(0, 0, ["Elution time [min]"] + list(labels), underline_format)
+            worksheet.write(0, len(labels) + 2, f"HPLC-MS-Data derived from '{source_filename}'")
+            return cls.write_rows(worksheet, 1, columns, float_format)
+
+        sheets = cls.add_data_sheets('Data_XIC', [elution_times] + list(xics), fill_xic_sheet)
+
+        chart = cls.excel_workbook.add_chart({'type': 'scatter', 'subtype': 'straight'})
+        series = [(name, rows, column) for name, rows in sheets for column in range(1, len(labels) + 1)]
+        for name, rows, column in series[:255]:  # Excel charts are limited to 255 series
+            chart.add_series({
+                'name': [name, 0, column],
+                'categories': [name, 1, 0, rows, 0],
+                'values': [name, 1, column, rows, column],
+                'line': {'width': 1.25}})
+        if len(sheets) > 1:
+            chart.set_legend({'delete_series': list(range(len(labels), min(len(series), 255)))})
+        chart.set_title({'name': 'HPLC-MS Extracted ion chromatograms'})
+        chart.set_x_axis({'name': 'Elution time [min]', 'num_format': '0.0'})
+        chart.set_y_axis({'name': 'Counts', 'num_format': '#,##0'})
+        chart_sheet.set_chart(chart)
+
+        cls.excel_workbook.close()
+        cls.log_throughput(sum(rows for _, rows in sheets), time.perf_counter() - start)
+        cls.logger.info('Erzeugung der XIC-Exceldatei beendet.')
+        return
+
     @classmethod
     def create_new_excel_workbook(cls, filename=excel_filename):
         cls.logger.debug('A new Excel file will be created.')
-        cls.excel_workbook = xlsxwriter.Workbook(filename)
+        import xlsxwriter  # imported on first export, not on program start
+        # constant_memory: every row is written to disk, when the next row starts (rows must be written in order)
+        cls.excel_workbook = xlsxwriter.Workbook(filename, {'constant_memory': True, 'nan_inf_to_errors': True})
+        return
+
+    @classmethod
+    def add_data_sheets(cls, sheet_name, columns, fill_sheet):
+        """
+        Add worksheets 'sheet_name', 'sheet_name_2', ... with at most 'max_rows' - 1 rows of 'columns' each
+        (one header row), 'fill_sheet(worksheet, columns)' writes one sheet and returns its number of rows.
+        Returns: [(sheet name, rows), ...]
+        """
+        rows_per_sheet = cls.max_rows - 1
+        length = len(columns[0])
+        sheets = []
+        for part, first in enumerate(range(0, max(length, 1), rows_per_sheet)):
+            name = f"{sheet_name}_{part + 1}" if part else sheet_name
+            worksheet = cls.excel_workbook.add_worksheet(name)
+            rows = fill_sheet(worksheet, [column[first:first + rows_per_sheet] for column in columns])
+            sheets.append((name, rows))
+        if len(sheets) > 1:
+            cls.logger.info(f"{length} Zeilen auf {len(sheets)} Arbeitsblätter '{sheet_name}' verteilt "
+                            f"(Excel: max. {cls.max_rows} Zeilen).")
+        return sheets
+
+    @staticmethod
+    def write_rows(worksheet, first_row, columns, cell_format=None):
+        """
+        Write equally long 'columns' (arrays) row by row, as required by constant_memory mode.
+        Columns are converted block by block to Python floats, the data is not copied as a whole.
+        Returns: number of rows
+        """
+        length = len(columns[0]) if len(columns) else 0
+        write_number = worksheet.write_number
+        for start in range(0, length, CreateExcel.block_rows):
+            block = [np.asarray(column[start:start + CreateExcel.block_rows], dtype=np.float64).tolist()
+                     for column in columns]
+            for row, values in enumerate(zip(*block), start=first_row + start):
+                for col, value in enumerate(values):
+                    write_number(row, col, value, cell_format)
+        return length
+
+    @classmethod
+    def log_throughput(cls, rows, seconds):
+        cls.logger.info(f"{rows} Zeilen in {seconds:.2f} s geschrieben ({rows / max(seconds, 1e-9):.0f} rows/s).")
         return
 
     @classmethod
-    def fill_data_sheet(cls, worksheet, mode, data, trace, deviation, source_filename=source_filename):
-        """ Creation of a data sheet in workbook object """
+    def fill_data_sheet(cls, worksheet, mode, columns, trace, deviation, source_filename=source_filename):
+        """ Creation of a data sheet in workbook object, returns number of data rows """
         cls.logger.debug(f"{cls.fill_data_sheet.__doc__}")
         worksheet.freeze_panes(1, 0)
         worksheet.set_landscape()  # set landscape orientation for printing
@@ -86,41 +214,62 @@ class CreateExcel:
             worksheet.write(0, 1, "Summed up total counts", underline_format)
             if trace != 0 or deviation != 0:
                 worksheet.write(0, 2, f"Counts for minute trace {trace}±{deviation} Min", underline_format)
+        worksheet.write(0, 5, f"HPLC-MS-Data derived from '{source_filename}'")
 
         worksheet.set_column(0, 2, 22)
-        cls.logger.debug(f"Länge: {len(data)}")
-        cls.logger.debug(data[0])
-        for index, entry in enumerate(data):
-            worksheet.write(1 + index, 0, entry[0], float_format)
-            worksheet.write(1 + index, 1, entry[1], float_format)
-            if trace != 0 or deviation != 0:
-                worksheet.write(1 + index, 2, entry[2], float_format)
-        worksheet.write(0, 5, f"HPLC-MS-Data derived from '{source_filename}'")
+        cls.logger.debug(f"Länge: {len(columns[0])}")
+        return cls.write_rows(worksheet, 1, columns, float_format)
+
+    @classmethod
+    def fill_peak_sheet(cls, worksheet, peak_table):
+        """ Creation of a sheet with one row per detected peak """
+        cls.logger.debug(f"{cls.fill_peak_sheet.__doc__}")
+        worksheet.freeze_panes(1, 0)
+        worksheet.set_zoom(100)
+        underline_format = cls.excel_workbook.add_format({'bottom': True})
+        float_format = cls.excel_workbook.add_format({'num_format': '#,##0.000;;[Red] 0'})
+        header = {'apex_time': "Apex [min]",
+                  'apex_height': "Apex counts",
+                  'start_time': "Start [min]",
+                  'end_time': "End [min]",
+                  'baseline': "Baseline counts",
+                  'area': "Area [counts*min]",
+                  'fwhm': "FWHM [min]",
+                  'signal_to_noise': "S/N"}
+        worksheet.set_column(0, len(header) - 1, 18)
+        worksheet.write_row(0, 0, [header.get(field, field) for field in peak_table._fields], underline_format)
+        columns = [np.asarray(getattr(peak_table, field), dtype=np.float64).tolist() for field in peak_table._fields]
+        for row, values in enumerate(zip(*columns), start=1):
+            worksheet.write_row(row, 0, [value if np.isfinite(value) else None for value in values], float_format)
         return
 
     @classmethod
-    def create_chart(cls, mode, data, show_trace):
-        """ Creation of a chart in workbook object """
-        cls.logger.debug(f"{cls.fill_data_sheet.__doc__}")
+    def create_chart(cls, mode, sheets, show_trace):
+        """ Creation of a chart in workbook object, 'sheets' are [(name, rows), ...] of the data sheets """
+        cls.logger.debug(f"{cls.create_chart.__doc__}")
         # Create a new chart object.
         chart = cls.excel_workbook.add_chart({'type': 'scatter',
                                               'subtype': 'straight'})
 
-        # Add a series to the chart.
-        chart.add_series({
-            'name': f'=Data_{mode.title()}!$B$1',
-            'categories': f'=Data_{mode.title()}!$A$2:$A${len(data)+1}',
-            'values': f'=Data_{mode.title()}!$B$2:$B${len(data)+1}',
-            'line': {'width': 1.25,
-                     'color': '#4472C4'}})
-
-        if show_trace:  # show mass trace or elution_time trace
+        # Add series to the chart, one per data sheet
+        for name, rows in sheets:
             chart.add_series({
-                'name': f'=Data_{mode.title()}!$C$1',
-                'categories': f'=Data_{mode.title()}!$A$2:$A${len(data)+1}',
-                'values': f'=Data_{mode.title()}!$C$2:$C${len(data)+1}',
-                'line':   {'width': 1.25,
-                           'color': '#ED7D31'}})
+                'name': [name, 0, 1],
+                'categories': [name, 1, 0, rows, 0],
+                'values': [name, 1, 1, rows, 1],
+                'line': {'width': 1.25,
+                         'color': '#4472C4'}})
+
+            if show_trace:  # show mass trace or elution_time trace
+                chart.add_series({
+                    'name': [name, 0, 2],
+                    'categories': [name, 1, 0, rows, 0],
+                    'values': [name, 1, 2, rows, 2],
+                    'line': {'width': 1.25,
+                             'color': '#ED7D31'}})
+        if len(sheets) > 1:  # one legend entry per column
+            series_per_sheet = 2 if show_trace else 1
+            chart.set_legend({'delete_series': list(range(series_per_sheet, series_per_sheet * len(sheets)))})
 
         # Set an Excel chart style.
         # chart.set_style(13)
@@ -2,6 +2,9 @@ from collections import namedtuple
 import logging
 import numpy as np
 
+from Model.Dataset import Dataset
+from Model.ChunkStore import ChunkStore
+
 __all__ = ['Data']
 Line = namedtuple('Line', ['elution_time', 'mass_count_list'])
 MassCount = namedtuple('MassCount', ['mass', 'count'])
@@ -13,26 +16,197 @@ Summary = namedtuple('Summary', ['elution_times',
                                  'min_mass_per_time',
                                  'ion_masses',
                                  'total_counts_per_mass'])
+PeakTable = namedtuple('PeakTable', ['apex_time',
+                                     'apex_height',
+                                     'start_time',
+                                     'end_time',
+                                     'baseline',
+                                     'area',
+                                     'fwhm',
+                                     'signal_to_noise'])
+Features = namedtuple('Features', ['mass',
+                                   'retention_time',
+                                   'area',
+                                   'signal_to_noise',
+                                   'apex_height',
+                                   'fwhm'])
 
 
 class Data:
     """
     Calculate 'counts per time' (Chromatogram) with optional mass trace
     Calculate 'counts per mass' (Mass spectrum) with optional elution time trace
+    Parameter 'data' is a list of Lines, a Dataset or a stream (iterable) of chunks,
+    e.g. from ParseCSV.iter_csv_chunks() or a ChunkStore. Streams are reduced incrementally in one pass.
     """
     logger = logging.getLogger().getChild(__name__)  # Start logger
-    logger.info('Module imported.')
 
     @staticmethod
-    def get_total_counts(data: [Line]):
+    def is_lines(data):
+        """True, if 'data' is given in tuple format [Line, Line, ...]"""
+        return isinstance(data, (list, tuple)) and len(data) > 0 and hasattr(data[0], 'elution_time')
+
+    @classmethod
+    def iter_lines(cls, data):
+        """
+        Iterate over all scans of 'data' in tuple format.
+        'data' is a list of Lines, a Dataset or an iterable of chunks (Datasets or lists of Lines)
+        """
+        if isinstance(data, Dataset) or cls.is_lines(data):
+            yield from data
+        else:
+            for chunk in data:
+                yield from chunk
+
+    @classmethod
+    def iter_chunks(cls, data):
+        """
+        Iterate over 'data' as Datasets.
+        'data' is a list of Lines, a Dataset or an iterable of chunks (Datasets or lists of Lines)
+        """
+        if isinstance(data, Dataset):
+            yield data
+        elif cls.is_lines(data):
+            yield Dataset.from_lines(data)
+        else:
+            for chunk in data:
+                yield chunk if isinstance(chunk, Dataset) else Dataset.from_lines(chunk)
+
+    @classmethod
+    def get_total_counts(cls, data):
+        """
+        Calculates Summary ('counts per time' and 'counts per mass').
+        A list of Lines is processed in tuple format and returns lists,
+        a Dataset or a stream of chunks is processed vectorized and returns numpy arrays.
+        """
+        if cls.is_lines(data):
+            return cls.get_total_counts_lines(data)
+        return cls.get_total_counts_columnar(data)
+
+    @classmethod
+    def get_total_counts_columnar(cls, data):
+        """
+        Vectorized calculation of Summary in one pass over the chunks of 'data':
+        segment reductions for the values per scan, sort/unique-and-sum for the values per mass.
+        The (mass, count) pairs of the chunks are merged once after the last chunk.
+        """
+        per_scan = {name: [] for name in Summary._fields[:6]}
+        masses_per_chunk = []
+        counts_per_chunk = []
+        mass_binning = None
+
+        for chunk in cls.iter_chunks(data):
+            number_of_masses = chunk.masses_per_scan
+            scan_ids = np.repeat(np.arange(len(chunk)), number_of_masses)
+            per_scan['elution_times'].append(chunk.elution_times)
+            # bincount sums in order of the points, like the built-in sum() per line
+            per_scan['total_counts_per_time'].append(np.bincount(scan_ids, weights=chunk.counts,
+                                                                 minlength=len(chunk)))
+            per_scan['total_masses_per_time'].append(np.bincount(scan_ids, weights=chunk.masses,
+                                                                 minlength=len(chunk)))
+            per_scan['number_of_masses_per_time'].append(number_of_masses)
+
+            # Max and min per scan (NaN for scans without masses)
+            not_empty = number_of_masses > 0
+            starts = chunk.offsets[:-1][not_empty]
+            max_mass = np.full(len(chunk), np.nan)
+            min_mass = np.full(len(chunk), np.nan)
+            if len(starts):
+                max_mass[not_empty] = np.maximum.reduceat(chunk.masses, starts)
+                min_mass[not_empty] = np.minimum.reduceat(chunk.masses, starts)
+            per_scan['max_mass_per_time'].append(max_mass)
+            per_scan['min_mass_per_time'].append(min_mass)
+
+            # Sum up counts for every mass (bin) of the chunk, merged after the last chunk
+            masses, counts = cls.sum_per_mass(chunk, chunk.counts)
+            masses_per_chunk.append(masses)
+            counts_per_chunk.append(counts)
+            mass_binning = chunk.mass_binning
+
+        ion_masses, total_counts_per_mass = cls.merge_mass_counts(masses_per_chunk, counts_per_chunk)
+        per_scan = {name: np.concatenate(values) if values else np.empty(0) for name, values in per_scan.items()}
+        if mass_binning is not None:
+            ion_masses = mass_binning.centers(ion_masses)
+        return Summary(ion_masses=ion_masses,
+                       total_counts_per_mass=total_counts_per_mass,
+                       **per_scan)
+
+    @staticmethod
+    def sum_per_mass(chunk, weights):
+        """
+        Returns (keys, sums): sorted distinct masses of 'chunk' and the summed up 'weights' per mass.
+        For binned masses the keys are integer bin indices, accumulated by bincount over the bin range.
+        """
+        keys = chunk.mass_values
+        if chunk.mass_bins is None:
+            masses, inverse = np.unique(keys, return_inverse=True)
+            return masses, np.bincount(inverse, weights=weights, minlength=len(masses))
+        if not len(keys):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        first = keys.min()
+        present = np.bincount(keys - first) > 0
+        sums = np.bincount(keys - first, weights=weights, minlength=len(present))
+        return np.flatnonzero(present) + first, sums[present]
+
+    @staticmethod
+    def merge_mass_counts(masses_list, counts_list):
+        """Merge several sorted (ion_masses, counts) pairs to one sorted pair with summed up counts"""
+        masses_list = [masses for masses in masses_list if len(masses)]
+        counts_list = [counts for counts in counts_list if len(counts)]
+        if len(masses_list) < 2:
+            return (masses_list[0], counts_list[0]) if masses_list else (np.empty(0), np.empty(0))
+        masses, inverse = np.unique(np.concatenate(masses_list), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate(counts_list), minlength=len(masses))
+        return masses, counts
+
+    @classmethod
+    def compare_summaries(cls, reference, other):
+        """
+        Accuracy check of a Summary (e.g. of a compact float32 dataset) against the reference Summary (float64).
+        Values per time are compared scan by scan. Values per mass are compared after summing up the reference
+        counts of all masses, which are equal after conversion to the dtype of 'other.ion_masses'.
+        Returns: {field: maximum relative deviation}, 'ion_masses' gives the maximum absolute deviation in Dalton
+        """
+        deviations = {}
+        for field in Summary._fields[:6]:
+            expected = np.asarray(getattr(reference, field), dtype=np.float64)
+            actual = np.asarray(getattr(other, field), dtype=np.float64)
+            if expected.shape != actual.shape:
+                raise ValueError(f"Summaries have a different number of scans ({field})")
+            deviations[field] = cls._relative_deviation(expected, actual)
+
+        other_masses = np.asarray(other.ion_masses)
+        keys, inverse = np.unique(np.asarray(reference.ion_masses).astype(other_masses.dtype), return_inverse=True)
+        if len(keys) != len(other_masses):
+            raise ValueError("Summaries have different ion masses")
+        expected = np.bincount(inverse, weights=reference.total_counts_per_mass, minlength=len(keys))
+        deviations['ion_masses'] = float(np.max(np.abs(keys.astype(np.float64)
+                                                       - np.asarray(reference.ion_masses)), initial=0))
+        deviations['total_counts_per_mass'] = cls._relative_deviation(expected, other.total_counts_per_mass)
+        for field, deviation in deviations.items():
+            cls.logger.info(f"Maximum deviation of {field}: {deviation:.3g}")
+        return deviations
+
+    @staticmethod
+    def _relative_deviation(expected, actual):
+        """Maximum of |actual - expected| / |expected| (NaN entries, e.g. of scans without masses, are skipped)"""
+        expected = np.asarray(expected, dtype=np.float64)
+        actual = np.asarray(actual, dtype=np.float64)
+        valid = ~np.isnan(expected) & (expected != 0)
+        return float(np.max(np.abs(actual[valid] - expected[valid]) / np.abs(expected[valid]), initial=0))
+
+    @classmethod
+    def get_total_counts_lines(cls, data: [Line]):
+        """Calculates Summary from tuple format [Line, Line, ...] (reference implementation)"""
         elution_times = []
         total_counts_per_time = []
         total_masses_per_time = []
         number_of_masses_per_time = []
         max_mass_per_time = []
         min_mass_per_time = []
+        ion_masses_dict = {}
 
-        for line in data:
+        for line in cls.iter_lines(data):
             # for each line get 'elution_time' and calculate 'total counts' and 'total mass'
             elution_times.append(line.elution_time)
             total_counts_per_time.append(sum([item.count for item in line.mass_count_list]))
@@ -41,8 +215,6 @@ class Data:
             max_mass_per_time.append(max([item.mass for item in line.mass_count_list]))
             min_mass_per_time.append(min([item.mass for item in line.mass_count_list]))
 
-        ion_masses_dict = {}
-        for line in data:
             # Sum up for every line counts for every mass
             for mass, count in line.mass_count_list:
                 # if mass already in dict, sum up counts
@@ -64,10 +236,12 @@ class Data:
                        total_counts_per_mass=total_counts_per_mass)
 
     @classmethod
-    def mass_trace(cls, data: [Line], mass=0, mass_interval=0):
+    def mass_trace(cls, data: [Line], mass=0, mass_interval=0, approximate=False):
         """
         Calculates mass_trace in 'counts per elution time'
-        Returns: 1-D list or None
+        For a Dataset only the points inside the mass window are touched (binary search in its mass index).
+        If 'approximate', a Dataset is answered from its binned intensity map in O(scans).
+        Returns: 1-D list (tuple format), 1-D numpy array or None
         """
 
         low = round(mass - mass_interval, 1)
@@ -78,20 +252,92 @@ class Data:
         trace = True if upper_limit > 0 else False  # Masses weigh more than 0 Da :-)
         Data.logger.debug(f"{trace = }, Mass: {lower_limit}-{upper_limit} Da")
 
-        if trace:
+        if not trace:
+            return None
+        if cls.is_lines(data):
             trace_counts = []
             for line in data:
                 trace_counts.append(sum([item.count
                                         for item in line.mass_count_list
                                         if lower_limit <= item.mass <= upper_limit]))
             return trace_counts
-        return None
+        if isinstance(data, Dataset):
+            if approximate:
+                return data.intensity_map.mass_trace(lower_limit, upper_limit)
+            return cls.mass_trace_indexed(data, lower_limit, upper_limit)
+        if isinstance(data, ChunkStore):
+            # Only chunks with masses inside the window are read, all other scans have 0 counts
+            overlapping = set(data.overlapping(mass_min=lower_limit, mass_max=upper_limit))
+            trace_counts = [cls.mass_trace_in_chunk(data.chunk(number), lower_limit, upper_limit)
+                            if number in overlapping else np.zeros(info['scans'])
+                            for number, info in enumerate(data.chunk_info)]
+            return np.concatenate(trace_counts) if trace_counts else np.empty(0)
+
+        # Stream of chunks: select points inside the mass window chunk by chunk
+        trace_counts = [cls.mass_trace_in_chunk(chunk, lower_limit, upper_limit) for chunk in cls.iter_chunks(data)]
+        return np.concatenate(trace_counts) if trace_counts else np.empty(0)
+
+    @staticmethod
+    def mass_trace_in_chunk(chunk, lower_limit, upper_limit):
+        """Sum up counts of all points with lower_limit <= mass <= upper_limit per scan of a chunk in one scan"""
+        masses = chunk.masses
+        inside = (masses >= lower_limit) & (masses <= upper_limit)
+        return np.bincount(chunk.scan_ids[inside], weights=chunk.counts[inside], minlength=len(chunk))
+
+    @staticmethod
+    def mass_trace_indexed(dataset, lower_limit, upper_limit):
+        """Sum up counts of all points with lower_limit <= mass <= upper_limit per scan using the mass index"""
+        index = dataset.mass_index
+        start = np.searchsorted(index.masses, lower_limit, side='left')
+        end = np.searchsorted(index.masses, upper_limit, side='right')
+        return np.bincount(index.scan_ids[start:end], weights=index.counts[start:end], minlength=len(dataset))
+
+    @classmethod
+    def extract_xics(cls, data, masses, tolerances=0.5, unit='Da'):
+        """
+        Batch extraction of mass traces (XICs) for many target masses in one pass.
+        'tolerances' is one value for all or one value per target mass, either absolute ('Da') or relative ('ppm').
+        Every target window is mass - tolerance <= m <= mass + tolerance.
+        Returns: 2-D numpy array (targets x scans)
+        """
+        masses = np.atleast_1d(np.asarray(masses, dtype=np.float64))
+        tolerances = np.broadcast_to(np.asarray(tolerances, dtype=np.float64), masses.shape)
+        if unit == 'ppm':
+            tolerances = masses * tolerances * 1e-6
+        elif unit != 'Da':
+            raise ValueError("unit must be 'Da' or 'ppm'")
+        lower_limits = masses - tolerances
+        upper_limits = masses + tolerances
+        Data.logger.debug(f"Extracting {len(masses)} XICs.")
+
+        xics = [cls.extract_xics_indexed(chunk, lower_limits, upper_limits) for chunk in cls.iter_chunks(data)]
+        return np.concatenate(xics, axis=1) if xics else np.zeros((len(masses), 0))
+
+    @staticmethod
+    def extract_xics_indexed(dataset, lower_limits, upper_limits):
+        """Sum up counts per scan for every mass window [lower_limit, upper_limit] using the mass index"""
+        index = dataset.mass_index
+        number_of_scans = len(dataset)
+        starts = np.searchsorted(index.masses, lower_limits, side='left')
+        ends = np.searchsorted(index.masses, upper_limits, side='right')
+        lengths = np.maximum(ends - starts, 0)
+
+        # Positions of all points inside any window, windows may overlap
+        window_starts = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) - np.repeat(window_starts - starts, lengths)
+        target_ids = np.repeat(np.arange(len(lengths)), lengths)
+        cells = target_ids * number_of_scans + index.scan_ids[positions]
+        xics = np.bincount(cells, weights=index.counts[positions], minlength=len(lengths) * number_of_scans)
+        return xics.reshape(len(lengths), number_of_scans)
 
     @classmethod
-    def elution_time_trace(cls, data: [Line], time=0, time_interval=0):
+    def elution_time_trace(cls, data: [Line], time=0, time_interval=0, summary=None, approximate=False):
         """
         Calculates elution_time_trace in 'counts per mass'
-        Returns: 1-D list or None
+        For a Dataset the time window is mapped to a contiguous slice of scans (elution-time index)
+        and summed up on the ion_masses axis of 'summary' (computed once per dataset, if not given).
+        If 'approximate', a Dataset is answered from its binned intensity map in O(masses).
+        Returns: 1-D list (tuple format), 1-D numpy array or None
         """
 
         low = round(time - time_interval, 1)
@@ -102,7 +348,9 @@ class Data:
         trace = True if upper_limit > 0 else False
         Data.logger.debug(f"{trace = }, Time: {lower_limit}-{upper_limit} Min")
 
-        if trace:
+        if not trace:
+            return None
+        if cls.is_lines(data):
             ion_masses_dict = {}
             for line in data:
                 correct_elution_time = True if lower_limit <= line.elution_time <= upper_limit else False
@@ -119,8 +367,41 @@ class Data:
 
             ion_masses = sorted(list(ion_masses_dict.keys()))  # Sort keys
             return [ion_masses_dict[key] for key in ion_masses]  # ...and values
+        if isinstance(data, Dataset):
+            if approximate:
+                return data.intensity_map.elution_time_trace(lower_limit, upper_limit)
+            ion_masses = np.asarray(summary.ion_masses) if summary is not None else data.ion_masses
+            return cls.elution_time_trace_indexed(data, lower_limit, upper_limit, ion_masses)
+        if isinstance(data, ChunkStore):
+            # Only chunks with scans inside the time window are read
+            ion_masses = np.asarray(summary.ion_masses) if summary is not None else data.ion_masses
+            trace_counts = np.zeros(len(ion_masses))
+            for number in data.overlapping(time_min=lower_limit, time_max=upper_limit):
+                trace_counts += cls.elution_time_trace_indexed(data.chunk(number), lower_limit, upper_limit,
+                                                               ion_masses)
+            return trace_counts
 
-        return None
+        # Stream of chunks: sum up counts inside the time window, masses outside count with 0
+        masses_per_chunk, counts_per_chunk = [], []
+        for chunk in cls.iter_chunks(data):
+            inside = (chunk.elution_times >= lower_limit) & (chunk.elution_times <= upper_limit)
+            masses, counts = cls.sum_per_mass(chunk, np.where(np.repeat(inside, chunk.masses_per_scan),
+                                                              chunk.counts, 0))
+            masses_per_chunk.append(masses)
+            counts_per_chunk.append(counts)
+        return cls.merge_mass_counts(masses_per_chunk, counts_per_chunk)[1]
+
+    @staticmethod
+    def elution_time_trace_indexed(dataset, lower_limit, upper_limit, ion_masses):
+        """Sum up counts of all scans with lower_limit <= elution_time <= upper_limit per mass of 'ion_masses'"""
+        index = dataset.time_index
+        start = np.searchsorted(index.elution_times, lower_limit, side='left')
+        end = np.searchsorted(index.elution_times, upper_limit, side='right')
+        first_point, last_point = index.offsets[start], index.offsets[end]
+        if dataset.mass_binning is not None:
+            ion_masses = dataset.mass_binning.to_bins(ion_masses)  # index holds integer bins
+        mass_ids = np.searchsorted(ion_masses, index.masses[first_point:last_point])
+        return np.bincount(mass_ids, weights=index.counts[first_point:last_point], minlength=len(ion_masses))
 
     @classmethod
     def peakdetect(cls, y_axis, x_axis=None, lookahead=200, delta=0):
@@ -160,94 +441,272 @@ class Data:
             results to unpack one of the lists into x, y coordinates do:
             x, y = zip(*max_peaks)
         """
-        max_peaks = []
-        min_peaks = []
-        dump = []  # Used to pop the first hit which almost always is false
-
         # check input data
         x_axis, y_axis = cls._datacheck_peakdetect(x_axis, y_axis)
-        # store data length for later use
-        length = len(y_axis)
+        return cls._peakdetect_rows(y_axis[np.newaxis, :], x_axis, lookahead, delta)[0]
 
+    @classmethod
+    def peakdetect_batch(cls, y_matrix, x_axis=None, lookahead=200, delta=0):
+        """
+        Peak detection for every row of 'y_matrix' (e.g. an XIC matrix 'targets x scans') at once.
+        Sliding window maxima and minima are calculated for all rows together.
+        Returns: list with [max_peaks, min_peaks] for every row (same as 'peakdetect')
+        """
+        y_matrix = np.asarray(y_matrix)
+        if y_matrix.ndim != 2:
+            raise ValueError("y_matrix must be a 2-D array")
+        x_axis = np.arange(y_matrix.shape[1]) if x_axis is None else np.asarray(x_axis)
+        if len(x_axis) != y_matrix.shape[1]:
+            raise ValueError("Input vectors y_axis and x_axis must have same length")
+        return cls._peakdetect_rows(y_matrix, x_axis, lookahead, delta)
+
+    @classmethod
+    def _peakdetect_rows(cls, y_matrix, x_axis, lookahead, delta):
+        """
+        Vectorized peak detection, same results as the former loop over every point of the signal:
+        The jitter check 'no higher value within lookahead' becomes a sliding window maximum (minimum) in O(n),
+        the next peak is searched with running maxima (minima) on growing blocks of the signal.
+        """
         # perform some checks
         if lookahead < 1:
             raise ValueError("Lookahead must be '1' or above in value")
         if not (np.isscalar(delta) and delta >= 0):
             raise ValueError("delta must be a positive number")
 
-        # maxima and minima candidates are temporarily stored in
-        # _max and _min respectively
-        _min, _max = np.inf, -np.inf
-        min_pos, max_pos = np.nan, np.nan
-
         # Only detect peak if there is 'lookahead' amount of points after it
-        for index, (x, y) in enumerate(zip(x_axis[:-lookahead],
-                                           y_axis[:-lookahead])):
-            this = y
-            if this > _max:
-                _max = this
-                max_pos = x
-            if this < _min:
-                _min = this
-                min_pos = x
+        end = y_matrix.shape[1] - lookahead
+        if end <= 0:
+            return [[[], []] for _ in range(len(y_matrix))]
+        window_max = cls.sliding_max(y_matrix, lookahead)[:, :end]
+        window_min = cls.sliding_min(y_matrix, lookahead)[:, :end]
+
+        results = []
+        for y_axis, row_max, row_min in zip(y_matrix, window_max, window_min):
+            y = y_axis[:end]
+            max_peaks = []
+            min_peaks = []
+
+            # The loop starts with the global maximum and minimum as candidates. The first hit
+            # is therefore always false and removed: it only decides, which kind of peak comes next.
+            _max, _min = y.max(), y.min()
+            hits = np.flatnonzero(((y < _max - delta) & (row_max < _max)) | ((y > _min + delta) & (row_min > _min)))
+            if len(hits) == 0:
+                results.append([max_peaks, min_peaks])
+                continue
+            index = hits[0]
+            look_for_max = not (y[index] < _max - delta and row_max[index] < _max)
+
+            # Minima are searched as maxima of the negated signal
+            signals = {True: (y, row_max), False: (-y, -row_min)}
+            while True:
+                signal, signal_window_max = signals[look_for_max]
+                found = cls._next_peak(signal, signal_window_max, index + 1, end, delta)
+                if found is None:
+                    break
+                index, position = found
+                peaks = max_peaks if look_for_max else min_peaks
+                peaks.append([x_axis[position], y_axis[position]])
+                look_for_max = not look_for_max
+            results.append([max_peaks, min_peaks])
+        return results
 
-        # Only detect peak if there is 'lookahead' amount of points after it
-        for index, (x, y) in enumerate(zip(x_axis[:-lookahead],
-                                           y_axis[:-lookahead])):
-            if y > _max:
-                _max = y
-                max_pos = x
-            if y < _min:
-                _min = y
-                min_pos = x
-
-            # # # # look for max # # # #
-            if y < _max - delta and _max != np.inf:
-                # Maxima peak candidate found
-                # look ahead in signal to ensure that this is a peak and not jitter
-                if y_axis[index:index + lookahead].max() < _max:
-                    max_peaks.append([max_pos, _max])
-                    dump.append(True)
-                    # set algorithm to only find minima now
-                    _max = np.inf
-                    _min = np.inf
-                    if index + lookahead >= length:
-                        # end is within lookahead no more peaks can be found
-                        break
+    @staticmethod
+    def _next_peak(y, window_max, start, end, delta, block=64):
+        """
+        First index i >= start, where the running maximum of y[start:i + 1] is confirmed as peak:
+        y[i] < maximum - delta and window_max[i] < maximum.
+        Returns (i, position of the maximum) or None
+        """
+        first = start
+        carry = -np.inf
+        while start < end:
+            stop = min(start + block, end)
+            running = np.maximum(np.maximum.accumulate(y[start:stop]), carry)
+            hits = np.flatnonzero((y[start:stop] < running - delta) & (window_max[start:stop] < running))
+            if len(hits):
+                index = start + hits[0]
+                return index, first + np.argmax(y[first:index + 1])
+            carry = running[-1]
+            start = stop
+            block *= 2
+        return None
+
+    @staticmethod
+    def sliding_max(values, window):
+        """Maximum of values[..., i:i + window] for every i along the last axis in O(n) (van Herk/Gil-Werman)"""
+        return Data._sliding_reduce(values, window, np.maximum, -np.inf)
+
+    @staticmethod
+    def sliding_min(values, window):
+        """Minimum of values[..., i:i + window] for every i along the last axis in O(n) (van Herk/Gil-Werman)"""
+        return Data._sliding_reduce(values, window, np.minimum, np.inf)
+
+    @staticmethod
+    def _sliding_reduce(values, window, ufunc, fill):
+        """Windows at the end of the signal are shorter"""
+        values = np.asarray(values, dtype=np.float64)
+        length = values.shape[-1]
+        blocks = -(-(length + window - 1) // window)
+        padded = np.full(values.shape[:-1] + (blocks * window,), fill)
+        padded[..., :length] = values
+        shaped = padded.reshape(values.shape[:-1] + (blocks, window))
+        prefix = ufunc.accumulate(shaped, axis=-1).reshape(padded.shape)
+        suffix = ufunc.accumulate(shaped[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+        return ufunc(suffix[..., :length], prefix[..., window - 1:window - 1 + length])
+
+    @classmethod
+    def peak_table(cls, y_axis, x_axis, max_peaks, min_peaks):
+        """
+        Describe every peak of 'max_peaks' (results of 'peakdetect') by array operations:
+        boundaries are the neighbouring minima of 'min_peaks' (or the ends of the signal),
+        the baseline is the straight line between the boundaries,
+        area is the trapezoidal integral above the baseline,
+        FWHM is the width at half height above the baseline (linear interpolation),
+        signal-to-noise is the height above the baseline divided by the noise of the signal.
+        'x_axis' has to be ascending (e.g. Summary.elution_times).
+        Returns: PeakTable with one array entry per peak
+        """
+        x, y = cls._datacheck_peakdetect(x_axis, y_axis)
+        x = x.astype(np.float64)
+        y = y.astype(np.float64)
+        apex = np.searchsorted(x, [position for position, _ in max_peaks]).astype(np.int64)
+        minima = np.sort(np.searchsorted(x, [position for position, _ in min_peaks])).astype(np.int64)
+        if len(apex) == 0 or len(y) < 2:
+            return PeakTable(*[np.empty(0) for _ in PeakTable._fields])
+
+        # Boundaries: last minimum before and first minimum after the apex
+        before = np.searchsorted(minima, apex, side='left') - 1
+        after = np.searchsorted(minima, apex, side='right')
+        start = np.where(before >= 0, minima[np.maximum(before, 0)], 0) if len(minima) else np.zeros_like(apex)
+        end = np.where(after < len(minima), minima[np.minimum(after, len(minima) - 1)], len(y) - 1) \
+            if len(minima) else np.full_like(apex, len(y) - 1)
+
+        # Linear baseline between the boundaries
+        slope = np.zeros(len(apex))
+        np.divide(y[end] - y[start], x[end] - x[start], out=slope, where=x[end] != x[start])
+        baseline = y[start] + slope * (x[apex] - x[start])
+        height = y[apex] - baseline
+
+        # Trapezoidal area above the baseline from cumulative integral
+        integral = np.concatenate(([0.0], np.cumsum(np.diff(x) * (y[1:] + y[:-1]) / 2)))
+        area = integral[end] - integral[start] - (y[start] + y[end]) / 2 * (x[end] - x[start])
+
+        # Full width at half maximum: last point below half height left of apex, first one right of apex
+        half = baseline + height / 2
+        left_index = cls._segment_crossing(y, half, start, apex, last=True)
+        right_index = cls._segment_crossing(y, half, apex, end, last=False)
+        left = np.where(left_index >= 0,
+                        cls._interpolate(x, y, np.maximum(left_index, 0), np.maximum(left_index, 0) + 1, half),
+                        x[start])
+        right = np.where(right_index >= 0,
+                         cls._interpolate(x, y, np.maximum(right_index, 1) - 1, np.maximum(right_index, 1), half),
+                         x[end])
+
+        noise = cls.noise_level(y)
+        signal_to_noise = np.full(len(apex), np.inf)
+        if noise > 0:
+            signal_to_noise = height / noise
+
+        return PeakTable(apex_time=x[apex],
+                         apex_height=y[apex],
+                         start_time=x[start],
+                         end_time=x[end],
+                         baseline=baseline,
+                         area=area,
+                         fwhm=right - left,
+                         signal_to_noise=signal_to_noise)
+
+    @classmethod
+    def find_features(cls, data, mass_bin=1.0, lookahead=50, min_signal_to_noise=3.0, max_features=None,
+                      max_cells=20_000_000, conditioner=None):
+        """
+        Untargeted feature detection: one XIC for every m/z bin of width 'mass_bin' with counts,
+        peak detection for blocks of XICs at once ('peakdetect_batch') and a peak table for every XIC.
+        XICs are extracted in blocks of at most 'max_cells' values (XICs x scans) to limit memory.
+        With 'conditioner' (e.g. Signal.SignalConditioner) peaks are detected in the conditioned XICs.
+        Returns: Features (one array entry per peak with signal-to-noise >= 'min_signal_to_noise'),
+        ranked by area, at most 'max_features' entries
+        """
+        if cls.is_lines(data):
+            data = Dataset.from_lines(data)
+        elif not isinstance(data, Dataset):
+            data = Dataset.concatenate(cls.iter_chunks(data))
+        if mass_bin <= 0:
+            raise ValueError("mass_bin must be greater than 0")
+
+        # m/z bins with counts, half-open windows [center - mass_bin/2, center + mass_bin/2)
+        centers = np.unique(np.floor(data.ion_masses / mass_bin + 0.5)) * mass_bin
+        lower_limits = centers - mass_bin / 2
+        upper_limits = np.nextafter(centers + mass_bin / 2, -np.inf)
+        order = np.argsort(data.elution_times, kind='stable')  # peak table needs ascending times
+        elution_times = data.elution_times[order]
+        rows_per_block = max(1, max_cells // max(len(data), 1))
+        cls.logger.info(f"Feature detection in {len(centers)} m/z bins of {mass_bin} Da "
+                        f"({len(data)} scans, {rows_per_block} XICs per block).")
+
+        found = {name: [] for name in Features._fields}
+        for first in range(0, len(centers), rows_per_block):
+            last = first + rows_per_block
+            xics = cls.extract_xics_indexed(data, lower_limits[first:last], upper_limits[first:last])[:, order]
+            if conditioner is not None:
+                xics = conditioner.apply(xics)
+            for mass, xic, (max_peaks, min_peaks) in zip(centers[first:last], xics,
+                                                         cls.peakdetect_batch(xics, elution_times, lookahead)):
+                if not max_peaks:
                     continue
-                # else:  #slows shit down this does
-                #    _max = ahead
-                #    max_pos = x_axis[np.where(y_axis[index:index+lookahead]==_max)]
-
-            # # # # look for min # # # #
-            if y > _min + delta and _min != -np.inf:
-                # Minima peak candidate found
-                # look ahead in signal to ensure that this is a peak and not jitter
-                if y_axis[index:index + lookahead].min() > _min:
-                    min_peaks.append([min_pos, _min])
-                    dump.append(False)
-                    # set algorithm to only find maxima now
-                    _min = -np.inf
-                    _max = -np.inf
-                    if index + lookahead >= length:
-                        # end is within lookahead no more peaks can be found
-                        break
-                # else:  #slows shit down this does
-                #    _min = ahead
-                #    min_pos = x_axis[np.where(y_axis[index:index+lookahead]==_min)]
-
-        # Remove the false hit on the first value of the y_axis
-        try:
-            if dump[0]:
-                max_peaks.pop(0)
-            else:
-                min_peaks.pop(0)
-            del dump
-        except IndexError:
-            # no peaks were found, should the function return empty lists?
-            pass
-
-        return [max_peaks, min_peaks]
+                table = cls.peak_table(xic, elution_times, max_peaks, min_peaks)
+                found['mass'].append(np.full(len(table.apex_time), mass))
+                found['retention_time'].append(table.apex_time)
+                found['area'].append(table.area)
+                found['signal_to_noise'].append(table.signal_to_noise)
+                found['apex_height'].append(table.apex_height)
+                found['fwhm'].append(table.fwhm)
+
+        features = Features(**{name: np.concatenate(values) if values else np.empty(0)
+                               for name, values in found.items()})
+        keep = np.flatnonzero(features.signal_to_noise >= min_signal_to_noise)
+        ranking = keep[np.argsort(-features.area[keep], kind='stable')][:max_features]
+        cls.logger.info(f"{len(ranking)} features found ({len(features.area)} peaks in total).")
+        return Features(*[values[ranking] for values in features])
+
+    @staticmethod
+    def _segment_crossing(y, limits, starts, ends, last):
+        """
+        For every segment y[starts[k]:ends[k] + 1] the last (or first) index with y <= limits[k], -1 if none.
+        All segments are processed together by segment reductions.
+        """
+        lengths = ends - starts + 1
+        segment_starts = np.cumsum(lengths) - lengths
+        indices = np.arange(lengths.sum()) - np.repeat(segment_starts - starts, lengths)
+        below = y[indices] <= np.repeat(limits, lengths)
+        if last:
+            return np.maximum.reduceat(np.where(below, indices, -1), segment_starts)
+        first = np.minimum.reduceat(np.where(below, indices, len(y)), segment_starts)
+        return np.where(first < len(y), first, -1)
+
+    @staticmethod
+    def _interpolate(x, y, index1, index2, level):
+        """x value, where the straight line between point index1 and point index2 reaches 'level'"""
+        dy = y[index2] - y[index1]
+        fraction = np.zeros(len(index1))
+        np.divide(level - y[index1], dy, out=fraction, where=dy != 0)
+        return x[index1] + fraction * (x[index2] - x[index1])
+
+    @staticmethod
+    def noise_level(y):
+        """
+        Robust noise estimate (standard deviation) from the median absolute deviation of first differences.
+        Sparse signals (mostly constant, e.g. XICs or baseline corrected traces) have a median absolute deviation
+        of 0, then the mean absolute deviation is used.
+        """
+        differences = np.diff(np.asarray(y, dtype=np.float64))
+        if len(differences) == 0:
+            return 0.0
+        deviations = np.abs(differences - np.median(differences))
+        mad = np.median(deviations)
+        if mad > 0:
+            return float(1.4826 * mad / np.sqrt(2))
+        return float(1.2533 * deviations.mean() / np.sqrt(2))
 
     @classmethod
     def _datacheck_peakdetect(cls, x_axis, y_axis):
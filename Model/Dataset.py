@@ -0,0 +1,285 @@
+from collections import namedtuple
+import itertools
+import logging
+import numpy as np
+
+from Model.IntensityMap import IntensityMap
+
+__all__ = ['Dataset', 'MassBinning']
+Line = namedtuple('Line', ['elution_time', 'mass_count_list'])
+MassCount = namedtuple('MassCount', ['mass', 'count'])
+MassIndex = namedtuple('MassIndex', ['masses', 'counts', 'scan_ids'])
+TimeIndex = namedtuple('TimeIndex', ['elution_times', 'offsets', 'masses', 'counts'])
+
+
+class MassBinning:
+    """
+    Fixed-precision m/z binning: masses are stored as integer bin indices.
+    Bins have a fixed width in Dalton ('width') or a width proportional to the mass ('ppm').
+    """
+
+    def __init__(self, width=0.0, ppm=0.0):
+        if (width > 0) == (ppm > 0):
+            raise ValueError("Exactly one of 'width' (Da) and 'ppm' must be greater than 0")
+        self.width = float(width)
+        self.ppm = float(ppm)
+        self._log_factor = np.log1p(self.ppm * 1e-6) if self.ppm else 0.0
+
+    def __repr__(self):
+        return f"{type(self).__name__}(width={self.width}, ppm={self.ppm})"
+
+    def __eq__(self, other):
+        return isinstance(other, MassBinning) and (self.width, self.ppm) == (other.width, other.ppm)
+
+    def as_dict(self):
+        return {'width': self.width, 'ppm': self.ppm}
+
+    def to_bins(self, masses):
+        """Integer bin index for every mass (nearest bin center)"""
+        masses = np.asarray(masses, dtype=np.float64)
+        if self.width:
+            return np.floor(masses / self.width + 0.5).astype(np.int64)
+        return np.floor(np.log(np.maximum(masses, 1e-12)) / self._log_factor + 0.5).astype(np.int64)
+
+    def centers(self, bins):
+        """Mass of the bin center for every bin index"""
+        bins = np.asarray(bins)
+        if self.width:
+            return bins * self.width
+        return np.exp(bins * self._log_factor)
+
+
+class Dataset:
+    """
+    Columnar storage of parsed HPLC-MS scans in CSR layout:
+    'elution_times' holds one entry per scan, the masses and counts of scan i are
+    'masses[offsets[i]:offsets[i + 1]]' and 'counts[offsets[i]:offsets[i + 1]]'.
+    Iterating over a Dataset yields 'Line' namedtuples for compatibility with the tuple format.
+    With 'mass_binning' the masses are stored as integer bin indices: 'mass_bins' are given (masses None)
+    or 'masses' are binned on creation. 'masses' returns the bin centers (computed once on first use).
+    Compact arrays are kept as given: float32 masses, float32 or uint32 counts, int32 offsets (see 'astype').
+    All other inputs are stored as float64 (int64 offsets), the reference precision.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+    _ids = itertools.count(1)
+    mass_dtypes = (np.float64, np.float32)
+    count_dtypes = (np.float64, np.float32, np.uint32)
+    offset_dtypes = (np.int64, np.int32)
+
+    def __init__(self, elution_times, offsets, masses, counts, source_filename="", mass_binning=None,
+                 mass_bins=None):
+        self.id = next(Dataset._ids)  # unique per instance, e.g. for keys of cached results
+        self.elution_times = np.asarray(elution_times, dtype=np.float64)
+        self.offsets = self._as_array(offsets, self.offset_dtypes)
+        self.mass_binning = mass_binning
+        self.mass_bins = None
+        self._masses = None  # masses or cached bin centers
+        if mass_bins is not None:
+            if mass_binning is None or masses is not None:
+                raise ValueError("'mass_bins' need a 'mass_binning' and no 'masses'")
+            self.mass_bins = np.asarray(mass_bins, dtype=np.int64)
+        elif mass_binning is not None:
+            self.mass_bins = mass_binning.to_bins(masses)
+        else:
+            self._masses = self._as_array(masses, self.mass_dtypes)
+        self.counts = self._as_array(counts, self.count_dtypes)
+        self.source_filename = source_filename
+        self._mass_index = None
+        self._time_index = None
+        self._ion_masses = None
+        self._intensity_map = None
+        if len(self.offsets) != len(self.elution_times) + 1:
+            raise ValueError("Offsets must contain one entry more than elution_times")
+        if len(self.mass_values) != len(self.counts) or self.offsets[-1] != len(self.counts):
+            raise ValueError("Masses and counts must have the length given by the last offset")
+
+    @classmethod
+    def from_mass_values(cls, elution_times, offsets, mass_values, counts, source_filename="", mass_binning=None):
+        """Create a Dataset from the stored mass column 'mass_values' (integer bins, if 'mass_binning' is given)"""
+        if mass_binning is None:
+            return cls(elution_times, offsets, mass_values, counts, source_filename)
+        return cls(elution_times, offsets, None, counts, source_filename, mass_binning, mass_bins=mass_values)
+
+    @staticmethod
+    def _as_array(values, dtypes):
+        """Array of 'values', converted to dtypes[0] (the reference dtype), if its dtype is not one of 'dtypes'"""
+        array = np.asarray(values)
+        return array if array.dtype in dtypes else array.astype(dtypes[0])
+
+    def __len__(self):
+        return len(self.elution_times)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.line(index)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(scans={len(self)}, points={self.number_of_points}, " \
+               f"nbytes={self.nbytes})"
+
+    @property
+    def masses(self):
+        """Mass of every (mass, count) pair (bin centers, if masses are binned, computed once on first use)"""
+        if self._masses is None:
+            self._masses = self.mass_binning.centers(self.mass_bins)
+        return self._masses
+
+    @property
+    def mass_values(self):
+        """Stored mass column: integer bin indices, if masses are binned, else masses"""
+        return self._masses if self.mass_bins is None else self.mass_bins
+
+    @property
+    def number_of_points(self):
+        """Total number of (mass, count) pairs in all scans"""
+        return len(self.counts)
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays of this dataset"""
+        return self.elution_times.nbytes + self.offsets.nbytes + self.mass_values.nbytes + self.counts.nbytes
+
+    @property
+    def masses_per_scan(self):
+        """Number of (mass, count) pairs for every scan"""
+        return np.diff(self.offsets)
+
+    @property
+    def scan_ids(self):
+        """Scan number for every (mass, count) pair"""
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.masses_per_scan)
+
+    @property
+    def mass_index(self):
+        """All points sorted by mass together with their counts and scan ids. Built once on first use."""
+        if self._mass_index is None:
+            masses = self.masses
+            order = np.argsort(masses, kind='stable')
+            self._mass_index = MassIndex(masses=masses[order],
+                                         counts=self.counts[order],
+                                         scan_ids=self.scan_ids[order])
+            self.logger.debug(f"Mass index built for {self.number_of_points} points.")
+        return self._mass_index
+
+    @property
+    def time_index(self):
+        """
+        Scans sorted by elution time in CSR layout, so a time window is a contiguous slice of scans and points.
+        Shares the arrays of the dataset, if scans are already in time order. Built once on first use.
+        Masses are given as stored ('mass_values').
+        """
+        if self._time_index is None:
+            if np.all(np.diff(self.elution_times) >= 0):
+                self._time_index = TimeIndex(self.elution_times, self.offsets, self.mass_values, self.counts)
+            else:
+                order = np.argsort(self.elution_times, kind='stable')
+                sizes = self.masses_per_scan[order]
+                offsets = np.zeros(len(self) + 1, dtype=np.int64)
+                np.cumsum(sizes, out=offsets[1:])
+                # positions of the points of all scans in time order
+                points = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - self.offsets[:-1][order], sizes)
+                self._time_index = TimeIndex(self.elution_times[order], offsets,
+                                             self.mass_values[points], self.counts[points])
+                self.logger.debug(f"Time index built for {len(self)} unsorted scans.")
+        return self._time_index
+
+    @property
+    def ion_masses(self):
+        """Sorted distinct masses of all scans. Computed once on first use."""
+        if self._ion_masses is None:
+            if self.mass_bins is None:
+                self._ion_masses = np.unique(self.masses)
+            else:
+                self._ion_masses = self.mass_binning.centers(np.unique(self.mass_bins))
+        return self._ion_masses
+
+    @property
+    def intensity_map(self):
+        """Binned 'elution time x mass' matrix with summed-area table. Built once on first use."""
+        if self._intensity_map is None:
+            self._intensity_map = IntensityMap(self)
+        return self._intensity_map
+
+    def line(self, index):
+        """Returns scan 'index' in tuple format: Line(elution_time, [MassCount, ...])"""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        masses = self.mass_values[start:end]
+        if self.mass_bins is not None:
+            masses = self.mass_binning.centers(masses)
+        return Line(float(self.elution_times[index]),
+                    [MassCount(mass, count) for mass, count in zip(masses.tolist(),
+                                                                   self.counts[start:end].tolist())])
+
+    def scans(self, start, stop):
+        """Returns scans 'start' to 'stop' (exclusive) as new Dataset sharing the mass and count arrays"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        offsets = self.offsets[start:stop + 1]
+        return Dataset.from_mass_values(self.elution_times[start:stop], offsets - offsets[0],
+                                        self.mass_values[offsets[0]:offsets[-1]], self.counts[offsets[0]:offsets[-1]],
+                                        self.source_filename, self.mass_binning)
+
+    def astype(self, mass_dtype='float64', count_dtype='float64', offset_dtype='int64'):
+        """
+        Returns a new Dataset with masses, counts and offsets converted, e.g. astype('float32', 'uint32', 'int32')
+        needs 12 instead of 24 bytes per point. uint32 counts are rounded to the nearest integer.
+        Binned masses stay int64 bins, for them only 'mass_dtype' float64 is accepted.
+        """
+        mass_dtype, count_dtype, offset_dtype = np.dtype(mass_dtype), np.dtype(count_dtype), np.dtype(offset_dtype)
+        if mass_dtype not in self.mass_dtypes or count_dtype not in self.count_dtypes \
+                or offset_dtype not in self.offset_dtypes:
+            raise ValueError(f"Unsupported dtypes: masses {mass_dtype}, counts {count_dtype}, offsets {offset_dtype}")
+        if self.mass_bins is not None and mass_dtype != np.float64:
+            raise ValueError(f"Binned masses are stored as integer bins, mass_dtype {mass_dtype} is not possible")
+        if offset_dtype == np.int32 and self.number_of_points > np.iinfo(np.int32).max:
+            raise ValueError("Too many points for int32 offsets")
+        counts = self.counts
+        if count_dtype == np.uint32 and counts.dtype != np.uint32:
+            if np.any(counts < 0) or np.any(counts > np.iinfo(np.uint32).max):
+                raise ValueError("Counts out of range for uint32")
+            counts = np.rint(counts)
+        masses = self.mass_values if self.mass_bins is not None else self.masses.astype(mass_dtype, copy=False)
+        return Dataset.from_mass_values(self.elution_times, self.offsets.astype(offset_dtype, copy=False), masses,
+                                        counts.astype(count_dtype, copy=False), self.source_filename,
+                                        self.mass_binning)
+
+    def binned(self, mass_binning):
+        """Returns a new Dataset with masses stored as integer bins of 'mass_binning'"""
+        return Dataset(self.elution_times, self.offsets, self.masses, self.counts,
+                       self.source_filename, mass_binning)
+
+    def to_lines(self):
+        """Returns all scans in tuple format [Line, Line, ...]"""
+        return list(self)
+
+    @classmethod
+    def from_lines(cls, lines, source_filename=""):
+        """Create a Dataset from tuple format [Line, Line, ...]"""
+        elution_times = [line.elution_time for line in lines]
+        offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(line.mass_count_list) for line in lines])
+        masses = [item.mass for line in lines for item in line.mass_count_list]
+        counts = [item.count for line in lines for item in line.mass_count_list]
+        return cls(elution_times, offsets, masses, counts, source_filename)
+
+    @classmethod
+    def concatenate(cls, datasets, source_filename=""):
+        """Join several datasets (e.g. parsed blocks of one file, same mass binning) in the given order"""
+        datasets = list(datasets)
+        if not datasets:
+            return cls([], [0], [], [], source_filename)
+        mass_binning = datasets[0].mass_binning
+        if any(dataset.mass_binning != mass_binning for dataset in datasets):
+            raise ValueError("Datasets with different mass binning can not be joined")
+        point_shift = np.cumsum([0] + [dataset.number_of_points for dataset in datasets[:-1]])
+        offsets = [datasets[0].offsets[:1]] + [dataset.offsets[1:] + shift
+                                               for dataset, shift in zip(datasets, point_shift)]
+        offsets = np.concatenate(offsets)
+        offset_dtype = datasets[0].offsets.dtype
+        if offsets[-1] <= np.iinfo(offset_dtype).max:  # keep compact offsets, if all points fit
+            offsets = offsets.astype(offset_dtype, copy=False)
+        return cls.from_mass_values(np.concatenate([dataset.elution_times for dataset in datasets]),
+                                    offsets,
+                                    np.concatenate([dataset.mass_values for dataset in datasets]),
+                                    np.concatenate([dataset.counts for dataset in datasets]),
+                                    source_filename, mass_binning)
@@ -0,0 +1,79 @@
+import logging
+import numpy as np
+
+__all__ = ['Downsample']
+
+
+class Downsample:
+    """
+    Display-aware decimation of plot series (x ascending):
+    'minmax' keeps minimum and maximum of every pixel column (and both ends), so no peak disappears,
+    'lttb' (Largest-Triangle-Three-Buckets) keeps the visually most important points.
+    Series with at most 2 points per pixel are returned unchanged.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+
+    method = 'minmax'  # 'minmax', 'lttb' or 'none'
+
+    @classmethod
+    def decimate(cls, x, y, pixels, method=None):
+        """Reduce series to about 2 points per pixel with 'method' (default: class attribute 'method')"""
+        method = method or cls.method
+        if method == 'minmax':
+            return cls.min_max(x, y, pixels)
+        if method == 'lttb':
+            return cls.lttb(x, y, 2 * pixels)
+        if method == 'none':
+            return np.asarray(x), np.asarray(y)
+        raise ValueError("method must be 'minmax', 'lttb' or 'none'")
+
+    @classmethod
+    def visible(cls, x, y, x_min, x_max, pixels, method=None):
+        """Decimate only the visible range [x_min, x_max] (and one point beyond each end) in full resolution"""
+        x, y = np.asarray(x), np.asarray(y)
+        start = max(np.searchsorted(x, x_min, side='left') - 1, 0)
+        end = min(np.searchsorted(x, x_max, side='right') + 1, len(x))
+        return cls.decimate(x[start:end], y[start:end], pixels, method)
+
+    @staticmethod
+    def min_max(x, y, pixels):
+        """Minimum and maximum point of every one of 'pixels' equally wide x intervals, in order of x"""
+        x, y = np.asarray(x), np.asarray(y)
+        if len(x) <= 2 * pixels:
+            return x, y
+        edges = np.searchsorted(x, np.linspace(x[0], x[-1], pixels + 1)[1:-1])
+        starts = np.unique(np.concatenate(([0], edges)))
+        starts = starts[starts < len(x)]
+        bucket_ids = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(x))))
+
+        # First position of the minimum and of the maximum in every bucket
+        is_min = y == np.minimum.reduceat(y, starts)[bucket_ids]
+        is_max = y == np.maximum.reduceat(y, starts)[bucket_ids]
+        first_min = np.flatnonzero(is_min)[np.unique(bucket_ids[is_min], return_index=True)[1]]
+        first_max = np.flatnonzero(is_max)[np.unique(bucket_ids[is_max], return_index=True)[1]]
+        keep = np.unique(np.concatenate(([0], first_min, first_max, [len(x) - 1])))
+        return x[keep], y[keep]
+
+    @staticmethod
+    def lttb(x, y, threshold):
+        """Largest-Triangle-Three-Buckets: 'threshold' points, first and last point are always kept"""
+        x, y = np.asarray(x), np.asarray(y)
+        if threshold >= len(x) or threshold < 3:
+            return x, y
+        x_float, y_float = x.astype(np.float64), y.astype(np.float64)
+        edges = np.linspace(1, len(x) - 1, threshold - 1).astype(np.int64)  # buckets between first and last
+        keep = np.empty(threshold, dtype=np.int64)
+        keep[0], keep[-1] = 0, len(x) - 1
+        selected = 0
+        for bucket in range(threshold - 2):
+            start, end = edges[bucket], edges[bucket + 1]
+            next_end = edges[bucket + 2] if bucket + 2 < len(edges) else len(x)
+            # Third vertex: mean of the next bucket
+            mean_x = x_float[end:next_end].mean()
+            mean_y = y_float[end:next_end].mean()
+            # Point of this bucket, which spans the largest triangle with the selected point and the mean
+            areas = np.abs((x_float[selected] - mean_x) * (y_float[start:end] - y_float[selected])
+                           - (x_float[selected] - x_float[start:end]) * (mean_y - y_float[selected]))
+            selected = start + int(np.argmax(areas))
+            keep[bucket + 1] = selected
+        return x[keep], y[keep]
@@ -0,0 +1,258 @@
+from collections import namedtuple
+from pathlib import Path
+import importlib.util
+import itertools
+import json
+import logging
+import time
+import zipfile
+import numpy as np
+
+from Model.Dataset import Dataset
+from Model.Data import Data
+
+__all__ = ['Export', 'ExportTable']
+# 'chunks()' returns a new iterator of chunks, every chunk is a list of arrays in order of 'columns',
+# 'dtypes' are the dtypes of the columns (also for tables without rows)
+ExportTable = namedtuple('ExportTable', ['name', 'columns', 'rows', 'chunks', 'dtypes'])
+
+
+class Export:
+    """
+    Export of Summary, traces, peak table and parsed scans in columnar formats:
+    'npz' (NumPy, one file), 'csv' (delimited text, one file per table),
+    'parquet' and 'arrow' (Arrow IPC, one file per table, only if pyarrow is installed).
+    All writers stream the tables chunk by chunk, so the scans of a ChunkStore are never loaded as a whole.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+
+    formats = ('npz', 'csv', 'parquet', 'arrow')
+    suffixes = {'npz': '.npz', 'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+    chunk_rows = 1000000  # rows per written chunk
+    delimiter = ','
+
+    @classmethod
+    def apply_settings(cls, settings):
+        """Set export settings from [EXPORT] of 'settings' (configparser of config.ini)"""
+        if not settings.has_section('EXPORT'):
+            return
+        cls.chunk_rows = settings['EXPORT'].getint('chunk_rows', fallback=cls.chunk_rows)
+        cls.delimiter = settings['EXPORT'].get('csv_delimiter', fallback=cls.delimiter) or cls.delimiter
+        return
+
+    @staticmethod
+    def pyarrow_available():
+        return importlib.util.find_spec('pyarrow') is not None
+
+    @classmethod
+    def available_formats(cls):
+        """Formats, which can be written with the installed packages"""
+        return [name for name in cls.formats if name in ('npz', 'csv') or cls.pyarrow_available()]
+
+    @staticmethod
+    def result_basename(filename, folder=None):
+        """Path of the export files without suffix: (folder or path of 'filename')/HPLC_MS_filename"""
+        return Path(folder or Path(filename).parent, f'HPLC_MS_{Path(filename).name}')
+
+    @staticmethod
+    def metadata(source_filename, mass=0, mass_interval=0, time=0, time_interval=0):
+        """Metadata of the export files: source file and parameters of the traces (mass or time 0: no trace)"""
+        metadata = {'source': str(source_filename)}
+        if mass:
+            metadata.update(mass=mass, mass_interval=mass_interval)
+        if time:
+            metadata.update(time=time, time_interval=time_interval)
+        return metadata
+
+    @classmethod
+    def tables(cls, summary, mass_trace=None, elution_time_trace=None, peak_table=None, data=None):
+        """
+        Tables of an analysis: 'counts_per_time' (with mass trace), 'counts_per_mass' (with elution time trace),
+        optional 'peaks' (PeakTable) and 'scans' (one row per (mass, count) pair of 'data').
+        Returns: [ExportTable, ...]
+        """
+        columns = {'elution_time': summary.elution_times,
+                   'total_counts': summary.total_counts_per_time,
+                   'total_masses': summary.total_masses_per_time,
+                   'number_of_masses': summary.number_of_masses_per_time,
+                   'max_mass': summary.max_mass_per_time,
+                   'min_mass': summary.min_mass_per_time}
+        if mass_trace is not None:
+            columns['mass_trace'] = mass_trace
+        tables = [cls.array_table('counts_per_time', columns)]
+
+        columns = {'ion_mass': summary.ion_masses,
+                   'total_counts': summary.total_counts_per_mass}
+        if elution_time_trace is not None:
+            columns['elution_time_trace'] = elution_time_trace
+        tables.append(cls.array_table('counts_per_mass', columns))
+
+        if peak_table is not None:
+            tables.append(cls.array_table('peaks', peak_table._asdict()))
+        if data is not None:
+            tables.append(cls.scan_table(data))
+        return tables
+
+    @classmethod
+    def array_table(cls, name, columns):
+        """ExportTable of equally long arrays 'columns' {column name: array}, chunks are slices (no copies)"""
+        arrays = [np.asarray(values) for values in columns.values()]
+        rows = len(arrays[0]) if arrays else 0
+        if any(len(array) != rows for array in arrays):
+            raise ValueError(f"Columns of table '{name}' differ in length")
+
+        def chunks():
+            for start in range(0, rows, cls.chunk_rows):
+                yield [array[start:start + cls.chunk_rows] for array in arrays]
+
+        return ExportTable(name, list(columns), rows, chunks, [array.dtype for array in arrays])
+
+    @classmethod
+    def scan_table(cls, data):
+        """
+        ExportTable 'scans' of a Dataset, ChunkStore or list of Lines: columns scan, elution_time, mass, count.
+        Chunks of the ChunkStore are loaded one at a time, every chunk is written in slices of 'chunk_rows' points.
+        """
+        if Data.is_lines(data):
+            data = Dataset.from_lines(data)
+        first = next(iter(Data.iter_chunks(data)), None)  # dtypes of the stored arrays (memory-mapped chunk)
+        mass_dtype = np.float64 if first is None or first.mass_binning is not None else first.mass_values.dtype
+        count_dtype = np.float64 if first is None else first.counts.dtype
+        dtypes = [np.dtype(np.intp), np.dtype(np.float64), np.dtype(mass_dtype), np.dtype(count_dtype)]
+
+        def chunks():
+            first_scan = 0
+            for chunk in Data.iter_chunks(data):
+                offsets = np.asarray(chunk.offsets)
+                for start in range(0, chunk.number_of_points, cls.chunk_rows):
+                    stop = min(start + cls.chunk_rows, chunk.number_of_points)
+                    scan = np.searchsorted(offsets, np.arange(start, stop), side='right') - 1
+                    masses = chunk.mass_values[start:stop]
+                    if chunk.mass_binning is not None:
+                        masses = chunk.mass_binning.centers(masses)
+                    yield [scan + first_scan, chunk.elution_times[scan], masses, chunk.counts[start:stop]]
+                first_scan += len(chunk)
+
+        return ExportTable('scans', ['scan', 'elution_time', 'mass', 'count'], data.number_of_points, chunks, dtypes)
+
+    @classmethod
+    def filenames(cls, base_filename, export_format, tables):
+        """Files written for 'tables': one '.npz' file or one file per table 'base_filename_<table><suffix>'"""
+        base_filename = Path(base_filename)
+        suffix = cls.suffixes[export_format]
+        if export_format == 'npz':
+            return [base_filename.with_name(base_filename.name + suffix)]
+        return [base_filename.with_name(f"{base_filename.name}_{table.name}{suffix}") for table in tables]
+
+    @classmethod
+    def write(cls, tables, base_filename, export_format='npz', metadata=None):
+        """
+        Write 'tables' in 'export_format' next to 'base_filename' (path without suffix).
+        'metadata' (dict, e.g. source file and trace parameters) is stored in npz, parquet and arrow files.
+        Returns: list of written files
+        """
+        if export_format not in cls.formats:
+            raise ValueError(f"Unknown export format '{export_format}', possible formats: {', '.join(cls.formats)}")
+        if export_format in ('parquet', 'arrow') and not cls.pyarrow_available():
+            raise ValueError(f"Export format '{export_format}' needs package 'pyarrow'")
+        start = time.perf_counter()
+        filenames = cls.filenames(base_filename, export_format, tables)
+        Path(filenames[0]).parent.mkdir(parents=True, exist_ok=True)
+        metadata = {key: str(value) for key, value in (metadata or {}).items()}
+        if export_format == 'npz':
+            cls.write_npz(tables, filenames[0], metadata)
+        else:
+            writer = {'csv': cls.write_csv, 'parquet': cls.write_parquet, 'arrow': cls.write_arrow}[export_format]
+            for table, filename in zip(tables, filenames):
+                writer(table, filename, metadata)
+        rows = sum(table.rows for table in tables)
+        seconds = max(time.perf_counter() - start, 1e-9)
+        cls.logger.info(f"Export '{export_format}': {rows} Zeilen in {len(filenames)} Datei(en) "
+                        f"in {seconds:.2f} s ({rows / seconds:.0f} rows/s).")
+        return filenames
+
+    @classmethod
+    def write_npz(cls, tables, filename, metadata):
+        """
+        One '.npz' file with arrays '<table>/<column>' (np.load(filename)['scans/mass']) and 'metadata' (JSON).
+        Every column is streamed into its '.npy' entry, the header is written first from the number of rows.
+        """
+        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            with archive.open('metadata.npy', 'w') as file:
+                np.lib.format.write_array(file, np.array(json.dumps(metadata)))
+            for table in tables:
+                for index, column in enumerate(table.columns):
+                    with archive.open(f"{table.name}/{column}.npy", 'w', force_zip64=True) as file:
+                        cls.stream_npy(file, table, index)
+        return
+
+    @staticmethod
+    def stream_npy(file, table, index):
+        """Write column 'index' of 'table' chunk by chunk as '.npy' to 'file' (dtype of the column, also if empty)"""
+        rows = 0
+        dtype = np.dtype(table.dtypes[index])
+        np.lib.format.write_array_header_2_0(file, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                    'fortran_order': False,
+                                                    'shape': (table.rows,)})
+        for chunk in table.chunks():
+            values = np.asarray(chunk[index])
+            file.write(np.ascontiguousarray(values, dtype=dtype).data)
+            rows += len(values)
+        if rows != table.rows:
+            raise ValueError(f"Table '{table.name}': {rows} rows written instead of {table.rows}")
+        return
+
+    @classmethod
+    def write_csv(cls, table, filename, metadata=None):
+        """
+        Delimited text with header line, numbers in shortest exact representation (repr of Python floats).
+        Every chunk is formatted as one string and written at once.
+        """
+        with open(filename, 'w', encoding='utf-8', newline='') as file:
+            file.write(cls.delimiter.join(table.columns) + '\n')
+            for chunk in table.chunks():
+                lines = zip(*[map(repr, np.asarray(values).tolist()) for values in chunk])
+                file.write('\n'.join(map(cls.delimiter.join, lines)))
+                file.write('\n')
+        return
+
+    @staticmethod
+    def arrow_batches(table, metadata=None):
+        """
+        pyarrow schema (with 'metadata') and iterator of record batches of 'table', one batch per chunk.
+        The schema is taken from the first chunk (from the dtypes of the columns for empty tables).
+        """
+        import pyarrow as pa  # optional dependency, only for parquet and arrow
+        chunks = table.chunks()
+        first = next(chunks, None)
+        if first is None:
+            first = [np.empty(0, dtype=dtype) for dtype in table.dtypes]
+        schema = pa.record_batch([np.asarray(values) for values in first],
+                                 names=table.columns).schema.with_metadata(metadata or {})
+
+        def batches():
+            for chunk in itertools.chain([first], chunks):
+                yield pa.record_batch([np.asarray(values) for values in chunk], schema=schema)
+
+        return schema, batches()
+
+    @classmethod
+    def write_parquet(cls, table, filename, metadata=None):
+        """Parquet file, one row group per chunk"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema, batches = cls.arrow_batches(table, metadata)
+        with pq.ParquetWriter(str(filename), schema) as writer:
+            for batch in batches:
+                writer.write_table(pa.Table.from_batches([batch], schema=schema))
+        return
+
+    @classmethod
+    def write_arrow(cls, table, filename, metadata=None):
+        """Arrow IPC file (Feather v2), one record batch per chunk"""
+        import pyarrow as pa
+        schema, batches = cls.arrow_batches(table, metadata)
+        with pa.OSFile(str(filename), 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+        return
@@ -0,0 +1,107 @@
+import logging
+import math
+import numpy as np
+
+__all__ = ['IntensityMap']
+
+
+class IntensityMap:
+    """
+    Binned 'elution time x mass' intensity matrix of a Dataset with a summed-area table (2-D prefix sum).
+    Any rectangle 'time range x mass range' is summed up in O(1).
+    Used for the heatmap view and for the approximate mode of Data.mass_trace and Data.elution_time_trace.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+
+    time_bin = 0.05  # bin width in minutes
+    mass_bin = 1.0  # bin width in Dalton
+    max_cells = 20_000_000  # dense matrix budget, bins get coarser for larger maps
+
+    def __init__(self, dataset, time_bin=None, mass_bin=None):
+        self.time_bin = time_bin or IntensityMap.time_bin
+        self.mass_bin = mass_bin or IntensityMap.mass_bin
+        times = dataset.elution_times
+        masses = dataset.masses
+        self.time_origin = float(times.min()) if len(times) else 0.0
+        self.mass_origin = float(masses.min()) if len(masses) else 0.0
+        time_span = float(times.max()) - self.time_origin if len(times) else 0.0
+        mass_span = float(masses.max()) - self.mass_origin if len(masses) else 0.0
+
+        # Coarsen bins until the dense matrix fits into 'max_cells'
+        while (math.floor(time_span / self.time_bin) + 1) * (math.floor(mass_span / self.mass_bin) + 1) \
+                > self.max_cells:
+            self.time_bin *= 2
+            self.mass_bin *= 2
+            self.logger.warning(f"Intensity map too large, bins coarsened to "
+                                f"{self.time_bin} min x {self.mass_bin} Da.")
+        self.number_of_time_bins = math.floor(time_span / self.time_bin) + 1
+        self.number_of_mass_bins = math.floor(mass_span / self.mass_bin) + 1
+
+        # Bin index of every scan and every point, then accumulate counts into the matrix
+        self.scan_bins = self.time_bins(times)
+        point_mass_bins = self.mass_bins(masses)
+        cells = np.repeat(self.scan_bins, dataset.masses_per_scan) * self.number_of_mass_bins + point_mass_bins
+        self.matrix = np.bincount(cells, weights=dataset.counts,
+                                  minlength=self.number_of_time_bins * self.number_of_mass_bins) \
+            .reshape(self.number_of_time_bins, self.number_of_mass_bins)
+
+        # Summed-area table: sat[i, j] is the sum of matrix[:i, :j]
+        self.sat = np.zeros((self.number_of_time_bins + 1, self.number_of_mass_bins + 1))
+        np.cumsum(np.cumsum(self.matrix, axis=0), axis=1, out=self.sat[1:, 1:])
+
+        # Weights to distribute binned values to single scans and single masses (share of their bin)
+        scan_totals = np.bincount(dataset.scan_ids, weights=dataset.counts, minlength=len(dataset))
+        self.scan_weights = self._shares(scan_totals, self.scan_bins, self.matrix.sum(axis=1))
+        self.ion_masses, inverse = np.unique(masses, return_inverse=True)
+        mass_totals = np.bincount(inverse, weights=dataset.counts, minlength=len(self.ion_masses))
+        self.ion_mass_bins = self.mass_bins(self.ion_masses)
+        self.ion_mass_weights = self._shares(mass_totals, self.ion_mass_bins, self.matrix.sum(axis=0))
+        self.logger.debug(f"Intensity map {self.matrix.shape} built "
+                          f"({self.time_bin} min x {self.mass_bin} Da per bin).")
+
+    @staticmethod
+    def _shares(totals, bins, bin_totals):
+        """Share of every total in the summed up total of its bin"""
+        shares = np.zeros(len(totals))
+        np.divide(totals, bin_totals[bins], out=shares, where=bin_totals[bins] != 0)
+        return shares
+
+    def time_bins(self, times):
+        """Time bin index for every elution time (clipped to the map)"""
+        bins = np.floor((np.asarray(times) - self.time_origin) / self.time_bin).astype(np.int64)
+        return np.clip(bins, 0, self.number_of_time_bins - 1)
+
+    def mass_bins(self, masses):
+        """Mass bin index for every mass (clipped to the map)"""
+        bins = np.floor((np.asarray(masses) - self.mass_origin) / self.mass_bin).astype(np.int64)
+        return np.clip(bins, 0, self.number_of_mass_bins - 1)
+
+    @property
+    def extent(self):
+        """(time_min, time_max, mass_min, mass_max) of the map, e.g. for imshow"""
+        return (self.time_origin, self.time_origin + self.number_of_time_bins * self.time_bin,
+                self.mass_origin, self.mass_origin + self.number_of_mass_bins * self.mass_bin)
+
+    def _bin_range(self, low, high, origin, width, number_of_bins):
+        """Half-open range [first, last) of bins touched by [low, high]"""
+        first = max(math.floor((low - origin) / width), 0)
+        last = min(math.floor((high - origin) / width) + 1, number_of_bins)
+        return first, max(first, last)
+
+    def total(self, time_low, time_high, mass_low, mass_high):
+        """Summed up counts of all bins touched by the rectangle [time_low, time_high] x [mass_low, mass_high]"""
+        t0, t1 = self._bin_range(time_low, time_high, self.time_origin, self.time_bin, self.number_of_time_bins)
+        m0, m1 = self._bin_range(mass_low, mass_high, self.mass_origin, self.mass_bin, self.number_of_mass_bins)
+        return self.sat[t1, m1] - self.sat[t0, m1] - self.sat[t1, m0] + self.sat[t0, m0]
+
+    def mass_trace(self, lower_limit, upper_limit):
+        """Approximate mass trace per scan: binned trace distributed by the share of every scan in its time bin"""
+        m0, m1 = self._bin_range(lower_limit, upper_limit, self.mass_origin, self.mass_bin, self.number_of_mass_bins)
+        rows = self.sat[1:, m1] - self.sat[:-1, m1] - self.sat[1:, m0] + self.sat[:-1, m0]
+        return rows[self.scan_bins] * self.scan_weights
+
+    def elution_time_trace(self, lower_limit, upper_limit):
+        """Approximate time trace per ion mass: binned trace distributed by the share of every mass in its bin"""
+        t0, t1 = self._bin_range(lower_limit, upper_limit, self.time_origin, self.time_bin, self.number_of_time_bins)
+        columns = self.sat[t1, 1:] - self.sat[t1, :-1] - self.sat[t0, 1:] + self.sat[t0, :-1]
+        return columns[self.ion_mass_bins] * self.ion_mass_weights
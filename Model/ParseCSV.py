@@ -1,12 +1,25 @@
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import codecs
 import csv
 import logging
+import multiprocessing
+import os
+import re
+import numpy as np
 
-__all__ = ['ParseCSV']
+from Model.Dataset import Dataset, MassBinning
+from Model.ChunkStore import ChunkStore
+
+__all__ = ['ParseCSV', 'ParseCancelled']
 Line = namedtuple('Line', ['elution_time', 'mass_count_list'])
 MassCount = namedtuple('MassCount', ['mass', 'count'])
 
 
+class ParseCancelled(Exception):
+    """Parsing was cancelled by setting 'ParseCSV.cancel_event'"""
+
+
 class ParseCSV:
     """
     Parse HPLC-MS raw data from special-formatted CSV files to a defined format for later analysis
@@ -25,6 +38,92 @@ class ParseCSV:
     col_number_masses = 7
     col_data_starts = 8
 
+    # Memory ceiling of the columnar parse engine: one text block is parsed at a time,
+    # parsing needs roughly 'memory_factor' bytes per character of text
+    max_chunk_mb = 256
+    memory_factor = 16
+    chunk_size = 10000  # number of scans per chunk yielded by 'iter_csv_chunks'
+    out_of_core_mb = 2048  # larger files are parsed into a ChunkStore on disk (0: never)
+
+    # Parallel parsing: number of worker processes (0: one per CPU, 1: no parallel parsing)
+    workers = 1
+    min_parallel_bytes = 4 * 1024 * 1024  # smaller files are parsed in one process
+    # Workers are started with 'spawn', not forked from a process with threads (e.g. the analysis thread of the GUI)
+    start_method = 'spawn'
+    # Fixed-precision m/z binning at parse time: masses are stored as integer bin indices (0: no binning)
+    mass_bin_width = 0.0  # bin width in Dalton
+    mass_bin_ppm = 0.0  # bin width in ppm of the mass
+
+    # Storage dtypes of parsed datasets, float64/float64/int64 is the reference precision,
+    # float32 masses, float32 or uint32 counts and int32 offsets halve the memory per point
+    mass_dtype = 'float64'
+    count_dtype = 'float64'
+    offset_dtype = 'int64'
+
+    # Settings of config.ini, which change the parse result: key of parsed files in memory and in the cache.
+    # Other settings (e.g. of peak detection) do not invalidate a parsed file.
+    parse_settings = {'CSV': ('delimiter', 'decimal', 'encoding'),
+                      'DATA': ('col_retention', 'col_number_masses', 'col_data_starts', 'mass_bin_width',
+                               'mass_bin_ppm', 'mass_dtype', 'count_dtype', 'offset_dtype')}
+    settings_attributes = ('delimiter', 'decimal', 'encoding', 'col_retention', 'col_number_masses',
+                           'col_data_starts', 'max_chunk_mb', 'memory_factor', 'mass_bin_width', 'mass_bin_ppm',
+                           'mass_dtype', 'count_dtype', 'offset_dtype')
+
+    # Progress and cancellation of the columnar engine (e.g. for a GUI), checked after every text block
+    progress = None  # optional callback progress(bytes_read, total_bytes, scans)
+    cancel_event = None  # optional threading.Event, parsing stops with ParseCancelled when it is set
+
+    @classmethod
+    def apply_settings(cls, settings):
+        """Set parse settings from [CSV] and [DATA] of 'settings' (configparser of config.ini)"""
+        cls.delimiter = settings['CSV']['delimiter']
+        cls.decimal = settings['CSV']['decimal']
+        cls.encoding = settings['CSV']['encoding']
+        cls.max_chunk_mb = settings['CSV'].getint('max_chunk_mb', fallback=cls.max_chunk_mb)
+        cls.chunk_size = settings['CSV'].getint('chunk_size', fallback=cls.chunk_size)
+        cls.workers = settings['CSV'].getint('workers', fallback=cls.workers)
+        cls.out_of_core_mb = settings['CSV'].getint('out_of_core_mb', fallback=cls.out_of_core_mb)
+
+        cls.col_retention = int(settings['DATA']['col_retention'])
+        cls.col_number_masses = int(settings['DATA']['col_number_masses'])
+        cls.col_data_starts = int(settings['DATA']['col_data_starts'])
+        cls.mass_bin_width = settings['DATA'].getfloat('mass_bin_width', fallback=0.0)
+        cls.mass_bin_ppm = settings['DATA'].getfloat('mass_bin_ppm', fallback=0.0)
+        if cls.mass_bin_width > 0 and cls.mass_bin_ppm > 0:
+            cls.logger.warning("Both mass_bin_width and mass_bin_ppm set, mass_bin_ppm is ignored.")
+            cls.mass_bin_ppm = 0.0
+        for name, choices in (('mass_dtype', ('float64', 'float32')),
+                              ('count_dtype', ('float64', 'float32', 'uint32')),
+                              ('offset_dtype', ('int64', 'int32'))):
+            value = settings['DATA'].get(name, fallback=choices[0])
+            if value not in choices:
+                cls.logger.warning(f"{name} = {value} not supported, {choices[0]} is used.")
+                value = choices[0]
+            setattr(cls, name, value)
+        if cls.mass_binning() is not None and cls.mass_dtype != 'float64':
+            cls.logger.warning(f"mass_dtype = {cls.mass_dtype} not possible for binned masses, float64 is used.")
+            cls.mass_dtype = 'float64'
+        return
+
+    @classmethod
+    def with_settings(cls, settings):
+        """Parser class with 'settings' {attribute: value} (derived class, ParseCSV itself is not changed)"""
+        return type(cls.__name__, (cls,), dict(settings))
+
+    @classmethod
+    def block_size(cls):
+        """Characters of text parsed at once, so parsing stays below about 'max_chunk_mb' MB"""
+        return max(cls.max_chunk_mb * 1024 * 1024 // cls.memory_factor, 1)
+
+    @classmethod
+    def mass_binning(cls):
+        """MassBinning from 'mass_bin_width' or 'mass_bin_ppm', None if masses are not binned"""
+        if cls.mass_bin_width > 0:
+            return MassBinning(width=cls.mass_bin_width)
+        if cls.mass_bin_ppm > 0:
+            return MassBinning(ppm=cls.mass_bin_ppm)
+        return None
+
     @classmethod
     def read_csv_file(cls, csv_filename):
         cls.logger.info(f"Parsing of {csv_filename}")
@@ -48,6 +147,325 @@ class ParseCSV:
             return None
         return data
 
+    @classmethod
+    def read_csv_columnar(cls, csv_filename):
+        """
+        Parse file with the columnar engine.
+        Returns a 'Dataset' (elution times, scan offsets, masses and counts as arrays)
+        Returns None if errors during parsing occur
+        """
+        if cls.workers != 1 and os.path.getsize(csv_filename) >= cls.min_parallel_bytes \
+                and not codecs.lookup(cls.encoding).name.startswith(('utf-16', 'utf-32')):
+            return cls.read_csv_parallel(csv_filename)
+        cls.logger.info(f"Columnar parsing of {csv_filename}")
+        blocks = []
+        errors = []
+        line_num = 0
+        scans = 0
+        try:
+            for lines, bytes_read in cls._iter_line_blocks(csv_filename):
+                block, block_errors = cls.parse_block(lines, first_line_num=line_num + 1)
+                blocks.append(block)
+                errors.extend(block_errors)
+                line_num += len(lines)
+                scans += len(block)
+                cls.report_progress(csv_filename, bytes_read, scans)
+        except (csv.Error, UnicodeDecodeError) as e:
+            cls.logger.critical('file {}, line {}: {}'.format(csv_filename, line_num + 1, e))
+            return None
+        except ParseCancelled as e:
+            cls.logger.info(f"{e}")
+            return None
+        if errors:
+            cls.logger.critical(f"File '{csv_filename}' contains errors in {len(errors)} lines: {errors[:20]}")
+            return None
+        return Dataset.concatenate(blocks, source_filename=str(csv_filename))
+
+    @classmethod
+    def read_csv_parallel(cls, csv_filename, workers=None):
+        """
+        Parse file with the columnar engine in a pool of 'workers' processes.
+        The file is split at line breaks into byte ranges (at least 4 per worker, at most 'block_size' bytes each),
+        which are parsed independently and merged in file order. Progress and cancellation are checked
+        after every byte range. Only for encodings, in which a line break is the byte b'\\n'.
+        Returns a 'Dataset' or None if errors during parsing occur
+        """
+        workers = workers or cls.workers or os.cpu_count() or 1
+        parts = max(workers * 4, -(-os.path.getsize(csv_filename) // cls.block_size()))
+        ranges = cls.split_byte_ranges(csv_filename, parts=parts)
+        cls.logger.info(f"Parallel parsing of {csv_filename} ({len(ranges)} byte ranges, {workers} processes)")
+        settings = {name: getattr(cls, name) for name in cls.settings_attributes}
+        blocks = []
+        errors = []
+        line_num = 0
+        scans = 0
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context(cls.start_method)) as executor:
+                starts, ends = zip(*ranges)
+                results = executor.map(_parse_byte_range, [csv_filename] * len(ranges), starts, ends,
+                                       [settings] * len(ranges))
+                try:
+                    for (block, block_errors, number_of_lines), end in zip(results, ends):
+                        # Line numbers of workers start at 1 for every byte range
+                        errors.extend(line_num + error for error in block_errors)
+                        blocks.append(block)
+                        line_num += number_of_lines
+                        scans += len(block)
+                        cls.report_progress(csv_filename, end, scans)
+                except ParseCancelled:
+                    executor.shutdown(wait=False, cancel_futures=True)  # byte ranges not started are dropped
+                    raise
+        except (csv.Error, UnicodeDecodeError) as e:
+            cls.logger.critical('file {}, after line {}: {}'.format(csv_filename, line_num, e))
+            return None
+        except ParseCancelled as e:
+            cls.logger.info(f"{e}")
+            return None
+        if errors:
+            cls.logger.critical(f"File '{csv_filename}' contains errors in {len(errors)} lines: {errors[:20]}")
+            return None
+        return Dataset.concatenate(blocks, source_filename=str(csv_filename))
+
+    @classmethod
+    def split_byte_ranges(cls, csv_filename, parts):
+        """Split file into about 'parts' byte ranges [(start, end), ...], each ending directly after a line break"""
+        size = os.path.getsize(csv_filename)
+        borders = [0]
+        with open(csv_filename, 'rb') as file:
+            for index in range(1, parts):
+                position = max(size * index // parts, borders[-1])
+                file.seek(position)
+                file.readline()  # move to the start of the next line
+                position = file.tell()
+                if position >= size:
+                    break
+                if position > borders[-1]:
+                    borders.append(position)
+        borders.append(size)
+        return list(zip(borders[:-1], borders[1:]))
+
+    @classmethod
+    def parse_byte_range(cls, csv_filename, start, end):
+        """
+        Parse bytes 'start' to 'end' of file (start of a line to end of a line).
+        Returns (dataset, [line numbers with errors, counted from 1 in this range], number of lines)
+        """
+        with open(csv_filename, 'rb') as file:
+            file.seek(start)
+            text = file.read(end - start).decode(cls.encoding)
+        text = text.replace('\r\n', '\n').replace('\r', '\n')  # universal newlines as in text mode
+        lines = text.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        block, errors = cls.parse_block(lines, first_line_num=1)
+        return block, errors, len(lines)
+
+    @classmethod
+    def iter_csv_chunks(cls, csv_filename, chunk_size=None):
+        """
+        Parse file block by block and yield Datasets of 'chunk_size' scans (the last one may be shorter).
+        Only one text block is parsed at a time, so memory stays below about 'max_chunk_mb' MB
+        plus the chunks kept by the consumer.
+        Raises ValueError if errors during parsing occur, ParseCancelled if 'cancel_event' is set
+        """
+        chunk_size = chunk_size or cls.chunk_size
+        cls.logger.info(f"Chunked parsing of {csv_filename} ({chunk_size} scans per chunk)")
+        pending = []  # parsed scans, which are not yielded yet
+        line_num = 0
+        scans = 0
+        try:
+            for lines, bytes_read in cls._iter_line_blocks(csv_filename):
+                block, errors = cls.parse_block(lines, first_line_num=line_num + 1)
+                line_num += len(lines)
+                scans += len(block)
+                cls.report_progress(csv_filename, bytes_read, scans)
+                if errors:
+                    cls.logger.critical(f"File '{csv_filename}' contains errors in lines {errors}.")
+                    raise ValueError(f"File '{csv_filename}' contains errors in {len(errors)} lines.")
+                pending.append(block)
+                if sum(len(dataset) for dataset in pending) < chunk_size:
+                    continue
+                buffered = Dataset.concatenate(pending, source_filename=str(csv_filename))
+                start = 0
+                while len(buffered) - start >= chunk_size:
+                    yield buffered.scans(start, start + chunk_size)
+                    start += chunk_size
+                pending = [buffered.scans(start, len(buffered))]
+        except (csv.Error, UnicodeDecodeError) as e:
+            cls.logger.critical('file {}, line {}: {}'.format(csv_filename, line_num + 1, e))
+            raise ValueError(f"File '{csv_filename}' can not be parsed: {e}") from e
+        if sum(len(dataset) for dataset in pending):
+            yield Dataset.concatenate(pending, source_filename=str(csv_filename))
+
+    @classmethod
+    def read_csv_to_store(cls, csv_filename, directory, chunk_size=None):
+        """
+        Parse file chunk by chunk into a ChunkStore in 'directory' for files larger than memory.
+        Returns the ChunkStore or None if errors during parsing occur
+        """
+        try:
+            return ChunkStore.write(directory, cls.iter_csv_chunks(csv_filename, chunk_size),
+                                    source_filename=str(csv_filename))
+        except ValueError as e:
+            cls.logger.critical(f"{e}")
+            return None
+        except ParseCancelled as e:
+            cls.logger.info(f"{e}")
+            return None
+
+    @classmethod
+    def report_progress(cls, csv_filename, bytes_read, scans):
+        """Raise ParseCancelled if 'cancel_event' is set, else pass progress to the 'progress' callback"""
+        if cls.cancel_event is not None and cls.cancel_event.is_set():
+            raise ParseCancelled(f"Parsing of '{csv_filename}' cancelled after {scans} scans.")
+        if cls.progress is not None:
+            cls.progress(bytes_read, os.path.getsize(csv_filename), scans)
+        return
+
+    @classmethod
+    def _iter_line_blocks(cls, csv_filename):
+        """
+        Read file in text blocks, which always end at a line break. Block size follows 'max_chunk_mb'.
+        Yields (lines, bytes read so far)
+        """
+        block_size = cls.block_size()
+        with open(csv_filename, encoding=cls.encoding) as file:
+            while True:
+                text = file.read(block_size)
+                if not text:
+                    break
+                if not text.endswith('\n'):
+                    text += file.readline()  # complete the last line of this block
+                lines = text.split('\n')
+                if lines[-1] == '':
+                    lines.pop()
+                yield lines, file.buffer.tell()
+
+    @classmethod
+    def parse_block(cls, lines, first_line_num=1):
+        """
+        *** Parse a block of lines in special HPLC-MS format to a Dataset ***
+        Tokenizing and float conversion is done in bulk for all well-formed lines,
+        lines which do not match the expected pattern are parsed one by one with 'make_correct_format_hplc_ms'.
+        Returns (dataset, [line numbers with errors])
+        """
+        if cls.decimal != '.' and cls.decimal != cls.delimiter:
+            lines = [line.replace(cls.decimal, '.') for line in lines]
+        pattern = cls._data_pattern()
+        n_head = cls.col_data_starts
+
+        fast_heads, fast_data, fast_index = [], [], []
+        slow_lines = {}
+        for index, line in enumerate(lines):
+            fields = line.split(cls.delimiter, n_head)
+            if len(fields) < n_head or '"' in line:
+                slow_lines[index] = line
+            elif len(fields) == n_head:  # no masses at all
+                fast_heads.append(fields)
+                fast_data.append('')
+                fast_index.append(index)
+            elif pattern.fullmatch(fields[n_head]):
+                fast_heads.append(fields)
+                fast_data.append(fields[n_head])
+                fast_index.append(index)
+            else:
+                slow_lines[index] = line
+
+        try:
+            elution_times = np.array([fields[cls.col_retention] for fields in fast_heads], dtype=np.float64)
+            number_of_masses = np.array([fields[cls.col_number_masses] for fields in fast_heads], dtype=np.float64)
+            values = np.array(cls.delimiter.join(fast_data).replace(cls.delimiter, ' ').split(),
+                              dtype=np.float64).reshape(-1, 2)
+        except (ValueError, IndexError):
+            # Some value is not a number -> let the line parser decide for every line of this block
+            cls.logger.debug(f"Bulk conversion failed in block starting at line {first_line_num}.")
+            slow_lines = dict(enumerate(lines))
+            fast_heads, fast_data, fast_index = [], [], []
+            elution_times = number_of_masses = np.empty(0)
+            values = np.empty((0, 2))
+
+        pairs = np.array([data.count(cls.delimiter) + 1 if data else 0 for data in fast_data], dtype=np.int64)
+        errors = [first_line_num + index for index, number in zip(fast_index, number_of_masses) if number == 0]
+        for index in np.flatnonzero(number_of_masses == 0):
+            cls.logger.warning(f"No masses for elution_time = {elution_times[index]} "
+                               f"in line_num = {first_line_num + fast_index[index]}.")
+        if not slow_lines:
+            offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+            np.cumsum(pairs, out=offsets[1:])
+            return cls.make_dataset(elution_times, offsets, values[:, 0], values[:, 1]), errors
+
+        # Merge the lines parsed one by one into the bulk result, keeping the order of the file
+        scans = {index: (time, start, start + number)
+                 for index, time, start, number in zip(fast_index, elution_times.tolist(),
+                                                       np.cumsum(pairs) - pairs, pairs)}
+        for index, line in slow_lines.items():
+            row = next(csv.reader([line], delimiter=cls.delimiter), [])
+            new_line = cls.make_correct_format_hplc_ms(first_line_num + index, row)
+            if new_line:
+                scans[index] = new_line
+            else:
+                errors.append(first_line_num + index)
+
+        times, counts_per_scan, masses, counts = [], [], [], []
+        for index in sorted(scans):
+            scan = scans[index]
+            if isinstance(scan, Line):
+                times.append(scan.elution_time)
+                counts_per_scan.append(len(scan.mass_count_list))
+                masses.append(np.array([item.mass for item in scan.mass_count_list], dtype=np.float64))
+                counts.append(np.array([item.count for item in scan.mass_count_list], dtype=np.float64))
+            else:
+                time, start, end = scan
+                times.append(time)
+                counts_per_scan.append(end - start)
+                masses.append(values[start:end, 0])
+                counts.append(values[start:end, 1])
+        offsets = np.zeros(len(times) + 1, dtype=np.int64)
+        np.cumsum(counts_per_scan, out=offsets[1:])
+        return cls.make_dataset(times, offsets,
+                                np.concatenate(masses) if masses else [],
+                                np.concatenate(counts) if counts else []), sorted(errors)
+
+    @classmethod
+    def make_dataset(cls, elution_times, offsets, masses, counts):
+        """Dataset of parsed arrays with the configured mass binning and storage dtypes"""
+        dataset = Dataset(elution_times, offsets, masses, counts, mass_binning=cls.mass_binning())
+        if (cls.mass_dtype, cls.count_dtype, cls.offset_dtype) == ('float64', 'float64', 'int64'):
+            return dataset
+        return dataset.astype(cls.mass_dtype, cls.count_dtype, cls.offset_dtype)
+
+    @classmethod
+    def _data_pattern(cls):
+        """Regular expression for the data part of a well-formed line: 'mass count,mass count,...'"""
+        value = f"[^\\s{re.escape(cls.delimiter)}\"]+"
+        pair = f"{value} {value}"
+        return re.compile(f"{pair}(?:{re.escape(cls.delimiter)}{pair})*")
+
+    @classmethod
+    def read_target_list(cls, filename):
+        """
+        Read a list of target masses: one 'mass' or 'mass, tolerance' per line.
+        Separators ',', ';', tab or space. Empty lines, comments (#) and text lines (header) are skipped.
+        Returns (masses, tolerances): tolerances is None, if not given for every mass
+        """
+        masses, tolerances = [], []
+        with open(filename, encoding=cls.encoding) as file:
+            for line_num, line in enumerate(file, start=1):
+                values = re.split(r"[,;\s]+", line.split('#')[0].strip())
+                try:
+                    numbers = [float(value) for value in values if value]
+                except ValueError:
+                    cls.logger.info(f"Line {line_num} of target list skipped: {line.strip()}")
+                    continue
+                if numbers:
+                    masses.append(numbers[0])
+                    tolerances.append(numbers[1] if len(numbers) > 1 else None)
+        cls.logger.info(f"{len(masses)} target masses read from {filename}")
+        if None in tolerances:
+            return masses, None
+        return masses, tolerances
+
     @classmethod
     def make_correct_format_hplc_ms(cls, line_num, line):
         """
@@ -87,3 +505,8 @@ class ParseCSV:
                 return None
             new_line.mass_count_list.append(MassCount(mass, count))
         return new_line
+
+
+def _parse_byte_range(csv_filename, start, end, settings):
+    """Worker function for the process pool of 'ParseCSV.read_csv_parallel', parse 'settings' are given explicitly"""
+    return ParseCSV.with_settings(settings).parse_byte_range(csv_filename, start, end)
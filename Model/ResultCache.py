@@ -0,0 +1,76 @@
+from collections import OrderedDict
+import logging
+import threading
+import numpy as np
+
+__all__ = ['ResultCache']
+
+
+class ResultCache:
+    """
+    Memory-bounded LRU cache for analysis results (traces, peaks) in memory.
+    Keys are (dataset id, function name, parameters), so results of another dataset never match.
+    Used by the worker thread and the main thread (live mode), all changes of the entries hold 'lock'.
+    Results are computed outside of the lock.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+
+    max_size_mb = 256
+    entries = OrderedDict()  # key -> (result, size in bytes)
+    size = 0
+    hits = 0
+    misses = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def get_or_compute(cls, dataset, name, parameters, function):
+        """Returns cached result of 'name(parameters)' for 'dataset', else calls 'function()' and stores the result"""
+        key = (dataset.id, name, tuple(parameters))
+        with cls.lock:
+            if key in cls.entries:
+                cls.hits += 1
+                cls.entries.move_to_end(key)
+                cls.logger.debug(f"Hit {name}{tuple(parameters)} (hits: {cls.hits}, misses: {cls.misses}).")
+                return cls.entries[key][0]
+            cls.misses += 1
+
+        result = function()
+        if isinstance(result, np.ndarray):
+            result.flags.writeable = False  # shared by all callers
+        size = cls.size_of(result)
+        with cls.lock:
+            if key in cls.entries:  # stored by another thread in the meantime
+                cls.size -= cls.entries.pop(key)[1]
+            cls.entries[key] = (result, size)
+            cls.size += size
+            cls.logger.debug(f"Miss {name}{tuple(parameters)} (hits: {cls.hits}, misses: {cls.misses}).")
+            cls.evict()
+        return result
+
+    @classmethod
+    def size_of(cls, result):
+        """Approximate memory of a result in bytes"""
+        if isinstance(result, np.ndarray):
+            return result.nbytes
+        if isinstance(result, (list, tuple)):
+            return 64 + sum(cls.size_of(item) for item in result)
+        return 32
+
+    @classmethod
+    def evict(cls):
+        """Remove least recently used results until the cache fits into 'max_size_mb' (caller holds 'lock')"""
+        budget = cls.max_size_mb * 1024 * 1024
+        while cls.entries and cls.size > budget:
+            key, (_, size) = cls.entries.popitem(last=False)
+            cls.size -= size
+            cls.logger.debug(f"Evicted {key[1]}{key[2]} ({size} bytes).")
+        return
+
+    @classmethod
+    def invalidate(cls, dataset=None):
+        """Remove all results (of 'dataset' only, if given)"""
+        with cls.lock:
+            for key in [key for key in cls.entries if dataset is None or key[0] == dataset.id]:
+                cls.size -= cls.entries.pop(key)[1]
+        cls.logger.debug(f"Invalidated, {len(cls.entries)} results left (hits: {cls.hits}, misses: {cls.misses}).")
+        return
@@ -0,0 +1,180 @@
+import logging
+import numpy as np
+
+from Model.Data import Data
+
+__all__ = ['Signal', 'SignalConditioner']
+
+
+class Signal:
+    """
+    Signal conditioning of traces (e.g. 'total_counts_per_time' or XICs) before peak detection:
+    smoothing (Savitzky-Golay, moving average) and baseline removal (rolling minimum).
+    All functions work along the last axis, i.e. on single traces and on matrices 'traces x scans'.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+
+    @staticmethod
+    def _odd_window(window, length):
+        """Largest odd window <= 'window', which fits into 'length' points"""
+        window = min(int(window), length)
+        return window if window % 2 else window - 1
+
+    @classmethod
+    def savitzky_golay(cls, values, window=7, order=2):
+        """
+        Savitzky-Golay smoothing: least squares polynomial of 'order' in every window of 'window' points.
+        The first and last window / 2 points are taken from the polynomials of the first and last window.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        window = cls._odd_window(window, values.shape[-1])
+        if window < 3 or order >= window:
+            return values.copy()
+        half = window // 2
+        vandermonde = np.vander(np.arange(-half, half + 1), order + 1, increasing=True)
+        projection = vandermonde @ np.linalg.pinv(vandermonde)  # fitted values of a window from its values
+        windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=-1)
+        smoothed = np.empty_like(values)
+        smoothed[..., half:-half] = windows @ projection[half]
+        smoothed[..., :half] = windows[..., 0, :] @ projection[:half].T
+        smoothed[..., -half:] = windows[..., -1, :] @ projection[half + 1:].T
+        return smoothed
+
+    @classmethod
+    def moving_average(cls, values, window=7):
+        """Centered moving average of 'window' points, windows at the ends of the signal are shorter"""
+        values = np.asarray(values, dtype=np.float64)
+        window = cls._odd_window(window, values.shape[-1])
+        if window < 3:
+            return values.copy()
+        half = window // 2
+        length = values.shape[-1]
+        cumulative = np.zeros(values.shape[:-1] + (length + 1,))
+        np.cumsum(values, axis=-1, out=cumulative[..., 1:])
+        lower = np.maximum(np.arange(length) - half, 0)
+        upper = np.minimum(np.arange(length) + half + 1, length)
+        return (cumulative[..., upper] - cumulative[..., lower]) / (upper - lower)
+
+    @staticmethod
+    def centered_min(values, window):
+        """Minimum of values[..., i - window // 2:i + window // 2 + 1] for every i"""
+        return -Signal.centered_max(-np.asarray(values, dtype=np.float64), window)
+
+    @staticmethod
+    def centered_max(values, window):
+        """Maximum of values[..., i - window // 2:i + window // 2 + 1] for every i"""
+        values = np.asarray(values, dtype=np.float64)
+        half = int(window) // 2
+        padded = np.concatenate([np.full(values.shape[:-1] + (half,), -np.inf), values], axis=-1)
+        return Data.sliding_max(padded, 2 * half + 1)[..., :values.shape[-1]]
+
+    @classmethod
+    def rolling_min_baseline(cls, values, window=101):
+        """
+        Baseline as morphological opening: rolling minimum followed by rolling maximum of 'window' points.
+        The baseline never exceeds the signal and follows it where no peak is wider than 'window'.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if window < 3:
+            return np.zeros_like(values)
+        return cls.centered_max(cls.centered_min(values, window), window)
+
+    @classmethod
+    def condition(cls, values, smoothing='savgol', window=7, order=2, baseline='rolling_min', baseline_window=101):
+        """
+        Smoothing ('savgol', 'moving_average' or 'none') followed by baseline removal ('rolling_min' or 'none')
+        Returns: conditioned signal with the shape of 'values'
+        """
+        if smoothing == 'savgol':
+            values = cls.savitzky_golay(values, window, order)
+        elif smoothing == 'moving_average':
+            values = cls.moving_average(values, window)
+        elif smoothing == 'none':
+            values = np.array(values, dtype=np.float64)
+        else:
+            raise ValueError("smoothing must be 'savgol', 'moving_average' or 'none'")
+        if baseline == 'rolling_min':
+            values = values - cls.rolling_min_baseline(values, baseline_window)
+        elif baseline != 'none':
+            raise ValueError("baseline must be 'rolling_min' or 'none'")
+        return values
+
+
+class SignalConditioner:
+    """
+    Signal conditioning with fixed parameters, for complete signals ('apply')
+    and for signals arriving in pieces ('update', 'flush'), e.g. scans of a running acquisition.
+    Streamed results are identical to 'apply' on the complete signal: a point is emitted
+    as soon as all points within 'context' after it have arrived.
+    """
+    logger = logging.getLogger().getChild(__name__)  # Start logger
+
+    def __init__(self, smoothing='savgol', window=7, order=2, baseline='rolling_min', baseline_window=101):
+        self.smoothing = smoothing
+        self.window = int(window)
+        self.order = int(order)
+        self.baseline = baseline
+        self.baseline_window = int(baseline_window)
+        self.reset()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """SignalConditioner from [DATA] of 'settings' (configparser), None if neither smoothing nor baseline is set"""
+        smoothing = settings['DATA'].get('smoothing', fallback='none')
+        baseline = settings['DATA'].get('baseline', fallback='none')
+        if smoothing == 'none' and baseline == 'none':
+            return None
+        return cls(smoothing=smoothing,
+                   window=settings['DATA'].getint('smoothing_window', fallback=7),
+                   order=settings['DATA'].getint('smoothing_order', fallback=2),
+                   baseline=baseline,
+                   baseline_window=settings['DATA'].getint('baseline_window', fallback=101))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(smoothing={self.smoothing!r}, window={self.window}, order={self.order}, " \
+               f"baseline={self.baseline!r}, baseline_window={self.baseline_window})"
+
+    @property
+    def context(self):
+        """Number of points before and after a point, which change its conditioned value"""
+        smoothing_half = self.window // 2 if self.smoothing != 'none' else 0
+        baseline_half = self.baseline_window // 2 if self.baseline != 'none' else 0
+        return smoothing_half + 2 * baseline_half
+
+    def apply(self, values):
+        """Conditioned signal of complete traces (1-D or 2-D 'traces x scans')"""
+        return Signal.condition(values, self.smoothing, self.window, self.order,
+                                self.baseline, self.baseline_window)
+
+    def reset(self):
+        """Start a new stream"""
+        self._buffer = np.empty(0)
+        self._buffer_start = 0  # position of the first buffered point in the stream
+        self._emitted = 0  # number of points already returned
+        return
+
+    def update(self, values):
+        """Add new points of the stream, returns the conditioned values of all points, which are final now"""
+        self._buffer = np.concatenate([self._buffer, np.asarray(values, dtype=np.float64).ravel()])
+        if len(self._buffer) < self.window:  # shorter signals are smoothed with a smaller window
+            return np.empty(0)
+        return self._emit(self._buffer_start + len(self._buffer) - self.context)
+
+    def flush(self):
+        """End of stream: returns the conditioned values of all remaining points"""
+        result = self._emit(self._buffer_start + len(self._buffer))
+        self.reset()
+        return result
+
+    def _emit(self, stop):
+        if stop <= self._emitted:
+            return np.empty(0)
+        conditioned = self.apply(self._buffer)
+        result = conditioned[self._emitted - self._buffer_start:stop - self._buffer_start]
+        self._emitted = stop
+
+        # Keep only the points needed as context for the points not yet emitted (at least one smoothing window)
+        keep_from = max(self._emitted - self.context - self.window, self._buffer_start)
+        self._buffer = self._buffer[keep_from - self._buffer_start:]
+        self._buffer_start = keep_from
+        return result
@@ -1,12 +1,28 @@
 """
 Parse HPLC-MS raw data from CSV files (Module ParseCSV)
+Store parsed scans in columnar arrays (Module Dataset)
+Cache parsed files on disk (Module Cache)
+Store files larger than memory in chunks on disk (Module ChunkStore)
+Bin scans to an 'elution time x mass' map (Module IntensityMap)
+Cache analysis results in memory (Module ResultCache)
 Calculate elution times, ion masses, traces and more (Module Data)
+Smooth traces and remove their baseline (Module Signal)
+Decimate plot series to the display resolution (Module Downsample)
 Generate Excel file with results (Module CreateExcel)
+Export results and scans as npz, csv, parquet or arrow files (Module Export)
 """
 
 # import submodules
 from Model.Data import Data  # Data analysis
 from Model.CreateExcel import CreateExcel  # Create Excel
 from Model.ParseCSV import ParseCSV
-__all__ = ['Data', 'CreateExcel', 'ParseCSV']
-
+from Model.Dataset import Dataset, MassBinning  # Columnar storage of scans, m/z binning
+from Model.Cache import DatasetCache  # On-disk cache of parsed files
+from Model.ChunkStore import ChunkStore  # Out-of-core chunks on disk
+from Model.IntensityMap import IntensityMap  # Binned intensity map
+from Model.ResultCache import ResultCache  # In-memory cache of results
+from Model.Signal import Signal, SignalConditioner  # Smoothing and baseline removal
+from Model.Downsample import Downsample  # Decimation of plot series
+from Model.Export import Export  # Columnar export formats
+__all__ = ['Data', 'CreateExcel', 'ParseCSV', 'Dataset', 'MassBinning', 'DatasetCache', 'ChunkStore',
+           'IntensityMap', 'ResultCache', 'Signal', 'SignalConditioner', 'Downsample', 'Export']
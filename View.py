@@ -1,11 +1,11 @@
+import importlib.util
 import logging
 import FreeSimpleGUI as sg
-import numpy as np
 
 from Constants import DEFAULT_ASCII_FILE
+import sys
+import time
 import webbrowser
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg  # The matplot tk canvas
 
 alw = b'iVBORw0KGgoAAAANSUhEUgAAAIwAAACqCAYAAAB/NacVAAABhWlDQ1BJQ0MgcHJvZmlsZQAAKJF9kT1Iw0AcxV8/pCoVETuIiGSoThZBRRxLFYtgobQVWnUwufQLmjQkKS6OgmvBwY/FqoOLs64OroIg+AHi6uKk6CIl/i8ptIjx4Lgf7+497t4B3kaFKYY/CiiqqafiMSGbWxUCr+iBHwOYxKjIDC2RXszAdXzdw8PXuwjPcj/35+iT8wYDPAJxlGm6SbxBPLtpapz3iUOsJMrE58QTOl2Q+JHrksNvnIs2e3lmSM+k5olDxEKxg6UOZiVdIZ4hDsuKSvnerMMy5y3OSqXGWvfkLwzm1ZU012mOII4lJJCEAAk1lFGBiQitKikGUrQfc/EP2/4kuSRylcHIsYAqFIi2H/wPfndrFKannKRgDOh6sayPMSCwCzTrlvV9bFnNE8D3DFypbX+1Acx9kl5va+EjoH8buLhua9IecLkDDD1poi7ako+mt1AA3s/om3LA4C3Qu+b01trH6QOQoa6Wb4CDQ2C8SNnrLu/u7uzt3zOt/n4AxnZyyLHBmt4AAAAGYktHRAAAAAAAAPlDu38AAAAJcEhZcwAALiMAAC4jAXilP3YAAAbMSURBVHja7dxdbFPnGcDx57VjJ/42lDHKiGN3mbHTjjRokyZV3dZstJvQGlDLrra7bUWkg0DHNO2m2s0uJg2GQqeRljWCINpVWtUGWkYrbWonTZVWFpGQDEoD8UfaoXzYTiDHJ/Y5u0hSQhLmdJphx/n/7owCQUd/v+9zjo+PCAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAMpp8NJbztffuOh9pu1jG0fjVlUcglt9dPZ4YNq17pGatZ+pqvEYZ0RkkqNyE++gedJvdgaD4YYdvjXhZ233+L9sd1RxfAhmaYlTR1etqt/0ZE0ottde7YmKsinD5LiwJS0h1f18cHW0aYcrFNstjpqYiNJFTBGCIZhFM8upjkAwunlHTV1stzhq4qKUjVAIZulY3ng+EKjf/N3ZWGKi1K1btCIQgrk5swQD9Q8+4QrFfiwOV1yUsi/8GUUwBCMikuh+Ibgm2vSEq27jHnG4GpaKRUTENAhkxQeTOn3Uv7q+cftsLPcv2oZAMJ/MLGeP+wJ1se2uuti+2W2IWAhmacNnu3yB2uh2V2jjT8Tpjt9uG5o/7zLDrNBgEm8e9wdqoy2uSHy/OD0lY5lTNChmxQWTONPlv6cu2uKONOwXp7thOduQEhGHTRwPfaXgHh5OFAqFZf0qZZrm7NmVMmf/GbPE71HZaWUOZA19x+a6ghWOZ0W/hT46e9zrr924bTaWB5Y7s0yLFK/fkD6XzfxrlcOYWnCczAXHbv7ruUjMEn9HRMRUStTolOjvJbKnL49ef2/vw6ECK8xd8vGfOr2+2ug2dzj+qWIREXGI2AMu2aSUiovYy3rd12kXzS6edPGG9ncRIZi7curc3eHzhRpa3OHYfqn2/FenzkqJEhHnHfjvGqahbFa55lNxwQy9fiSwqr6pxR2J7xOn+/7lDrhYgcEkuzt8q7/Q1OIOx9tmtyHLxGKaBHNnZ5bu33m99Y0t7nB8jzjdm1hZCOb2Z0OvHfb66pu2u8MNbeJ0WTIWq1wktHwwyVef8/miX2pxRxraZlYWGzeFEcxtBtzXjvhXRZse90TmVhbLxqKEGabMp86njnqD931xqyfcsEec7kZRytLxW+UmP0se5H+d6XR7QrGtnkjsGam2fixsSeWcWc4cc3s21H/HE47/VKq9myolFobeMkic/r03WPv5rZ77HqioWFhhymDw2LNO/7o1D3kjG/dKtbex0q6zWOXCnWXuOFM2UTa7WSNiuEVMblQhmP8s8r1f5HPXUn/WEhfaJZ+7JKZRUbdoK4L539vwaGsuk+5/KT/Uc0C0zCUxipUSjWmVYix3E/S932idyA0PvKQle38t+dzFCoqGYMplbfOuiUzywitaqu+g6LmLlbA9MfSWe6X5Zmt25ErPK1PJvkOVONMQTBnUPrY7MzJ47g9asvc3ks9+IIZ1o1HMMHdG6Ftt4+NDPS9ryd6Dks9etnI0BHOHrN+yO5NN9Z3MJ3sPiJ69bMHtyTKfVlfMV0XXNbfmssMDJ2dWmtyHVovGKp9WV9R3iz/7yM7c2NW+k1ri/EHJ5wYZhAmmpM892prNpQdO5BM9B0TLDVklGj6tvpsrTfPO3Mg7HV1KlDhrG/dLjb9OlO1TvTkMUwybkuly7xZKRFPKKMx8u5Zg7po1X/3RxOg7HV0eEVUdenCfVPsiy42mIGJMajLgtpt/q6oytTLGonRT8oZN66vyGEVrTOcV7tpfjvj962Pfr65t3LvcaCZN0d5Pmr8dO3f9l9taHDlNu/kYBzW7d8z74v0tr+f+bOHrpX7GJqZkCjY5N1YsfLvOw7z1/yL91nNB7dK7T5tT4x+YRrFolpAzzKm3rxq/+tnPsz6OXoUPvUsOwltaM9l0f5ee7D0k+dwVMZb3yGaHk/tuVmQwM6fcT2Uy6YEuPXXhkOjLu05j8rzelRvMXDTjyfMn9HR/u+gTg2KWWGkIZmUHIyKyrnnX2MiVf5zIp/sPiz75YclosLKDmZlpnh4dGew5oacvHBY9N3i7mYaHIhLMJzZs2TUyNnS+azrV3y76xNUlVxqCIZj57m3eOZpJ9R2bTve2iz65KBqeBE4wi6z9+lPj4+l/duqp3sOiTw4x0xBM6bOnr/1wfDTR16mn+tpFn0wQDcGUtL5551gm3f/idKr3kKFPDCuzaPJg+cX4bvKClebauy+8WHTZR23ZiEjRwRTDClNipnn4B5mikXrZGB/+Y3bMuMERAQAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAFvFvb+6M1dD/JHkAAAAASUVORK5CYII='
 arw = b'iVBORw0KGgoAAAANSUhEUgAAAIwAAACqCAYAAAB/NacVAAABhWlDQ1BJQ0MgcHJvZmlsZQAAKJF9kT1Iw0AcxV8/pCoVETuIiGSoThZBRRxLFYtgobQVWnUwufQLmjQkKS6OgmvBwY/FqoOLs64OroIg+AHi6uKk6CIl/i8ptIjx4Lgf7+497t4B3kaFKYY/CiiqqafiMSGbWxUCr+iBHwOYxKjIDC2RXszAdXzdw8PXuwjPcj/35+iT8wYDPAJxlGm6SbxBPLtpapz3iUOsJMrE58QTOl2Q+JHrksNvnIs2e3lmSM+k5olDxEKxg6UOZiVdIZ4hDsuKSvnerMMy5y3OSqXGWvfkLwzm1ZU012mOII4lJJCEAAk1lFGBiQitKikGUrQfc/EP2/4kuSRylcHIsYAqFIi2H/wPfndrFKannKRgDOh6sayPMSCwCzTrlvV9bFnNE8D3DFypbX+1Acx9kl5va+EjoH8buLhua9IecLkDDD1poi7ako+mt1AA3s/om3LA4C3Qu+b01trH6QOQoa6Wb4CDQ2C8SNnrLu/u7uzt3zOt/n4AxnZyyLHBmt4AAAAGYktHRAAAAAAAAPlDu38AAAAJcEhZcwAALiMAAC4jAXilP3YAAAbOSURBVHja7dxdTJvXHcfx8zy2H+zHBkNgAVpeV2psiEigiqppL23ZkkaLohSt6VUr9WJtIugSsjbV1Jtqt6sE60ikNV02lBClXaQthLTJ0km76H3zgoFAWgh+gWRKgnESsA1+zi5ItQwIdqZB9tjfz5Vl2cLPn5/P+Z9jHwsBAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAACA1fJ2+3X19OfDrtGRLzSqsZRKCf6T3WnV7eu/s83qKPnp5PljbipCYFZksVlVtTBvc25R1fv5VXW7wme786kKgXkoQwohFFWx5Dg99grv/oKahpcDZ44UUBkCszz57Q1FFZrD66jwthd5GneF+j5mpCEwKSiKKmx2n6PSu7ewtmnX5JnDbgKDRSFZNjRee6V3r9vzzCuTn3/sJjB4IB/L3mkRNofPUeH9hbum6eXAmSP5BAYLLYzx0CRZhOaoc1R69xV5Gn8W6PtDPoFBquHHImyOekdl7b4iz6aW0GdH8ggM0miEHXWOSu8v19U0tEyeP5ZLYLK8h1HSGWk03eeoqH3HXV7bMnG+J5fAZKmkoaSbLIvIcfkc1b4D7nLPS4Gzx7JierKa5YWe/Grc6nOrmtsmFfnA9toKi2MppVQW/reKEKmfI6xWIS5cmNdtqrAp6YZGc9bp1XUHhBAicK6nt2Lbq9Fs2nX4v9T5ZcBaU+h89tkK9/ZCh9CkFHLRa5fLXM+3j1Hu3178mGWfMz+nOmYN5QdOXWywCWFJb2klDZGY8c+MDX4QDQ6fKt362l1GmMc5TcxYLJZC5ybNYmlVVWFfzb9lsQhFk8KmPMqbSVFUoekb9CrfASGkuP637lMlL75+l8A8xr0RaSiqEEITQuSsReP7X62ecpz1C6FRRKjvcG/Zjjfv0PQiVSNcr1fXvVNQ09gyfvojN4F5HCOMNFloNH2DXu1rL/I07Qz2Hc4lMEgnNA16lW9fQc3Gndf7fu8iMGtaf7OGxtHgrKrbn1vT2DLZe9BFYJAiNKpV5OgNenVde65n80vBvx7KJTBr0sQslN+0odH0Bmd1fXuBd/PO8d6P8gjMmuTF5CONpm90VtXtK3y6cXvozBEXgUGqnsYqcvRNzmrv2/nfrd9+41y3TmBoetMIjWujs8r3rrPMsyN47qhOYJA6NPbcBudTG97NL39qR+CzP7oIzP+6h5EZGJoc10ZXde3+vJKi748efV8jMEj1NlCEMHTVIu2Kap4VoDl6mIzLimGIeHQkFhjoiv4z9I/qV38dN8tLN8cXqJTMWF0LIYQwkoaIT4/EA5c7IuHBT8q2tpnqE22rwBqHJTocC/Z33JkY+rT0x22m+/oDTe9aTkOJ6HAs5O+MBAdOrm9uNeV3ZWh617BnmQ36P7w5dvFk6U/aps16KWzcrfo0ZBgiPn01Fuz/7c3Rr/5c/uLeiJmzTw+z+mH5Ohbq75wav/Rpxbb2iNkvyRyBMeOn1dIwRGL663iwv2M67D/xxJa9GXH8xGqevJiuZ/kmFuzvjE4MnShpbsuYs0o0vasTltFY4HLn7Wv+E8Uv7Mmog22mGGFM0/RKwxCx6Hg8eLEjGh4+/uTWtow7BWmSwEihKMa8IkRsDXoZxZDCpiqPOPreD0sieOmDuzeu9hQ378m4M0mmCYzVaSQNNeZPSO1P0hA5chXbmvl5xT6TVL7ncgifNd0pWxqGiN8Ziwcvddy7MdJT9KM3MzIsplp5nB2/pzats1jzrYYwhCLkA9u/9w/bL7lvpccs9xy7XZWneufy1jU533umXGl1KWkcy/13WDqjE1eOrX9+d0Yfxsciv3pvOvfv14zfRA05K1Mxkkk5O3U1NvLlW+EvDmXFT5ixcbeITZPpjbqGIUUiOpYI9n84HR7qeXJLW4TAZOOqOJ3uaOGDxNFEaOB3kfBQT/ELuyPZUh/2YZaEIWVYpEjcGU2EB7umgpePZ1NYCMyj77NIkbj7TTw8ePDm2IXjJc2tt7OtBExJi5eNygo9y1x0NBEeOnhz9OLxsi1v3crG+hCYdDYaFqaha3Phwa7bgf6esi2tt7K1PARmSTaWnYauzYX7uyKhwaOlzXumsrk+9DCpe5bxRKj/4FT4Svf653dPZXtJCMzKYQkkQv6uWwF/d/Fzb0xRFKakpS2MKoQik9JI3JuYC/sPRcJD3U9k+TREYFaSTBrq9K2BWW1sIDF55XTxc29EKAqBeajp28aMMTXxl2RhaK70hz+PUxEAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAGAS/wKDoJPBuu/BqwAAAABJRU5ErkJggg=='
@@ -17,6 +17,15 @@ class View:
     """ Class for Main-GUI """
     logger = logging.getLogger().getChild(__name__)
 
+    # Persistent figures: titles of pyplot windows and canvases in the result window
+    figure_titles = {'time': 'Counts per Time', 'mass': 'Counts per Mass', 'heatmap': 'Heatmap',
+                     'xics': 'Extracted ion chromatograms'}
+    canvas_keys = {'time': '-CANVAS1-', 'mass': '-CANVAS2-', 'heatmap': '-CANVAS3-'}
+    no_export = 'none'  # entry of the export format combo: no export besides Excel
+    redraw_log_interval = 1.0  # seconds between two debug messages with the redraw time
+    last_redraw_log = 0.0
+    downsampling = None  # method of Model.Downsample from the GUI settings (None: its default)
+
     def __init__(self, title="", settings=None):
         View.logger.info('Started.')
         self.title = title
@@ -25,14 +34,65 @@ class View:
         self.update_gui_settings()
         self.main_window = None
         self.result_window = None
+        self.trace_lines = {}  # Line2D of 'mass' and 'time' trace, updated in live mode
+        self.figures = {}  # persistent figures of the result window
+        self.canvases = {}  # FigureCanvasTkAgg of the figures in the current result window
         self.make_main_window()
         # self.make_result_window()
         View.logger.info('Finished.')
         return
 
     @staticmethod
-    def read_all_windows():
-        return sg.read_all_windows()
+    def pyplot():
+        """ matplotlib.pyplot, imported on first plot and not on program start (slowest import of the program) """
+        import matplotlib.pyplot as plt
+        return plt
+
+    @classmethod
+    def downsample(cls):
+        """ Model.Downsample with the method of the GUI settings, imported on first plot (imports numpy) """
+        from Model.Downsample import Downsample
+        if cls.downsampling:
+            Downsample.method = cls.downsampling
+        return Downsample
+
+    @staticmethod
+    def export_formats():
+        """
+        Formats of Model.Export, which can be written with the installed packages ('Export.available_formats'),
+        without importing Model.Export and numpy on program start
+        """
+        formats = ['npz', 'csv']
+        if importlib.util.find_spec('pyarrow') is not None:
+            formats += ['parquet', 'arrow']
+        return formats
+
+    @classmethod
+    def show_figures(cls):
+        """
+        Show the pyplot windows. Blocks until all of them are closed, so live updates (blitted overlays)
+        are only possible in the result window.
+        """
+        cls.pyplot().show()
+        return
+
+    @staticmethod
+    def close_figures():
+        """ Close all matplotlib windows (pyplot is not imported only for this) """
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+        return
+
+    @staticmethod
+    def splash_window(title):
+        """ Small window without titlebar, shown while the program starts """
+        return sg.Window(title, [[sg.Text(title, font=('Arial', 16, 'bold'))],
+                                 [sg.Text('Programm wird gestartet ...')]],
+                         no_titlebar=True, keep_on_top=True, element_padding=(20, 10), finalize=True)
+
+    @staticmethod
+    def read_all_windows(timeout=None):
+        return sg.read_all_windows(timeout=timeout)
 
     def make_main_window(self):
         """ Define and creates main application window with PySimpleGUI """
@@ -40,7 +100,7 @@ class View:
 
         # ------ Menu Definition ------ #
         menu_def = [
-            ["&Datei", ["&Beenden"]],
+            ["&Datei", ["&Zielmassen-Liste...", "&Cache leeren", "---", "&Beenden"]],
             ["&Hilfe", ["&Über", "&Einstellungen"]]
         ]
 
@@ -53,8 +113,17 @@ class View:
         font_size = 11
         font_size_title = 15
         default_text = DEFAULT_ASCII_FILE
+        live_update = True
+        export_formats = [self.no_export] + self.export_formats()
+        export_format = self.no_export
+        export_scans = False
 
         if self.settings:
+            live_update = self.settings["GUI"].getboolean("live_update", fallback=True)
+            if self.settings.has_section("EXPORT"):
+                if self.settings["EXPORT"].get("format") in export_formats:
+                    export_format = self.settings["EXPORT"]["format"]
+                export_scans = self.settings["EXPORT"].getboolean("scans", fallback=False)
             font = self.settings["GUI"]["font_family"]
             font_size = int(self.settings["GUI"]["font_size"])
             font_size_title = int(int(self.settings["GUI"]["font_size"]) * 1.4)
@@ -105,7 +174,15 @@ class View:
             [sg.Check("Anzeige mit Matplotlib", default=False,
                       key="-MATPLOT-", s=30)],
             [sg.Check("Öffnen in Excel", default=False,
-                      key="-EXCEL-", s=30)]
+                      key="-EXCEL-", s=30)],
+            [sg.Check("Spuren live aktualisieren", default=live_update, key="-LIVE-", s=30,
+                      tooltip="Änderungen von Masse, Zeit und Intervallen ohne neuen Start anzeigen "
+                              "(nur im Ergebnisfenster, nicht mit Matplotlib)")],
+            [sg.T("Export", s=8),
+             sg.Combo(export_formats, default_value=export_format, key="-EXPORT_FORMAT-", readonly=True, s=8,
+                      tooltip="Ergebnisse zusätzlich als npz, csv, parquet oder arrow speichern"),
+             sg.Check("mit Scans", default=export_scans, key="-EXPORT_SCANS-",
+                      tooltip="Alle eingelesenen Scans (Masse, Counts) mit exportieren")]
         ]
 
         compute_frame = sg.Frame("Optionale Parameter", compute_layout, pad=(0, 10), expand_x=True)
@@ -117,6 +194,9 @@ class View:
             [compute_frame],
             [sg.B("Auswertung starten", button_color="tomato", s=16, key='-START_BUTTON-',
                   bind_return_key=True, expand_x=True)],
+            [sg.ProgressBar(1000, orientation='h', size=(20, 12), key='-PROGRESS_BAR-', expand_x=True),
+             sg.B("Abbrechen", s=10, key='-CANCEL-', disabled=True)],
+            [sg.T("", key='-STATUS-', expand_x=True)],
             [sg.VPush()],
             [sg.Sizegrip()]
         ]
@@ -128,6 +208,22 @@ class View:
         self.main_window.set_min_size(self.main_window.size)
         return
 
+    def set_busy(self, busy):
+        """ Main window during a running analysis: start button disabled, cancel button enabled """
+        self.main_window['-START_BUTTON-'].update(disabled=busy)
+        self.main_window['-CANCEL-'].update(disabled=not busy)
+        self.main_window['-PROGRESS_BAR-'].update(current_count=0)
+        return
+
+    def show_progress(self, stage, bytes_read=None, total_bytes=None, scans=None):
+        """ Show stage of the analysis, for parsing with bytes and scans read so far """
+        text = stage
+        if total_bytes:
+            self.main_window['-PROGRESS_BAR-'].update(current_count=int(1000 * bytes_read / total_bytes))
+            text = f"{stage}: {bytes_read / 1024 / 1024:.1f} von {total_bytes / 1024 / 1024:.1f} MB, {scans} Scans"
+        self.main_window['-STATUS-'].update(text)
+        return
+
     def make_settings_window(self, settings_filename=""):
         """
         Define and creates settings window with PySimpleGUI.
@@ -261,7 +357,8 @@ class View:
         return
 
     def make_result_window(self, filename="",
-                           number_of_entries=0):
+                           number_of_entries=0,
+                           features=None):
         """ Define and creates result window """
         View.logger.info(f"{self.make_result_window.__doc__}")
 
@@ -290,9 +387,26 @@ class View:
                          [sg.Button('Exit', key="-EXIT2-")]
                          ]
 
+        result3_layout = [
+                         [sg.Canvas(key='-CANVAS3-', expand_x=True, expand_y=True)],
+                         [sg.Button('Exit', key="-EXIT3-")]
+                         ]
+
+        feature_rows = self.feature_rows(features)
+        result4_layout = [
+                         [sg.Text("Klick auf ein Feature verfolgt seine Massenspur.")],
+                         [sg.Table(values=feature_rows, headings=['m/z [Da]', 'Zeit [min]', 'Fläche', 'S/N'],
+                                   key='-FEATURES-', enable_events=True, justification='right',
+                                   select_mode=sg.TABLE_SELECT_MODE_BROWSE, auto_size_columns=True,
+                                   num_rows=min(max(len(feature_rows), 5), 25), expand_x=True, expand_y=True)],
+                         [sg.Button('Exit', key="-EXIT4-")]
+                         ]
+
         tab = sg.TabGroup([
             [sg.Tab('Counts per time', result1_layout, background_color='darkseagreen'),
-             sg.Tab('Counts per mass', result2_layout, background_color='darkslateblue')]],
+             sg.Tab('Counts per mass', result2_layout, background_color='darkslateblue'),
+             sg.Tab('Heatmap', result3_layout, background_color='dimgray'),
+             sg.Tab('Features', result4_layout, background_color='slategray')]],
                           key='-TAB_GROUP-', expand_x=True, expand_y=True)
 
         layout = [
@@ -300,8 +414,7 @@ class View:
             [header],
             [tab],
             # [sg.VPush()],
-            [sg.StatusBar(f"Datei: {filename}\n"
-                          f"Einträge: {number_of_entries} Zeilen"), sg.Sizegrip()]
+            [sg.StatusBar(self.result_status(filename, number_of_entries), key='-STATUS_BAR-'), sg.Sizegrip()]
         ]
 
         self.result_window = sg.Window(title='Auswertung',
@@ -311,14 +424,29 @@ class View:
                                        resizable=True,
                                        element_justification='right')
         # self.result_window.set_min_size(self.main_window.size)
+        self.canvases = {}
+        for name in self.canvas_keys:
+            self.attach_figure(name)
+        return
+
+    def result_window_closed(self):
+        """ Result window was closed: its canvases are gone, the figures are kept for the next result window """
+        self.result_window = None
+        self.canvases = {}
         return
 
     @staticmethod
-    def draw_figure(canvas, figure):
-        figure_canvas_agg = FigureCanvasTkAgg(figure, canvas)
-        figure_canvas_agg.draw()
-        figure_canvas_agg.get_tk_widget().pack(side='top', fill='both', expand=1)
-        return figure_canvas_agg
+    def result_status(filename, number_of_entries):
+        return f"Datei: {filename}\nEinträge: {number_of_entries} Zeilen"
+
+    @staticmethod
+    def feature_rows(features):
+        """ Rows of the feature table """
+        if features is None:
+            return []
+        return [[f"{mass:g}", f"{time:.2f}", f"{area:.0f}", f"{sn:.1f}"]
+                for mass, time, area, sn in zip(features.mass, features.retention_time,
+                                                features.area, features.signal_to_noise)]
 
     @staticmethod
     def move_up(window):
@@ -344,6 +472,7 @@ class View:
             font_style = "normal"  # italic roman bold normal underline overstrike
             sg.theme(theme)
             sg.set_options(font=(font_family, font_size, font_style))
+            View.downsampling = self.settings["GUI"].get("downsampling", fallback=View.downsampling)
         return
 
     @staticmethod
@@ -357,50 +486,243 @@ class View:
         sg.popup(text, title=title)
         return
 
-    def plot_canvas(self, matplot, summary, mass, mass_interval, mass_trace, time, time_interval, elution_time_trace, max_peaks):
-        number_masses_per_time = summary.number_of_masses_per_time
-        max_mass_per_time = summary.max_mass_per_time
-        min_mass_per_time = summary.min_mass_per_time
-        ion_masses = summary.ion_masses
-        counts_per_mass = summary.total_counts_per_mass
-
-        # fig1, (ax1, ax2) = plt.subplots(1, 2)
-        fig1, (ax1) = plt.subplots()
-        ax1.plot(summary.elution_times, summary.total_counts_per_time, color='blue', label='Total counts')
-        if mass_trace:
-            ax1.plot(summary.elution_times, mass_trace,
-                     color='red',
-                     label=f"Counts for mass trace {mass} ± {mass_interval} Da.")
+    def plot_canvas(self, matplot, summary, mass, mass_interval, mass_trace, time, time_interval, elution_time_trace,
+                    max_peaks, conditioned_counts=None):
+        """
+        Plot results into the persistent figures 'time' (counts per time) and 'mass' (counts per mass).
+        Traces, peak markers and legends are overlays, which are redrawn by blitting.
+        """
+        import numpy as np  # imported on first plot, not on program start
+        fig1 = self.figure('time', matplot)
+        ax1 = fig1.add_subplot()
+        self.plot_decimated(ax1, summary.elution_times, summary.total_counts_per_time, color='blue',
+                            label='Total counts')
+        if conditioned_counts is not None:
+            self.plot_decimated(ax1, summary.elution_times, conditioned_counts, color='gray', linewidth=1,
+                                label='Total counts (smoothed, baseline removed)')
+        self.trace_lines = {}
+        if mass_trace is not None:
+            self.trace_lines['mass'] = self.plot_decimated(ax1, summary.elution_times, mass_trace,
+                                                           color='red', animated=True,
+                                                           label=self.mass_trace_label(mass, mass_interval))
         ax1.set_xlabel('Elution time [min]')
         ax1.set_ylabel('Counts')
-        ax1.legend(loc='upper left', ncol=1)
         ax1.set_title('Counts per Time')
 
         # Make data to numpy-arrays for detected peaks
         x_max = np.array([value[0] for value in max_peaks])
         y_max = np.array([value[1] for value in max_peaks])
-        ax1.scatter(x_max, y_max, color='green', label='Maxima')
-        ax1.legend(loc='upper left', ncol=1)
-        # ax1.scatter(x_min, y_min, color='red')
-
-        fig2, ax2 = plt.subplots()
-        ax2.plot(summary.ion_masses, summary.total_counts_per_mass,
-                 color='blue', label='Summed up total counts')
-        if elution_time_trace:
-            ax2.plot(summary.ion_masses, elution_time_trace, color='orange',
-                     label=f"Counts for minute trace {time} ± {time_interval} min.")
+        ax1.scatter(x_max, y_max, color='green', label='Maxima', animated=True)
+        ax1.legend(loc='upper left', ncol=1).set_animated(True)
+
+        fig2 = self.figure('mass', matplot)
+        ax2 = fig2.add_subplot()
+        self.plot_decimated(ax2, summary.ion_masses, summary.total_counts_per_mass,
+                            color='blue', label='Summed up total counts')
+        if elution_time_trace is not None:
+            self.trace_lines['time'] = self.plot_decimated(ax2, summary.ion_masses, elution_time_trace,
+                                                           color='orange', animated=True,
+                                                           label=self.time_trace_label(time, time_interval))
         ax2.set_xlabel('Ion masses [Da]')
         ax2.set_ylabel('Counts')
-        ax2.legend(loc='upper left', ncol=1)
+        ax2.legend(loc='upper left', ncol=1).set_animated(True)
         ax2.set_title('Counts per Mass')
+        return fig1, fig2
+
+    def figure(self, name, matplot=False):
+        """
+        Persistent, cleared figure 'name' ('time', 'mass', 'heatmap' or 'xics'): a pyplot figure for separate
+        windows or a Figure of the result window. Figures are reused, so no figure is left open by a new run.
         """
         if matplot:
-            plt.show()
+            fig = self.pyplot().figure(num=self.figure_titles[name], clear=True)
         else:
-            self.draw_figure(self.result_window['-CANVAS1-'].TKCanvas, fig1)
-            self.draw_figure(self.result_window['-CANVAS2-'].TKCanvas, fig2)
+            fig = self.figures.get(name)
+            if fig is None:
+                from matplotlib.figure import Figure
+                fig = self.figures[name] = Figure()
+                fig.set_label(self.figure_titles[name])
+            fig.clear()
+        if not getattr(fig, 'blitting', False):
+            fig.canvas.mpl_connect('draw_event', self.on_draw)
+            fig.blitting = True
+        fig.background = None
+        return fig
+
+    @staticmethod
+    def overlays(fig):
+        """ Animated artists of 'fig', which are drawn on the cached background """
+        return [artist for ax in fig.axes for artist in ax.get_children() if artist.get_animated()]
+
+    @classmethod
+    def on_draw(cls, event):
+        """ After every full draw: cache background without overlays, then draw the overlays on it """
+        fig = event.canvas.figure
+        fig.background = event.canvas.copy_from_bbox(fig.bbox)
+        for artist in cls.overlays(fig):
+            fig.draw_artist(artist)
+        return
+
+    @classmethod
+    def redraw(cls, fig, blit=True):
         """
-        return fig1, fig2
+        Redraw 'fig': with 'blit' only the overlays are drawn on the cached background,
+        else (or without cached background) the whole figure.
+        Redraw time is logged (debug) at most every 'redraw_log_interval' seconds.
+        """
+        start = time.perf_counter()
+        if blit and getattr(fig, 'background', None) is not None:
+            fig.canvas.restore_region(fig.background)
+            for artist in cls.overlays(fig):
+                fig.draw_artist(artist)
+            fig.canvas.blit(fig.bbox)
+            mode = 'blit'
+        else:
+            fig.canvas.draw()
+            mode = 'full'
+        now = time.perf_counter()
+        if now - cls.last_redraw_log >= cls.redraw_log_interval:
+            cls.last_redraw_log = now
+            View.logger.debug(f"Redraw of '{fig.get_label()}' ({mode}): {(now - start) * 1000:.1f} ms")
+        return
+
+    def is_shown(self, fig):
+        """ True, if 'fig' is shown in the result window or in an open pyplot window """
+        if fig in self.figures.values():
+            return any(canvas.figure is fig for canvas in self.canvases.values())
+        return 'matplotlib.pyplot' in sys.modules and self.pyplot().fignum_exists(fig.number)
+
+    def show_result_window(self, filename="", number_of_entries=0, features=None):
+        """ Show persistent figures in the result window: created on first use, else updated in place """
+        if self.result_window is None:
+            self.make_result_window(filename, number_of_entries, features)
+            return
+        self.result_window['-STATUS_BAR-'].update(self.result_status(filename, number_of_entries))
+        rows = self.feature_rows(features)
+        self.result_window['-FEATURES-'].update(values=rows, num_rows=min(max(len(rows), 5), 25))
+        for name in self.canvas_keys:
+            if name in self.canvases:
+                self.redraw(self.figures[name], blit=False)
+            else:
+                self.attach_figure(name)
+        return
+
+    def attach_figure(self, name):
+        """ Embed persistent figure 'name' into its canvas of the result window (once per result window) """
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg  # The matplot tk canvas
+        if name not in self.figures:
+            return
+        canvas = FigureCanvasTkAgg(self.figures[name], self.result_window[self.canvas_keys[name]].TKCanvas)
+        canvas.get_tk_widget().pack(side='top', fill='both', expand=1)
+        self.canvases[name] = canvas
+        self.redraw(self.figures[name], blit=False)
+        return
+
+    @staticmethod
+    def mass_trace_label(mass, mass_interval):
+        return f"Counts for mass trace {mass} ± {mass_interval} Da."
+
+    @staticmethod
+    def time_trace_label(time, time_interval):
+        return f"Counts for minute trace {time} ± {time_interval} min."
+
+    @staticmethod
+    def plot_decimated(ax, x, y, **kwargs):
+        """
+        Plot series decimated to the pixel width of 'ax'. On zoom or pan the visible range
+        is decimated again from the full resolution series.
+        """
+        import numpy as np
+        downsample = View.downsample()
+        x, y = np.asarray(x), np.asarray(y)
+        if np.any(np.diff(x) < 0):  # decimation needs ascending x
+            return ax.plot(x, y, **kwargs)[0]
+        pixels = max(int(ax.bbox.width), 100)
+        line, = ax.plot(*downsample.decimate(x, y, pixels), **kwargs)
+        line.full_data = (x, y)  # full resolution series for zoom, pan and 'set_decimated_data'
+        if downsample.method != 'none':
+            ax.callbacks.connect('xlim_changed', lambda axes: View.redecimate(line))
+        return line
+
+    @staticmethod
+    def redecimate(line):
+        """ Decimate the visible range of 'line' again from its full resolution series """
+        x, y = line.full_data
+        x_min, x_max = line.axes.get_xlim()
+        line.set_data(*View.downsample().visible(x, y, x_min, x_max, max(int(line.axes.bbox.width), 100)))
+        return
+
+    @staticmethod
+    def set_decimated_data(line, x, y):
+        """ New series for an existing line of 'plot_decimated' without creating a new line """
+        import numpy as np
+        if hasattr(line, 'full_data') and View.downsample().method != 'none':
+            line.full_data = (np.asarray(x), np.asarray(y))
+            View.redecimate(line)
+        else:
+            line.set_data(x, y)
+        return
+
+    def update_trace(self, name, x, y, label):
+        """
+        Live update of trace 'name' ('mass' or 'time'): data of the existing line is replaced.
+        Only the overlays are blitted, if the trace fits into the y range, else the axes are rescaled.
+        Returns False if the trace is not plotted.
+        """
+        import numpy as np
+        line = self.trace_lines.get(name)
+        if line is None or not self.is_shown(line.figure):
+            return False
+        self.set_decimated_data(line, x, y)
+        line.set_label(label)
+        ax = line.axes
+        ax.legend(loc='upper left', ncol=1).set_animated(True)
+        y_min, y_max = ax.get_ylim()
+        fits = len(y) == 0 or (np.nanmin(y) >= y_min and np.nanmax(y) <= y_max)
+        if not fits:
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+        self.redraw(line.figure, blit=fits)
+        return True
+
+    def plot_heatmap(self, intensity_map, matplot=False):
+        """ Heatmap of the binned 'elution time x mass' intensity map (logarithmic color scale) """
+        if intensity_map is None:  # no heatmap for this dataset
+            if not matplot and 'heatmap' in self.figures:
+                self.figure('heatmap')
+            return None
+        import numpy as np
+        fig = self.figure('heatmap', matplot)
+        ax = fig.add_subplot()
+        image = ax.imshow(np.log10(intensity_map.matrix.T + 1), origin='lower', aspect='auto',
+                          extent=intensity_map.extent, cmap='viridis', interpolation='nearest')
+        fig.colorbar(image, ax=ax, label='log10(Counts + 1)')
+        ax.set_xlabel('Elution time [min]')
+        ax.set_ylabel('Ion masses [Da]')
+        ax.set_title(f'Intensity map ({intensity_map.time_bin:g} min x {intensity_map.mass_bin:g} Da per bin)')
+        return fig
+
+    @staticmethod
+    def get_target_list_filename():
+        """ Ask user for a file with target masses """
+        return sg.popup_get_file("Datei mit Zielmassen (eine Masse [, Toleranz] pro Zeile):",
+                                 title="Zielmassen-Liste",
+                                 file_types=(("Text-Dateien", "*.txt"),
+                                             ("CSV-Dateien", "*.csv"),
+                                             ("Alle Dateien", "*.*"),))
+
+    def plot_xics(self, elution_times, xics, labels):
+        """ Overlaid plot of all XICs of a target list """
+        fig = self.figure('xics', matplot=True)
+        ax = fig.add_subplot()
+        for xic, label in zip(xics, labels):
+            View.plot_decimated(ax, elution_times, xic, linewidth=1, label=label)
+        ax.set_xlabel('Elution time [min]')
+        ax.set_ylabel('Counts')
+        ax.set_title(f'Extracted ion chromatograms ({len(labels)} target masses)')
+        if len(labels) <= 20:
+            ax.legend(loc='upper left', ncol=1)
+        return fig
 
 
 def module_test():
@@ -12,14 +12,23 @@ elution time trace: 13.2 Min
 Command-Line arguments:
     -debug: Enable Debug (level 10) for console and log_file
     -log_file <filename>
+    -profile_startup: Report import time of every module and time until the main window is shown
+
+Batch mode (no GUI, e.g. on processing nodes), settings are read from config.ini:
+    -batch <directory or glob pattern>: analyze all files and write one Excel file per file
+    -mass <Da> -mass_interval <Da>: mass trace (optional)
+    -time <min> -time_interval <min>: elution time trace (optional)
+    -jobs <number>: number of processes (default: number of CPUs)
+    -output <folder>: folder for result files (default: folder of every file)
+    -format <xlsx|npz|csv|parquet|arrow>: format of result files (default: xlsx, parquet and arrow need pyarrow)
+    -scans: export all parsed scans too (not for xlsx)
 """
 
 import logging
 import sys
+import time
 
-from Controller import Controller
 from Constants import APP_TITLE, VERSION, SETTINGS_FILENAME
-from View import View
 
 
 __author__ = "Dr. Marek Pecyna, https://daten-entdecker.de/"
@@ -72,7 +81,69 @@ def setup_logging(console_level, file_level=None, log_file='running_explorer.log
     return logger
 
 
+def argument(name, default=None, convert=str):
+    """Value following command-line argument 'name', else 'default'"""
+    if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv):
+        return convert(sys.argv[sys.argv.index(name) + 1])
+    return default
+
+
+def profile_imports():
+    """
+    Measure the import time of every module imported from now on (like 'python -X importtime').
+    Returns: (timings, stop): dict {module: seconds}, filled during the imports, and function 'stop()',
+    which restores the original import function. Times are cumulative, i.e. include the imports of the module itself.
+    """
+    import builtins
+    timings = {}
+    original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:  # relative or already imported
+            return original_import(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            timings.setdefault(name, time.perf_counter() - start)
+
+    def stop():
+        builtins.__import__ = original_import
+
+    builtins.__import__ = timed_import
+    return timings, stop
+
+
+def report_imports(timings, startup_time, number=20):
+    """ Log the 'number' slowest imports and the total start-up time """
+    logging.log(25, f"Start-up time until main window: {startup_time:.3f} s, {len(timings)} modules imported.")
+    logging.log(25, f"{'Module':<40}{'Import [ms]':>12}  (cumulative)")
+    for name, seconds in sorted(timings.items(), key=lambda item: item[1], reverse=True)[:number]:
+        logging.log(25, f"{name:<40}{seconds * 1000:>12.1f}")
+    return
+
+
+def run_batch(pattern):
+    """ Headless batch mode: imports no GUI modules """
+    from Batch import Batch
+    logging.log(25, f'START {Batch.__module__}')
+    results = Batch.run(pattern,
+                        mass=argument('-mass', 0, float),
+                        mass_interval=argument('-mass_interval', 0.5, float),
+                        time=argument('-time', 0, float),
+                        time_interval=argument('-time_interval', 0.4, float),
+                        settings=Batch.load_settings(SETTINGS_FILENAME),
+                        jobs=argument('-jobs', None, int),
+                        output_folder=argument('-output'),
+                        export_format=argument('-format', 'xlsx'),
+                        export_scans='-scans' in sys.argv)
+    return 1 if not results or any(result.error for result in results) else 0
+
+
 def main():
+    start_time = time.perf_counter()
+    import_profile = profile_imports() if "-profile_startup" in sys.argv else None
+
     # Set logging defaults
     db_console = 30  # equals logging.WARNING
     db_file = None  # -> no logging in file
@@ -89,7 +160,9 @@ def main():
         if entry == "-log_file":
             if index + 1 < len(sys.argv):
                 log_file = sys.argv[index + 1]
-
+    batch = argument('-batch')
+    if batch or import_profile is not None:
+        db_console = min(db_console, 25)  # show report of batch or start-up profile
 
     # Start logger
     logger = setup_logging(db_console, db_file, log_file)
@@ -101,15 +174,29 @@ def main():
     for line in text:
         logging.log(25, line)
     logging.log(25, "_" * len(max(text)))
+    if batch:
+        if import_profile is not None:
+            import_profile[1]()  # start-up profile only for GUI mode
+        return run_batch(batch)
+
+    # GUI modules are imported only in GUI mode, pyplot and xlsxwriter only when needed
+    from View import View
+    splash = View.splash_window(f"{APP_TITLE} {VERSION}")
+    from Controller import Controller
     logging.log(25, f'START {Controller.__module__}')
     controller = Controller(settings_filename=SETTINGS_FILENAME)
     logging.log(25, f'START {View.__module__}')
     view = View(title=f"{APP_TITLE} {VERSION}", settings=controller.settings)
     controller.set_view(view)
+    splash.close()
+    if import_profile is not None:
+        timings, stop_profile = import_profile
+        report_imports(timings, time.perf_counter() - start_time)
+        stop_profile()  # later imports are not timed
     logging.log(25, f'EXECUTE {controller.__module__}.{controller.mainloop.__name__}...')
     controller.mainloop()
     logging.log(25, f'Program finished. Good Bye!')
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
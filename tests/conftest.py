@@ -0,0 +1,45 @@
+from pathlib import Path
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))  # modules of the program are imported from the project folder
+
+from Model.ParseCSV import ParseCSV  # noqa: E402
+
+
+@pytest.fixture
+def small_file():
+    """ Small HPLC-MS file: quoted fields and a trailing space (parsed line by line), short last line """
+    return ROOT / 'tests' / 'data' / 'small.ascii'
+
+
+@pytest.fixture
+def random_file(tmp_path):
+    """ Factory for HPLC-MS files with random scans: random_file(scans, seed=0, bad_lines=()) """
+    def make(scans=300, seed=0, bad_lines=()):
+        rng = np.random.default_rng(seed)
+        lines = []
+        for index in range(scans):
+            number = int(rng.integers(1, 25))
+            masses = np.round(rng.uniform(100, 1000, number), 1)
+            counts = rng.integers(1, 500, number)
+            pairs = ','.join(f"{mass} {count}" for mass, count in zip(masses, counts))
+            lines.append(f"{index * 0.02:.2f},0,ES+,1,0,0,100-1000,{number},{pairs}")
+        for line_num in bad_lines:  # line numbers counted from 1
+            lines[line_num - 1] = f"# comment in line {line_num}"
+        filename = tmp_path / f"random_{seed}.ascii"
+        filename.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        return filename
+
+    return make
+
+
+@pytest.fixture(autouse=True)
+def parse_settings(monkeypatch):
+    """ Every test starts with the program defaults of ParseCSV, changes are undone after the test """
+    for name in ParseCSV.settings_attributes + ('workers', 'min_parallel_bytes', 'progress', 'cancel_event'):
+        monkeypatch.setattr(ParseCSV, name, getattr(ParseCSV, name))
+    yield
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+import configparser
+import threading
+
+import numpy as np
+
+from Constants import DEFAULT_SETTINGS
+from Model.Cache import DatasetCache
+from Model.ParseCSV import ParseCSV
+from Model.ResultCache import ResultCache
+
+
+def settings(**changes):
+    """ Program defaults with 'changes' {section__item: value} """
+    config = configparser.ConfigParser()
+    config.read_dict(DEFAULT_SETTINGS)
+    for name, value in changes.items():
+        section, item = name.split('__')
+        config[section][item] = value
+    return config
+
+
+def test_settings_key_contains_only_parse_settings():
+    key = DatasetCache.settings_key(settings())
+    assert set(key) == {f"{section}.{item}" for section, items in ParseCSV.parse_settings.items() for item in items}
+
+
+def test_analysis_settings_do_not_change_key():
+    reference = DatasetCache.settings_key(settings())
+    for name, value in (('DATA__smoothing', 'none'), ('DATA__peak_lookahead', '5'), ('DATA__feature_count', '3'),
+                        ('DATA__xic_tolerance', '2'), ('CSV__workers', '4'), ('GUI__theme', 'Dark')):
+        assert DatasetCache.settings_key(settings(**{name: value})) == reference, name
+
+
+def test_parse_settings_change_key():
+    reference = DatasetCache.settings_key(settings())
+    for name, value in (('CSV__delimiter', ';'), ('DATA__mass_bin_width', '0.1'), ('DATA__count_dtype', 'uint32')):
+        assert DatasetCache.settings_key(settings(**{name: value})) != reference, name
+
+
+def test_cache_round_trip(small_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(DatasetCache, 'directory', str(tmp_path / 'cache'))
+    monkeypatch.setattr(DatasetCache, 'enabled', True)
+    key = DatasetCache.settings_key(settings())
+    parsed = DatasetCache.load_or_parse(small_file, key)
+    cached = DatasetCache.load(small_file, key)
+    np.testing.assert_array_equal(cached.counts, parsed.counts)
+    np.testing.assert_array_equal(cached.masses, parsed.masses)
+    np.testing.assert_array_equal(cached.offsets, parsed.offsets)
+    assert DatasetCache.load(small_file, DatasetCache.settings_key(settings(CSV__decimal=','))) is None
+
+
+def test_result_cache_invalidate_of_one_dataset(small_file, monkeypatch):
+    monkeypatch.setattr(ResultCache, 'entries', OrderedDict())
+    monkeypatch.setattr(ResultCache, 'size', 0)
+    first, second = ParseCSV.read_csv_columnar(small_file), ParseCSV.read_csv_columnar(small_file)
+
+    def compute(dataset, name):
+        return ResultCache.get_or_compute(dataset, name, (), lambda: np.asarray(dataset.counts, dtype=np.float64))
+
+    threads = [threading.Thread(target=compute, args=(dataset, name))
+               for dataset in (first, second) for name in ('a', 'b', 'c') for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(ResultCache.entries) == 6
+    ResultCache.invalidate(first)
+    assert {key[0] for key in ResultCache.entries} == {second.id}
+    assert ResultCache.size == sum(size for _, size in ResultCache.entries.values()) == 3 * second.counts.size * 8
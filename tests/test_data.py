@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from Model.ChunkStore import ChunkStore
+from Model.Data import Data
+from Model.Dataset import Dataset
+from Model.ParseCSV import ParseCSV
+
+
+def chunks_of(dataset, scans_per_chunk):
+    """ Stream of Datasets with 'scans_per_chunk' scans each """
+    return [dataset.scans(start, start + scans_per_chunk) for start in range(0, len(dataset), scans_per_chunk)]
+
+
+@pytest.fixture
+def lines_and_dataset(random_file):
+    lines = ParseCSV.read_csv_file(random_file(scans=300, seed=11))
+    return lines, Dataset.from_lines(lines)
+
+
+@pytest.mark.parametrize('scans_per_chunk', [None, 1, 7, 64])
+def test_summary_columnar_equals_lines(lines_and_dataset, scans_per_chunk):
+    lines, dataset = lines_and_dataset
+    reference = Data.get_total_counts_lines(lines)
+    data = dataset if scans_per_chunk is None else chunks_of(dataset, scans_per_chunk)
+    summary = Data.get_total_counts_columnar(data)
+    for field in reference._fields:
+        np.testing.assert_array_equal(getattr(summary, field), getattr(reference, field), err_msg=field)
+
+
+def test_elution_time_trace_of_chunks_equals_lines(lines_and_dataset):
+    lines, dataset = lines_and_dataset
+    reference = Data.elution_time_trace(lines, time=3.0, time_interval=1.0)
+    trace = Data.elution_time_trace(iter(chunks_of(dataset, 13)), time=3.0, time_interval=1.0)
+    assert np.sum(reference) > 0
+    np.testing.assert_array_equal(trace, reference)
+
+
+def peakdetect_reference(y_axis, x_axis, lookahead, delta):
+    """ Loop over every point of the signal, the algorithm of 'Data.peakdetect' before vectorization """
+    max_peaks, min_peaks, dump = [], [], []
+    length = len(y_axis)
+    _min, _max = np.inf, -np.inf
+    min_pos, max_pos = np.nan, np.nan
+    for x, y in zip(x_axis[:-lookahead], y_axis[:-lookahead]):
+        if y > _max:
+            _max, max_pos = y, x
+        if y < _min:
+            _min, min_pos = y, x
+    for index, (x, y) in enumerate(zip(x_axis[:-lookahead], y_axis[:-lookahead])):
+        if y > _max:
+            _max, max_pos = y, x
+        if y < _min:
+            _min, min_pos = y, x
+        if y < _max - delta and _max != np.inf:
+            if y_axis[index:index + lookahead].max() < _max:
+                max_peaks.append([max_pos, _max])
+                dump.append(True)
+                _max, _min = np.inf, np.inf
+                if index + lookahead >= length:
+                    break
+                continue
+        if y > _min + delta and _min != -np.inf:
+            if y_axis[index:index + lookahead].min() > _min:
+                min_peaks.append([min_pos, _min])
+                dump.append(False)
+                _min, _max = -np.inf, -np.inf
+                if index + lookahead >= length:
+                    break
+    if dump:
+        (max_peaks if dump[0] else min_peaks).pop(0)
+    return [max_peaks, min_peaks]
+
+
+def signals():
+    rng = np.random.default_rng(7)
+    x = np.linspace(0, 30, 600)
+    yield 'random', rng.normal(100, 20, 500)
+    yield 'random_integers', rng.integers(0, 5, 400).astype(float)
+    yield 'gaussians', np.exp(-(x - 8) ** 2) * 500 + np.exp(-(x - 20) ** 2 / 4) * 300 + rng.normal(0, 5, len(x))
+    yield 'plateaus', np.repeat(rng.integers(0, 10, 60), rng.integers(1, 12, 60)).astype(float)
+    yield 'constant', np.full(50, 3.0)
+    yield 'short', np.array([1.0, 5.0, 2.0, 7.0, 1.0, 3.0])
+
+
+@pytest.mark.parametrize('name, y', list(signals()))
+@pytest.mark.parametrize('lookahead', [1, 3, 10, 49, 50, 600])
+@pytest.mark.parametrize('delta', [0, 1.0, 30.0])
+def test_peakdetect_equals_reference_loop(name, y, lookahead, delta):
+    x = np.arange(len(y)) * 0.05
+    expected = peakdetect_reference(y, x, lookahead, delta)
+    assert Data.peakdetect(y, x, lookahead=lookahead, delta=delta) == expected
+    assert Data.peakdetect_batch(np.vstack([y, y[::-1]]), x, lookahead=lookahead, delta=delta) \
+        == [expected, peakdetect_reference(y[::-1], x, lookahead, delta)]
+    if lookahead >= len(y):
+        assert expected == [[], []]
+
+
+def test_xics_of_chunk_store(lines_and_dataset, tmp_path):
+    _, dataset = lines_and_dataset
+    store = ChunkStore.write(tmp_path / 'store', chunks_of(dataset, 70))
+    masses, tolerances = [150.0, 500.0, 999.0], [0.5, 2.0, 1.0]
+    np.testing.assert_array_equal(store.elution_times, dataset.elution_times)
+    np.testing.assert_array_equal(Data.extract_xics(store, masses, tolerances),
+                                  Data.extract_xics(dataset, masses, tolerances))
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from Model.ChunkStore import ChunkStore
+from Model.Data import Data
+from Model.Dataset import Dataset, MassBinning
+from Model.ParseCSV import ParseCSV
+
+
+@pytest.fixture
+def binned(small_file):
+    return ParseCSV.read_csv_columnar(small_file).binned(MassBinning(width=0.01))
+
+
+def test_mass_bins_and_masses_are_separate_arguments(binned):
+    dataset = Dataset(binned.elution_times, binned.offsets, None, binned.counts,
+                      mass_binning=binned.mass_binning, mass_bins=binned.mass_bins)
+    np.testing.assert_array_equal(dataset.mass_bins, binned.mass_bins)
+    # Integer masses are masses, not bins
+    masses = np.rint(binned.masses).astype(np.int64)
+    from_integers = Dataset(binned.elution_times, binned.offsets, masses, binned.counts,
+                            mass_binning=binned.mass_binning)
+    np.testing.assert_array_equal(from_integers.mass_bins, binned.mass_binning.to_bins(masses))
+    with pytest.raises(ValueError):
+        Dataset(binned.elution_times, binned.offsets, None, binned.counts, mass_bins=binned.mass_bins)
+
+
+def test_bin_centers_are_computed_once(binned):
+    assert binned.masses is binned.masses
+    np.testing.assert_array_equal(binned.masses, binned.mass_binning.centers(binned.mass_bins))
+
+
+@pytest.mark.parametrize('make, scans', [
+    (lambda dataset: dataset.scans(2, 7), slice(2, 7)),
+    (lambda dataset: Dataset.concatenate([dataset.scans(0, 4), dataset.scans(4, None)]), slice(0, None)),
+    (lambda dataset: dataset.astype(count_dtype='uint32', offset_dtype='int32'), slice(0, None))])
+def test_binned_datasets_keep_their_bins(binned, make, scans):
+    dataset = make(binned)
+    start, stop, _ = scans.indices(len(binned))
+    assert dataset.mass_binning == binned.mass_binning
+    np.testing.assert_array_equal(dataset.mass_bins, binned.mass_bins[binned.offsets[start]:binned.offsets[stop]])
+
+
+def test_chunk_store_of_binned_dataset(binned, tmp_path):
+    store = ChunkStore.write(tmp_path / 'store', [binned.scans(0, 5), binned.scans(5, None)])
+    chunks = [store.chunk(number) for number in range(len(store.chunk_info))]
+    np.testing.assert_array_equal(np.concatenate([chunk.mass_bins for chunk in chunks]), binned.mass_bins)
+    np.testing.assert_array_equal(np.concatenate([chunk.masses for chunk in chunks]), binned.masses)
+
+
+def test_compact_summary_within_float32_precision(random_file):
+    """
+    Integer counts stay exact as uint32 (sums in float64), every float32 mass deviates by at most 2**-24 (relative),
+    so do sums, maxima and minima of masses. Ion masses below 1000 Da deviate by less than 1e-4 Da.
+    """
+    dataset = ParseCSV.read_csv_columnar(random_file(scans=400, seed=17))
+    compact = dataset.astype('float32', 'uint32', 'int32')
+    assert compact.nbytes < 0.6 * dataset.nbytes
+    deviations = Data.compare_summaries(Data.get_total_counts(dataset), Data.get_total_counts(compact))
+    for field in ('total_counts_per_time', 'number_of_masses_per_time', 'total_counts_per_mass'):
+        assert deviations[field] == 0, field
+    for field in ('total_masses_per_time', 'max_mass_per_time', 'min_mass_per_time'):
+        assert deviations[field] <= 2 ** -24, field
+    assert deviations['ion_masses'] < 1e-4
+
+
+def test_astype_of_binned_dataset(binned):
+    compact = binned.astype(count_dtype='float32', offset_dtype='int32')
+    np.testing.assert_array_equal(compact.mass_bins, binned.mass_bins)
+    with pytest.raises(ValueError):
+        binned.astype('float32')
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from Model.Dataset import Dataset
+from Model.Export import Export
+from Model.ParseCSV import ParseCSV
+
+
+def written_arrays(tables, tmp_path, export_format='npz'):
+    """ {table/column: array} of the files written in 'export_format' """
+    filenames = Export.write(tables, tmp_path / 'result', export_format)
+    if export_format == 'npz':
+        with np.load(filenames[0]) as archive:
+            return {name[:-len('.npy')] if name.endswith('.npy') else name: archive[name]
+                    for name in archive.files if name != 'metadata'}
+    import pyarrow.parquet as pq
+    return {f"{table.name}/{column}": pq.read_table(filename).column(column).to_numpy()
+            for table, filename in zip(tables, filenames) for column in table.columns}
+
+
+@pytest.mark.parametrize('scans', [0, 9])
+def test_npz_keeps_column_dtypes(small_file, tmp_path, scans):
+    dataset = ParseCSV.read_csv_columnar(small_file).scans(0, scans).astype('float32', 'uint32', 'int32')
+    tables = [Export.array_table('numbers', {'index': np.arange(scans, dtype=np.int32)}),
+              Export.scan_table(dataset)]
+    arrays = written_arrays(tables, tmp_path)
+    assert arrays['numbers/index'].dtype == np.int32
+    assert arrays['scans/mass'].dtype == np.float32
+    assert arrays['scans/count'].dtype == np.uint32
+    assert len(arrays['scans/mass']) == dataset.number_of_points
+    np.testing.assert_array_equal(arrays['scans/mass'], dataset.masses)
+
+
+def test_empty_tables_in_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    dataset = Dataset([], [0], [], []).astype('float32', 'uint32', 'int32')
+    arrays = written_arrays([Export.scan_table(dataset)], tmp_path, 'parquet')
+    assert arrays['scans/mass'].dtype == np.float32
+    assert arrays['scans/count'].dtype == np.uint32
@@ -0,0 +1,106 @@
+import csv
+import logging
+
+import numpy as np
+import pytest
+
+from Model.Dataset import Dataset
+from Model.ParseCSV import ParseCSV
+
+
+def assert_same_dataset(dataset, reference):
+    np.testing.assert_array_equal(dataset.elution_times, reference.elution_times)
+    np.testing.assert_array_equal(dataset.offsets, reference.offsets)
+    np.testing.assert_array_equal(dataset.masses, reference.masses)
+    np.testing.assert_array_equal(dataset.counts, reference.counts)
+
+
+def tuple_reference(filename):
+    """ Dataset of the tuple parser (reference for the columnar engine) """
+    return Dataset.from_lines(ParseCSV.read_csv_file(filename))
+
+
+def test_columnar_equals_tuple_parser(small_file):
+    dataset = ParseCSV.read_csv_columnar(small_file)
+    reference = tuple_reference(small_file)
+    assert len(dataset) == 9
+    assert_same_dataset(dataset, reference)
+
+
+def test_columnar_equals_tuple_parser_with_small_blocks(small_file, monkeypatch):
+    monkeypatch.setattr(ParseCSV, 'max_chunk_mb', 1)
+    monkeypatch.setattr(ParseCSV, 'memory_factor', 1024 * 1024 // 100)  # text blocks of about 100 characters
+    assert_same_dataset(ParseCSV.read_csv_columnar(small_file), tuple_reference(small_file))
+
+
+def test_random_file(random_file):
+    filename = random_file(scans=500, seed=3)
+    assert_same_dataset(ParseCSV.read_csv_columnar(filename), tuple_reference(filename))
+
+
+def test_line_fallback_of_parse_block(small_file):
+    """ Lines with quotes or trailing spaces do not match the bulk pattern and are parsed one by one """
+    lines = small_file.read_text().split('\n')
+    pattern = ParseCSV._data_pattern()
+    fallback = [line for line in lines
+                if '"' in line or not pattern.fullmatch(line.split(',', ParseCSV.col_data_starts)[-1])]
+    assert len(fallback) == 3
+    block, errors = ParseCSV.parse_block(lines)
+    assert errors == []
+    assert_same_dataset(block, tuple_reference(small_file))
+
+
+def test_comment_lines_are_errors_like_in_tuple_parser(small_file):
+    lines = small_file.read_text().split('\n')
+    lines.insert(0, '# exported by MassLynx')
+    lines.insert(5, 'retention time,unused,ionisation')
+    block, errors = ParseCSV.parse_block(lines, first_line_num=1)
+    reference = [line_num for line_num, row in enumerate(csv.reader(lines), start=1)
+                 if not ParseCSV.make_correct_format_hplc_ms(line_num, row)]
+    assert errors == reference == [1, 6]
+    assert len(block) == 9
+
+
+@pytest.mark.parametrize('reader', [ParseCSV.read_csv_file, ParseCSV.read_csv_columnar])
+def test_file_with_comment_lines_is_rejected(random_file, reader):
+    assert reader(random_file(scans=50, bad_lines=(1, 20))) is None
+
+
+def test_decimal_comma(small_file, tmp_path, monkeypatch):
+    reference = tuple_reference(small_file)
+    text = small_file.read_text().replace(',', ';').replace('.', ',')
+    filename = tmp_path / 'decimal_comma.ascii'
+    filename.write_text(text)
+    monkeypatch.setattr(ParseCSV, 'delimiter', ';')
+    monkeypatch.setattr(ParseCSV, 'decimal', ',')
+    assert_same_dataset(ParseCSV.read_csv_columnar(filename), reference)
+
+
+def parallel_settings(monkeypatch):
+    """ Two worker processes for every file size, small blocks (more byte ranges than workers) """
+    monkeypatch.setattr(ParseCSV, 'workers', 2)
+    monkeypatch.setattr(ParseCSV, 'min_parallel_bytes', 0)
+    monkeypatch.setattr(ParseCSV, 'max_chunk_mb', 1)
+    monkeypatch.setattr(ParseCSV, 'memory_factor', 1024 * 1024 // 2000)  # byte ranges of about 2000 bytes
+
+
+def test_parallel_equals_serial(random_file, monkeypatch, caplog):
+    filename = random_file(scans=400, seed=5)
+    serial = ParseCSV.read_csv_columnar(filename)
+    parallel_settings(monkeypatch)
+    caplog.set_level(logging.INFO)
+    assert_same_dataset(ParseCSV.read_csv_columnar(filename), serial)
+    message = next(record.getMessage() for record in caplog.records if 'Parallel parsing' in record.getMessage())
+    assert int(message.split('(')[1].split()[0]) > 2 * 4  # more byte ranges than 4 per worker (block size)
+
+
+def test_parallel_errors_with_serial_line_numbers(random_file, monkeypatch, caplog):
+    filename = random_file(scans=400, seed=6, bad_lines=(1, 123, 400))
+    assert ParseCSV.read_csv_columnar(filename) is None
+    serial = [record.getMessage() for record in caplog.records if record.levelname == 'CRITICAL']
+    caplog.clear()
+    parallel_settings(monkeypatch)
+    assert ParseCSV.read_csv_columnar(filename) is None
+    parallel = [record.getMessage() for record in caplog.records if record.levelname == 'CRITICAL']
+    assert serial == parallel
+    assert serial[0].endswith('errors in 3 lines: [1, 123, 400]')
@@ -0,0 +1,28 @@
+from pathlib import Path
+import configparser
+
+from Constants import DEFAULT_SETTINGS
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def settings_sources():
+    """ (name, configparser) of the program defaults and of config.ini """
+    defaults = configparser.ConfigParser()
+    defaults.read_dict(DEFAULT_SETTINGS)
+    config = configparser.ConfigParser()
+    config.read(ROOT / 'config.ini', encoding='utf-8')
+    return [('defaults', defaults), ('config.ini', config)]
+
+
+def test_feature_detection_is_opt_in():
+    for source, settings in settings_sources():
+        assert settings['DATA'].getboolean('feature_detection') is False, source
+
+
+def test_no_item_name_repeats_across_sections():
+    # Settings window keys its elements by item name only ('-ITEM-')
+    for source, settings in settings_sources():
+        items = [item for section in settings.sections() for item in settings[section]]
+        repeated = {item for item in items if items.count(item) > 1}
+        assert not repeated, (source, repeated)
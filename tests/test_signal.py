@@ -0,0 +1,17 @@
+from pathlib import Path
+import configparser
+
+from Constants import DEFAULT_SETTINGS
+from Model.Signal import SignalConditioner
+
+
+def test_conditioning_is_opt_in():
+    """ Program defaults and config.ini: raw counts, peak detection as before smoothing was added """
+    for source in ('defaults', 'config.ini'):
+        settings = configparser.ConfigParser()
+        if source == 'defaults':
+            settings.read_dict(DEFAULT_SETTINGS)
+        else:
+            settings.read(Path(__file__).resolve().parent.parent / 'config.ini', encoding='utf-8')
+        assert SignalConditioner.from_settings(settings) is None, source
+        assert settings['DATA'].getint('peak_lookahead') == 50, source
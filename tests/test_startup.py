@@ -0,0 +1,34 @@
+from pathlib import Path
+import builtins
+import subprocess
+import sys
+
+import peakexplorer
+from Model.Export import Export
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_gui_modules_import_no_model():
+    """ numpy and the Model modules are imported on first use, not on program start """
+    code = "import sys, Controller, View; print(sorted(m for m in ('numpy', 'Model') if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
+
+
+def test_export_formats_of_view_and_export_agree():
+    from View import View
+    assert View.export_formats() == Export.available_formats()
+
+
+def test_profile_imports_restores_import():
+    original_import = builtins.__import__
+    sys.modules.pop('tabnanny', None)
+    timings, stop = peakexplorer.profile_imports()
+    try:
+        assert builtins.__import__ is not original_import
+        __import__('tabnanny')  # timed by the profile
+    finally:
+        stop()
+    assert builtins.__import__ is original_import
+    assert 'tabnanny' in timings